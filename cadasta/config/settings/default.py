@@ -587,11 +587,61 @@ IMPORTERS = {
     'csv': 'organization.importers.csv.CSVImporter',
     'xls': 'organization.importers.xls.XLSImporter'
 }
+# Number of imported entities inserted at once
+IMPORT_BATCH_SIZE = 1000
+# Number of rows committed at once by import tasks. An interrupted import task
+# resumes after the last committed chunk.
+IMPORT_CHUNK_SIZE = 5000
+# Number of workers parsing the geometries of imported rows. None starts one
+# per CPU and 0 parses geometries in the importing process.
+IMPORT_GEOMETRY_WORKERS = None
+# Number of rows the import wizard validates before it schedules an import.
+# The import task validates all rows before it imports the first one.
+IMPORT_WIZARD_VALIDATION_ROWS = 1000
 
 ES_SCHEME = 'http'
 ES_HOST = 'localhost'
 ES_PORT = '9200'
 ES_MAX_RESULTS = 10000
+# Per-process connection pool and timeouts (in seconds) for the ES client.
+# Size ES_POOL_SIZE against the number of threads per uwsgi process.
+ES_POOL_SIZE = 10
+ES_POOL_BLOCK = False
+ES_CONNECT_TIMEOUT = 3
+ES_TIMEOUT = 10
+# How long result pages are kept to be served as stale results while ES is
+# unavailable.
+ES_FALLBACK_CACHE_TIMEOUT = 60 * 60
+# Rendered result pages are cached under the project index timestamp. The
+# timestamp itself is cached for ES_INDEX_TIMESTAMP_CACHE_TIMEOUT, which bounds
+# how long pages from before a reindex can still be served.
+ES_RESULTS_CACHE_TIMEOUT = 60 * 10
+ES_INDEX_TIMESTAMP_CACHE_TIMEOUT = 60
+
+# Resource files are fetched concurrently when exporting project data. Files
+# larger than EXPORT_RESOURCE_MAX_SIZE (in bytes) are left out of the export.
+EXPORT_RESOURCE_WORKERS = 8
+EXPORT_RESOURCE_RETRIES = 3
+EXPORT_RESOURCE_TIMEOUT = 30
+EXPORT_RESOURCE_MAX_SIZE = 500 * 1024 * 1024
+# Number of exported entities between two progress updates of export tasks
+EXPORT_PROGRESS_INTERVAL = 1000
+
+# How long the options of a questionnaire are cached. Questionnaires do not
+# change once created, so this only bounds the memory used by old ones.
+QUESTIONNAIRE_CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Whether a user may submit data to a project is cached per user and project.
+# The cache is cleared when the user's organization or project role changes;
+# the timeout bounds how long other policy changes, such as granting or
+# revoking superuser, take to apply to submissions.
+CONTRIBUTOR_PERMISSION_CACHE_TIMEOUT = 60 * 10
+
+# Attachments of ODK submissions are spooled to MEDIA_ROOT/temp and uploaded
+# by a background task, which is retried on failure every
+# XFORM_ATTACHMENT_RETRY_DELAY seconds.
+XFORM_ATTACHMENT_MAX_RETRIES = 10
+XFORM_ATTACHMENT_RETRY_DELAY = 60
 
 TOTP_TOKEN_VALIDITY = 3600
 TOTP_DIGITS = 6
@@ -1,4 +1,5 @@
 from kombu.exceptions import OperationalError
+from requests.exceptions import RequestException
 
 from .breaker import CircuitBreaker
 
@@ -6,3 +7,7 @@ from .breaker import CircuitBreaker
 celery = CircuitBreaker(
     'celery', fail_max=1,
     expected_errors=(OperationalError,))
+
+es = CircuitBreaker(
+    'es', fail_max=5, reset_timeout=30,
+    expected_errors=(RequestException,))
@@ -1,11 +1,11 @@
 from django.forms import Form, ModelForm, MultipleChoiceField, CharField
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.utils.translation import get_language
 from jsonattrs.mixins import template_xlang_labels
 from jsonattrs.forms import form_field_from_name
 
 from core.validators import sanitize_string
+from questionnaires.catalog import get_option_catalog
 from questionnaires.models import Questionnaire, Question, QuestionOption
 from .mixins import SchemaSelectorMixin
 from .widgets import XLangSelect, XLangSelectMultiple
@@ -16,24 +16,8 @@ def get_types(question_name, default, questionnaire_id=None,
               include_labels=False):
     types = []
     if questionnaire_id:
-        try:
-            question = Question.objects.get(
-                name=question_name,
-                questionnaire=questionnaire_id)
-        except Question.DoesNotExist:
-            pass
-        else:
-            options = QuestionOption.objects.filter(
-                question=question).values_list('name', 'label_xlat')
-
-            lang = get_language()
-            default_lang = question.questionnaire.default_language
-
-            for key, label in options:
-                if isinstance(label, dict):
-                    label = label.get(lang, label.get(default_lang))
-
-                types.append((key, label))
+        types = list(get_option_catalog(
+            questionnaire_id).get_labels(question_name))
 
     if not types:
         types = default
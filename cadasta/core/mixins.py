@@ -3,12 +3,19 @@ from collections import OrderedDict
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
 from django.core.urlresolvers import reverse
 from django.shortcuts import redirect
 from django.utils.translation import gettext as _
 from jsonattrs.models import Schema, compose_schemas
 from tutelary import mixins
 
+from .util import random_id
+
+# Compiled schema attributes of projects kept in process:
+# {project ID: (questionnaire ID, version, attributes)}
+_project_attributes = {}
+
 
 class PermissionRequiredMixin(mixins.PermissionRequiredMixin):
 
@@ -66,9 +73,60 @@ def update_permissions(permission, obj=None):
     return set_permissions
 
 
+def get_schema_version_cache_key(project_id):
+    return 'core:schema-attrs-version:{}'.format(project_id)
+
+
+def get_schema_attrs_cache_key(project_id, questionnaire_id, version):
+    return 'core:schema-attrs:{}:{}:{}'.format(
+        project_id, questionnaire_id, version)
+
+
 class SchemaSelectorMixin():
 
     def get_attributes(self, project):
+        """
+        Returns the schema attributes of each model of the project, by
+        selector. They are compiled once per project and questionnaire, and
+        kept in process and in the jsonattrs cache; the returned dicts are
+        shared and must not be changed.
+
+        A version of the compiled attributes is kept in the jsonattrs cache
+        too, which tells whether the attributes kept in process are current.
+        jsonattrs clears its cache whenever a schema is saved or an attribute
+        created, and the questionnaires app whenever an attribute is changed
+        or deleted; a new questionnaire changes the key of the attributes.
+        """
+        if not project.id:
+            return self._compile_attributes(project)
+
+        cache = caches['jsonattrs']
+        version_key = get_schema_version_cache_key(project.id)
+        version = cache.get(version_key)
+        if version is not None:
+            cached = _project_attributes.get(project.id)
+            if cached and cached[:2] == (project.current_questionnaire,
+                                         version):
+                return cached[2]
+            attributes = cache.get(get_schema_attrs_cache_key(
+                project.id, project.current_questionnaire, version))
+        else:
+            version = random_id()
+            attributes = None
+
+        if attributes is None:
+            attributes = self._compile_attributes(project)
+            cache.set_many({
+                version_key: version,
+                get_schema_attrs_cache_key(
+                    project.id, project.current_questionnaire, version
+                ): attributes,
+            })
+        _project_attributes[project.id] = (
+            project.current_questionnaire, version, attributes)
+        return attributes
+
+    def _compile_attributes(self, project):
         content_type_to_selectors = self._get_content_types_to_selectors()
 
         attributes_for_models = {}
@@ -128,6 +186,6 @@ class SchemaSelectorMixin():
         for k, v in settings.JSONATTRS_SCHEMA_SELECTORS.items():
             a, m = k.split('.')
             content_type_to_selectors[
-                ContentType.objects.get(app_label=a, model=m)
+                ContentType.objects.get_by_natural_key(a, m)
             ] = v
         return content_type_to_selectors
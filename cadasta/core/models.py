@@ -1,7 +1,7 @@
 import itertools
 import math
 from core.util import slugify
-from django.db import models
+from django.db import IntegrityError, models, router, transaction
 
 from .util import random_id, ID_FIELD_LENGTH
 
@@ -13,19 +13,31 @@ class RandomIDModel(models.Model):
         abstract = True
 
     def save(self, *args, **kwargs):
-        if not self.id:
-            kwargs['force_insert'] = True
-
-            ok = False
-            while not ok:
-                self.id = random_id()
-
-                if not type(self).objects.filter(pk=self.id).exists():
-                    ok = True
-                    super(RandomIDModel, self).save(*args, **kwargs)
-
-        else:
+        """
+        Inserts new instances with a random ID, without checking that the ID
+        is free first: IDs are drawn from a space of 120 bits, so a taken ID
+        is not expected in practice. Outside of a transaction, a new ID is
+        tried if the insert fails because the ID is taken anyway. Inside a
+        transaction, the failed insert would abort the transaction, so the
+        IntegrityError is raised.
+        """
+        if self.id:
             super(RandomIDModel, self).save(*args, **kwargs)
+            return
+
+        kwargs['force_insert'] = True
+        using = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self)
+        while True:
+            self.id = random_id()
+            try:
+                super(RandomIDModel, self).save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if (transaction.get_connection(using).in_atomic_block or
+                        not type(self)._default_manager.using(using).filter(
+                            pk=self.id).exists()):
+                    raise
 
 
 class SlugModel:
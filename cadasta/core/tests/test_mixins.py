@@ -15,6 +15,7 @@ from questionnaires.models import Questionnaire
 from spatial.views.default import LocationsAdd
 from tutelary.models import assign_user_policies
 
+from .. import mixins as core_mixins
 from ..mixins import SchemaSelectorMixin
 
 
@@ -223,3 +224,35 @@ class SchemaSelectorMixinTest(UserTestCase, FileStorageTestCase, TestCase):
         assert len(individual_party_attrs) == 4
         in_party_attr = individual_party_attrs.get('gender')
         assert in_party_attr.name == 'gender'
+
+    def test_get_attributes_is_cached(self):
+        project_attrs = SchemaSelectorMixin().get_attributes(self.project)
+        with self.assertNumQueries(0):
+            cached = SchemaSelectorMixin().get_attributes(self.project)
+        assert cached is project_attrs
+
+        # Other processes read the attributes from the cache
+        core_mixins._project_attributes.clear()
+        with self.assertNumQueries(0):
+            cached = SchemaSelectorMixin().get_attributes(self.project)
+        assert cached is not project_attrs
+        assert cached['party.party'].keys() == (
+            project_attrs['party.party'].keys())
+
+    def test_get_attributes_after_attribute_change(self):
+        mixin = SchemaSelectorMixin()
+        su_attr = mixin.get_attributes(
+            self.project)['spatial.spatialunit']['DEFAULT']['quality']
+        attribute = Attribute.objects.get(pk=su_attr.pk)
+        attribute.required = not su_attr.required
+        attribute.save()
+
+        su_attr = mixin.get_attributes(
+            self.project)['spatial.spatialunit']['DEFAULT']['quality']
+        assert su_attr.required == attribute.required
+
+    def test_get_attributes_of_new_questionnaire(self):
+        mixin = SchemaSelectorMixin()
+        assert mixin.get_attributes(self.project)['spatial.spatialunit']
+        self.project.current_questionnaire = 'abc'
+        assert mixin.get_attributes(self.project)['spatial.spatialunit'] == {}
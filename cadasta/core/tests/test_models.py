@@ -1,7 +1,10 @@
-import random
+from unittest.mock import patch
+
+from django.db import IntegrityError, transaction
 from django.db.models import SlugField, CharField, Model
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from ..models import RandomIDModel, SlugModel
+from ..util import ID_FIELD_LENGTH, alphabet, random_id, random_ids
 
 
 class MyRandomIdModel(RandomIDModel):
@@ -17,14 +20,50 @@ class RandomIDModelTest(TestCase):
         instance.save()
         assert instance.id is not None
 
+    def test_duplicate_ids_in_transaction(self):
+        instance1 = MyRandomIdModel()
+        instance1.save()
+        with patch('core.models.random_id', return_value=instance1.id):
+            instance2 = MyRandomIdModel()
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    instance2.save()
+        assert MyRandomIdModel.objects.count() == 1
+
+    def test_save_without_id_check(self):
+        instance = MyRandomIdModel()
+        with self.assertNumQueries(1):
+            instance.save()
+
+
+class RandomIDModelAutocommitTest(TransactionTestCase):
+
     def test_duplicate_ids(self):
-        random.seed(a=10)
         instance1 = MyRandomIdModel()
         instance1.save()
-        random.seed(a=10)
-        instance2 = MyRandomIdModel()
-        instance2.save()
-        assert instance1.id != instance2.id
+        with patch('core.models.random_id',
+                   side_effect=[instance1.id, 'abc']) as random_id:
+            instance2 = MyRandomIdModel()
+            instance2.save()
+        assert random_id.call_count == 2
+        assert instance2.id == 'abc'
+        assert MyRandomIdModel.objects.count() == 2
+
+
+class RandomIDTest(TestCase):
+
+    def test_random_id(self):
+        id = random_id()
+        assert len(id) == ID_FIELD_LENGTH
+        assert set(id) <= set(alphabet)
+        assert random_id() != id
+
+    def test_random_ids(self):
+        ids = random_ids(100)
+        assert len(ids) == len(set(ids)) == 100
+        for id in ids:
+            assert len(id) == ID_FIELD_LENGTH
+            assert set(id) <= set(alphabet)
 
 
 class MySlugModel(SlugModel, Model):
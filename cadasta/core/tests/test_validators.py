@@ -1,7 +1,37 @@
+import timeit
+from unittest.mock import patch
+
 import pytest
+from bs4 import BeautifulSoup
 from django.test import TestCase
 from django.utils.translation import gettext as _
-from ..validators import validate_json, JsonValidationError, sanitize_string
+from ..validators import (validate_json, JsonValidationError, sanitize_string,
+                          emoji_characters, emojis, macros)
+
+
+def sanitize_string_reference(value):
+    """The former implementation of `sanitize_string()`, which parses every
+    string."""
+    if not value or not isinstance(value, str):
+        return True
+
+    return (not bool(BeautifulSoup(value, 'html.parser').find()) and
+            not emojis.match(value) and
+            not macros.match(value))
+
+
+SANITIZE_CORPUS = [
+    None, 2, '', ' ', 'text', 'Me & you', '&amp;', '&lt;b&gt;', ':what',
+    '大家好', 'ф', 'Ξ', 'ß', 'œ', 'İ', 'עזרא ברש', 'সুরুজ্জামান মন্ডল',
+    '=1+1', '+1+1', '-1+1', '@1+1', ' =1', 'a=1', 'a-b@c+d',
+    '🍺', 'te🍺xt', '🦄', '©', 'a®b', '™', '\u3030', '\u00a8', '\u00aa',
+    'x\n🍺', '🍺\nx', 'a\r\n🍺', 'a\r🍺', '\n🍺',
+    '<script>', '<script>blah</script>', '</b>', '<b', '<br/>', 'a<b>c',
+    '<a href="x">', '\n<b>', '<b\n>', 'a < b', '<3', '<', '<<', '<a<b>',
+    '<!-- comment -->', '<!DOCTYPE html>', '<?xml version="1.0"?>',
+    '<![CDATA[x]]>', '< b>', '<1>', '<-b>', '<_b>', '<é>', '<b>🍺</b>',
+    'POINT (30 10)', 'SRID=4326;POINT (30 10)', '0101000020E6100000',
+]
 
 
 class ValidationTest(TestCase):
@@ -91,3 +121,30 @@ class ValidationTest(TestCase):
         assert sanitize_string('te🍺xt') is False
         assert sanitize_string('Me & you') is True
         assert sanitize_string('🦄') is False
+
+    def test_sanitize_string_matches_reference(self):
+        for value in SANITIZE_CORPUS:
+            assert sanitize_string(value) is sanitize_string_reference(
+                value), value
+
+    def test_emoji_characters_match_reference(self):
+        for code in range(0x20000):
+            char = chr(code)
+            assert (char in emoji_characters) is bool(emojis.match(char))
+
+    def test_sanitize_string_parses_html_only_with_tag_start(self):
+        with patch('core.validators.BeautifulSoup') as soup:
+            assert sanitize_string('Me & you') is True
+            assert not soup.called
+
+    def test_sanitize_string_benchmark(self):
+        values = ['Party {} name with some text'.format(i)
+                  for i in range(200)]
+        values += ['সুরুজ্জামান মন্ডল {}'.format(i) for i in range(200)]
+
+        def run(sanitize):
+            return min(timeit.repeat(
+                lambda: [sanitize(value) for value in values],
+                number=1, repeat=3))
+
+        assert run(sanitize_string) < run(sanitize_string_reference)
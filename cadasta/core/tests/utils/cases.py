@@ -1,5 +1,6 @@
 import os
 from django.conf import settings
+from django.core.files import File
 from buckets.test.storage import FakeS3Storage
 from core.tests.factories import PolicyFactory
 from jsonattrs.models import create_attribute_types
@@ -12,6 +13,16 @@ class UserTestCase:
         create_attribute_types()
 
 
+class StreamingFakeS3Storage(FakeS3Storage):
+    """Saves files passed as File objects, which S3Storage streams but
+    FakeS3Storage does not accept."""
+
+    def save(self, name, content):
+        if isinstance(content, File):
+            content = b''.join(content.chunks())
+        return super().save(name, content)
+
+
 class FileStorageTestCase:
     def setUp(self):
         super().setUp()
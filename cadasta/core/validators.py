@@ -32,8 +32,9 @@ def validate_json(value, schema):
         raise JsonValidationError(message_dict)
 
 
-emojis = re.compile(
-    u'.*[\U0001F004\U0001F0CF\U0001F170-\U0001F171\U0001F17E\U0001F17F'
+# Emoji characters, as the contents of a character class
+EMOJI_CHARACTERS = (
+    '\U0001F004\U0001F0CF\U0001F170-\U0001F171\U0001F17E\U0001F17F'
     '\U0001F18E\U0001F191-\U0001F19A\U0001F1E6-\U0001F1FF'
     '\U0001F201-\U0001F202\U0001F21A\U0001F22F\U0001F232-\U0001F23A'
     '\U0001F250-\U0001F251\U0001F300-\U0001F320\U0001F321\U0001F324-\U0001F32C'
@@ -109,14 +110,51 @@ emojis = re.compile(
     '\u26BD-\u26BE\u26C4-\u26C5\u26CE\u26D4\u26EA\u26F2-\u26F3\u26F5\u26FA'
     '\u26FD\u2705\u270A-\u270B\u2728\u274C\u274E\u2753-\u2755\u2757'
     '\u2795-\u2797\u27B0\u27BF\u2B1B-\u2B1C\u2B50\u2B55\u261D\u26F9'
-    '\u270A-\u270B\u270C-\u270D].*')
-macros = re.compile('^[' + re.escape('-=+@') + ']')
+    '\u270A-\u270B\u270C-\u270D')
+emojis = re.compile('.*[' + EMOJI_CHARACTERS + '].*')
+MACRO_CHARACTERS = '-=+@'
+macros = re.compile('^[' + re.escape(MACRO_CHARACTERS) + ']')
+
+
+def get_class_characters(characters):
+    """Returns the set of characters in the contents of a character class
+    without escapes, such as EMOJI_CHARACTERS."""
+    chars = set()
+    i = 0
+    while i < len(characters):
+        if characters[i + 1:i + 2] == '-' and i + 2 < len(characters):
+            chars.update(chr(code) for code in range(
+                ord(characters[i]), ord(characters[i + 2]) + 1))
+            i += 3
+        else:
+            chars.add(characters[i])
+            i += 1
+    return frozenset(chars)
+
+
+emoji_characters = get_class_characters(EMOJI_CHARACTERS)
 
 
 def sanitize_string(value):
+    """
+    Returns whether a string contains no HTML tags and no emojis, and does
+    not start with a spreadsheet macro character.
+
+    Accepts and rejects the same strings as matching `emojis` and `macros`
+    and parsing the string with BeautifulSoup, but only parses strings that
+    contain a `<`, since no tag can be parsed from any other string. Like
+    `emojis`, only emojis before the first line break are rejected.
+    """
     if not value or not isinstance(value, str):
         return True
 
-    return (not bool(BeautifulSoup(value, 'html.parser').find()) and
-            not emojis.match(value) and
-            not macros.match(value))
+    if value[0] in MACRO_CHARACTERS:
+        return False
+
+    line_end = value.find('\n')
+    first_line = value if line_end == -1 else value[:line_end]
+    if not emoji_characters.isdisjoint(first_line):
+        return False
+
+    return not ('<' in value and
+                BeautifulSoup(value, 'html.parser').find() is not None)
@@ -1,17 +1,20 @@
-import csv
+import importlib
+import itertools
 
 from core.mixins import SchemaSelectorMixin
-from core.messages import SANITIZE_ERROR
-from core.validators import sanitize_string
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.utils.dateparse import parse_datetime
 from party.models import Party, TenureRelationship
 from spatial.models import SpatialUnit
 
-from . import exceptions, validators
-
-ATTRIBUTE_GROUPS = settings.ATTRIBUTE_GROUPS
+from . import exceptions
+from .bulk import BulkCreator
+from .geometry import GeometryParser
+from .mapper import (AttributeMapper, RowMapper, cast_to_type,
+                     get_content_type_keys)
+from .validators import ValidationReport
 
 EXCLUDE_HEADERS = [
     'deviceid', 'sim_serial', 'start', 'end', 'today',
@@ -38,6 +41,14 @@ XLS_WORKSHEET_TO_CONTENT_TYPE = {
 }
 
 
+def get_importer(type, project, path):
+    """Returns an importer of the class configured for the file type in
+    IMPORTERS."""
+    module, _, name = settings.IMPORTERS.get(type).rpartition('.')
+    importer = getattr(importlib.import_module(module), name)
+    return importer(project=project, path=path)
+
+
 class Importer(SchemaSelectorMixin):
 
     class Meta:
@@ -63,14 +74,14 @@ class Importer(SchemaSelectorMixin):
             % self.__class__.__name__
         )
 
+    def validate_data(self, config, **kwargs):
+        raise NotImplementedError(
+            "Your %s class has not defined a validate_data() method."
+            % self.__class__.__name__
+        )
+
     def get_content_type_keys(self):
-        content_type_keys = []
-        for attribute_group in ATTRIBUTE_GROUPS:
-            app_label = ATTRIBUTE_GROUPS[attribute_group]['app_label']
-            model = ATTRIBUTE_GROUPS[attribute_group]['model']
-            content_type_key = '{}.{}'.format(app_label, model)
-            content_type_keys.append(content_type_key)
-        return content_type_keys
+        return get_content_type_keys()
 
     def get_schema_attrs(self):
         self._schema_attrs = self.get_attributes(self.project)
@@ -156,158 +167,166 @@ class Importer(SchemaSelectorMixin):
         return (attribute_map,
                 sorted(extra_attrs), sorted(extra_headers))
 
-    def _import(self, config, csvfile):
-        attributes = config.get('attributes', None)
+    def _import(self, config, reader, chunk_size=None, checkpoint=None,
+                on_commit=None, user=None):
+        """
+        Imports the rows of a `csv.reader`, or any iterator over rows that
+        keeps count of them in `line_num`, starting with the header row.
+
+        All rows are imported in one transaction, unless a `chunk_size` is
+        given: then every `chunk_size` rows are committed in a transaction of
+        their own, at the end of which `on_commit(checkpoint)` is called with
+        a checkpoint of the import. Passing the last checkpoint of an
+        interrupted import resumes it after the last committed row. If a row
+        cannot be imported, the rows of the chunks committed before it are
+        deleted again, including those committed before the import was
+        resumed.
+
+        The history records of the imported models are attributed to `user`.
+        """
         entity_types = config.get('entity_types', None)
 
         type = config.get('type', None)
         (attr_map,
             extra_attrs, extra_headers) = self.get_attribute_map(
                 type, entity_types)
+        self._bulk = BulkCreator(self.project, user=user)
+        num_rows = 0
+        if checkpoint:
+            num_rows = self._restore_checkpoint(checkpoint)
+        line_num = None
         try:
-            with transaction.atomic():
-                reader = csv.reader(
-                    csvfile, delimiter=self.delimiter,
-                    quotechar=self.quotechar
-                )
-                headers = [h.lower() for h in next(reader)]
-
-                for row in reader:
-                    content_types = dict(
-                        (key, None) for key in self.get_content_type_keys()
-                    )
-                    (party_name, party_type, geometry, location_type,
-                        tenure_type) = validators.validate_row(
-                            headers, row, config
-                    )
-                    if 'PT' in entity_types and party_type:
-                        content_types['party.party'] = {
-                            'project': self.project,
-                            'name': party_name,
-                            'type': party_type,
-                            'attributes': {}
-                        }
-                    if 'SU' in entity_types and location_type:
-                        content_types['spatial.spatialunit'] = {
-                            'project': self.project,
-                            'type': location_type,
-                            'geometry': geometry,
-                            'attributes': {}
-                        }
-                    if location_type and party_type and tenure_type:
-                        content_types['party.tenurerelationship'] = {
-                            'project': self.project,
-                            'attributes': {}
-                        }
-                    content_types = self._map_attrs_to_content_types(
-                        headers, row, content_types, attributes, attr_map)
-                    self._create_models(
-                        type, headers, row, content_types, tenure_type
-                    )
+            headers = [h.lower() for h in next(reader)]
+            mapper = RowMapper(self.project, headers, config, attr_map)
+            # Line numbers are taken as rows are read, since geometries are
+            # parsed ahead of the rows being mapped
+            numbered_rows = (
+                (reader.line_num, row)
+                for row in itertools.islice(reader, num_rows, None))
+
+            with GeometryParser(mapper.validator.geometry_position,
+                                len(headers)) as geometry_parser:
+                rows = geometry_parser.parse(numbered_rows)
+                done = False
+                while not done:
+                    with transaction.atomic():
+                        num_chunk_rows = 0
+                        for line_num, row, geometry in itertools.islice(
+                                rows, chunk_size):
+                            content_types, tenure_type = mapper.map(
+                                row, geometry)
+                            self._create_models(
+                                mapper, row, content_types, tenure_type)
+                            num_chunk_rows += 1
+                        self._bulk.flush()
+
+                        num_rows += num_chunk_rows
+                        done = (chunk_size is None or
+                                num_chunk_rows < chunk_size)
+                        if on_commit and num_chunk_rows:
+                            on_commit(self._get_checkpoint(num_rows))
         except ValidationError as e:
+            if chunk_size is not None:
+                self._bulk.delete_created()
             raise exceptions.DataImportError(
-                e.messages[0], line_num=reader.line_num)
+                e.messages[0], line_num=line_num or reader.line_num)
+        return num_rows
+
+    def _validate(self, config, reader, workers=None, max_rows=None):
+        """
+        Validates all rows of a `csv.reader`, or any iterator over rows that
+        keeps count of them in `line_num`, the way `_import()` would, without
+        creating anything. Returns a `ValidationReport` of the errors of all
+        rows instead of stopping at the first one. Only the first `max_rows`
+        rows are validated if given.
+
+        Geometries are parsed by `workers` workers, as configured by
+        IMPORT_GEOMETRY_WORKERS if not given; 0 parses them in-process.
+        """
+        (attr_map,
+            extra_attrs, extra_headers) = self.get_attribute_map(
+                config.get('type', None),
+                list(config.get('entity_types', None)))
+        report = ValidationReport()
+        try:
+            headers = [h.lower() for h in next(reader)]
+        except StopIteration:
+            return report
+        mapper = RowMapper(self.project, headers, config, attr_map)
+        numbered_rows = ((reader.line_num, row)
+                         for row in itertools.islice(reader, max_rows))
+
+        with GeometryParser(mapper.validator.geometry_position,
+                            len(headers),
+                            workers=workers) as geometry_parser:
+            for line_num, row, geometry in geometry_parser.parse(
+                    numbered_rows):
+                report.add_row()
+                try:
+                    mapper.map(row, geometry)
+                except ValidationError as e:
+                    report.add_error(e.messages[0], line_num)
+        return report
+
+    def _get_checkpoint(self, num_rows):
+        return {
+            'rows': num_rows,
+            'locations': {key: su.id
+                          for key, su in self._locations_created.items()},
+            'parties': {key: party.id
+                        for key, party in self._parties_created.items()},
+            'history_date': self._bulk.history_date.isoformat(),
+        }
+
+    def _restore_checkpoint(self, checkpoint):
+        self._locations_created = {
+            key: SpatialUnit(id=id, project=self.project)
+            for key, id in checkpoint['locations'].items()}
+        self._parties_created = {
+            key: Party(id=id, project=self.project)
+            for key, id in checkpoint['parties'].items()}
+        if 'history_date' in checkpoint:
+            self._bulk.history_date = parse_datetime(
+                checkpoint['history_date'])
+        return checkpoint['rows']
 
-    def _create_models(self, type, headers, row, content_types, tenure):
+    def _create_models(self, mapper, row, content_types, tenure):
 
         party_ct = content_types['party.party']
         spatial_ct = content_types['spatial.spatialunit']
 
-        s_id = (
-            'tenurerelationship::spatial_unit_id'
-            if type == 'xls' else 'spatial_unit_id')
-        p_id = (
-            'tenurerelationship::party_id'
-            if type == 'xls' else 'party_id'
-        )
-
         if spatial_ct:
-            try:
-                spatial_unit_id = row[headers.index(s_id)]
-            except ValueError:
-                su = SpatialUnit.objects.create(**spatial_ct)
-            else:
+            spatial_unit_id = mapper.get_spatial_unit_id(row)
+            su = None
+            if spatial_unit_id:
+                su = self._locations_created.get(spatial_unit_id, None)
+            if su is None:
+                su = self._bulk.add(SpatialUnit(**spatial_ct))
                 if spatial_unit_id:
-                    created_su_id = self._locations_created.get(
-                        spatial_unit_id, None
-                    )
-                    if created_su_id:
-                        su = SpatialUnit.objects.get(id=created_su_id)
-                    else:
-                        su = SpatialUnit.objects.create(**spatial_ct)
-                        self._locations_created[spatial_unit_id] = su.pk
-                else:
-                    su = SpatialUnit.objects.create(**spatial_ct)
-                    self._locations_created[spatial_unit_id] = su.pk
+                    self._locations_created[spatial_unit_id] = su
 
         if party_ct:
-            try:
-                party_id = row[headers.index(p_id)]
-            except ValueError:
-                party = Party.objects.create(**party_ct)
-            else:
+            party_id = mapper.get_party_id(row)
+            party = None
+            if party_id:
+                party = self._parties_created.get(party_id, None)
+            if party is None:
+                party = self._bulk.add(Party(**party_ct))
                 if party_id:
-                    created_party_id = self._parties_created.get(
-                        party_id, None)
-                    if created_party_id:
-                        party = Party.objects.get(id=created_party_id)
-                    else:
-                        party = Party.objects.create(**party_ct)
-                        self._parties_created[party_id] = party.pk
-                else:
-                    party = Party.objects.create(**party_ct)
-                    self._parties_created[party_id] = party.pk
+                    self._parties_created[party_id] = party
 
         if party_ct and spatial_ct:
             content_types['party.tenurerelationship']['party'] = party
             content_types['party.tenurerelationship']['spatial_unit'] = su
             content_types['party.tenurerelationship']['tenure_type'] = tenure
-            TenureRelationship.objects.create(
+            self._bulk.add(TenureRelationship(
                 **content_types['party.tenurerelationship']
-            )
+            ))
 
     def _map_attrs_to_content_types(self, headers, row, content_types,
                                     attributes, attr_map):
-        for model, selectors in attr_map.items():
-            for selector, attrs in selectors.items():
-                content_type = content_types.get(model, None)
-                if not content_type:
-                    continue
-                if selector in ['DEFAULT', content_type.get('type', '')]:
-                    for attr in attrs:
-                        attribute = attrs[attr][0]
-                        attr_label = '{0}::{1}'.format(
-                            model.split('.')[1], attr)
-                        if attr_label not in attributes:
-                            continue
-                        try:
-                            val = row[headers.index(attribute.name.lower())]
-                        except (KeyError, ValueError):
-                            val = row[headers.index(attr_label)]
-
-                        if not sanitize_string(val):
-                            raise ValidationError(SANITIZE_ERROR)
-
-                        if not attribute.required and val == '':
-                            continue
-                        if attribute.attr_type.name == 'select_multiple':
-                            val = [v.strip() for v in val.split(',')]
-                        if attribute.attr_type.name in ['integer', 'decimal']:
-                            val = self._cast_to_type(
-                                val, attribute.attr_type.name)
-                        if content_type:
-                            content_type['attributes'][attribute.name] = val
-        return content_types
+        return AttributeMapper(headers, attributes, attr_map).map(
+            row, content_types)
 
     def _cast_to_type(self, val, type):
-        if type == 'integer':
-            try:
-                val = int(float(val))
-            except (ValueError, TypeError):
-                val = 0
-        if type == 'decimal':
-            try:
-                val = float(val)
-            except (ValueError, TypeError):
-                val = 0.0
-        return val
+        return cast_to_type(val, type)
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.util import random_id, random_ids
+from party.models import Party, TenureRelationship
+from questionnaires.catalog import get_option_catalog
+from spatial.models import SpatialUnit, check_extent
+
+
+class BulkCreator():
+    """
+    Collects new spatial units, parties and tenure relationships of an import
+    and inserts them in batches with `bulk_create()`.
+
+    `bulk_create()` neither calls `save()` nor sends the `pre_save` and
+    `post_save` signals, so this takes over what they would do for new
+    instances: IDs are generated up front, so that relationships can refer
+    to instances that are not inserted yet; spatial units are passed through
+    `check_extent()` and labelled from a cache of the project's location type
+    options; and history records are written in bulk, attributed to `user`.
+
+    All history records are dated `history_date`, the time the creator is
+    made unless given, so that the instances created by an import can be
+    found, and deleted again, from their history.
+    """
+
+    # Insertion order, so that relationships are inserted after the
+    # instances they refer to
+    models = (SpatialUnit, Party, TenureRelationship)
+
+    def __init__(self, project, batch_size=None, user=None,
+                 history_date=None):
+        self.project = project
+        self.user = user
+        self.history_date = history_date or timezone.now()
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.pending = OrderedDict((model, []) for model in self.models)
+        self.count = 0
+        self._location_labels = None
+        self._ids = []
+
+    @property
+    def location_labels(self):
+        if self._location_labels is None:
+            catalog = get_option_catalog(self.project.current_questionnaire)
+            self._location_labels = dict(
+                catalog.get_options('location_type'))
+        return self._location_labels
+
+    def add(self, instance):
+        """Queues a new instance for insertion and returns it. The instance
+        has its final ID, unless that ID turns out to be taken when the batch
+        is inserted."""
+        if not self._ids:
+            self._ids = random_ids(self.batch_size)
+        instance.id = self._ids.pop()
+        if isinstance(instance, SpatialUnit):
+            check_extent(SpatialUnit, instance)
+            if instance.type in self.location_labels:
+                instance.label = self.location_labels[instance.type]
+
+        self.pending[type(instance)].append(instance)
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush()
+        return instance
+
+    def flush(self):
+        """Inserts all queued instances."""
+        for model, instances in self.pending.items():
+            if not instances:
+                continue
+            self._ensure_unique_ids(model, instances)
+            if model is TenureRelationship:
+                # IDs of parties and spatial units may have been replaced
+                for instance in instances:
+                    instance.party_id = instance.party.id
+                    instance.spatial_unit_id = instance.spatial_unit.id
+            model.objects.bulk_create(instances, batch_size=self.batch_size)
+            self._create_history(model, instances)
+            instances.clear()
+        self.count = 0
+
+    def delete_created(self):
+        """Deletes the instances inserted with the history date of this
+        creator, including those inserted by earlier creators of the same
+        import. Instances that are still queued are dropped."""
+        for instances in self.pending.values():
+            instances.clear()
+        self.count = 0
+        with transaction.atomic():
+            for model in reversed(self.models):
+                model.objects.filter(id__in=model.history.filter(
+                    project_id=self.project.id,
+                    history_type='+',
+                    history_date=self.history_date,
+                ).values('id')).delete()
+
+    def _ensure_unique_ids(self, model, instances):
+        while True:
+            taken = set(model.objects.filter(
+                pk__in=[instance.id for instance in instances]
+            ).values_list('pk', flat=True))
+            seen = set()
+            replaced = False
+            for instance in instances:
+                if instance.id in taken or instance.id in seen:
+                    instance.id = random_id()
+                    replaced = True
+                seen.add(instance.id)
+            if not replaced:
+                return
+
+    def _create_history(self, model, instances):
+        history_model = model.history.model
+        history_fields = {f.attname for f in history_model._meta.fields}
+        fields = [f.attname for f in model._meta.fields
+                  if f.attname in history_fields]
+        history_model.objects.bulk_create([
+            history_model(
+                history_date=self.history_date,
+                history_type='+',
+                history_user=self.user,
+                **{field: getattr(instance, field) for field in fields})
+            for instance in instances
+        ], batch_size=self.batch_size)
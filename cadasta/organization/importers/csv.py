@@ -26,4 +26,14 @@ class CSVImporter(base.Importer):
 
     def import_data(self, config_dict, **kwargs):
         with open(self.path, 'r', newline='') as csvfile:
-            self._import(config_dict, csvfile)
+            reader = csv.reader(
+                csvfile, delimiter=self.delimiter, quotechar=self.quotechar
+            )
+            return self._import(config_dict, reader, **kwargs)
+
+    def validate_data(self, config_dict, **kwargs):
+        with open(self.path, 'r', newline='') as csvfile:
+            reader = csv.reader(
+                csvfile, delimiter=self.delimiter, quotechar=self.quotechar
+            )
+            return self._validate(config_dict, reader, **kwargs)
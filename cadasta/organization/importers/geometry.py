@@ -0,0 +1,148 @@
+import itertools
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.gis.geos import (GEOSGeometry, GEOSException, LineString,
+                                     Point, Polygon)
+from django.core.exceptions import ValidationError
+from django.utils.translation import ugettext as _
+
+from xforms.utils import (InvalidODKGeometryError, odk_geom_to_wkt,
+                          parse_odk_geom)
+
+# Values of the geometry column that are coordinates in ODK format
+ODK_GEOMETRY = re.compile(r'[0-9.+\-;\s]*[0-9.]\s+[0-9.+\-;\s]*')
+
+GEOS_TYPES = {
+    'Point': lambda points: Point(*points[0]),
+    'LineString': LineString,
+    'Polygon': Polygon,
+}
+
+# Marks geometries that are not parsed yet and geometries that are invalid.
+# INVALID is returned by workers, so it must keep its identity when pickled.
+UNPARSED = object()
+INVALID = False
+
+# Batches with fewer geometries than this are parsed in-process
+MIN_POOL_BATCH = 200
+
+
+def odk_geom_to_geos(coords):
+    """Builds a GEOS geometry from coordinates in ODK format directly,
+    instead of through shapely and WKT like `odk_geom_to_wkt()`."""
+    try:
+        geom_type, points = parse_odk_geom(coords)
+        return GEOS_TYPES[geom_type](points)
+    except Exception as e:
+        raise InvalidODKGeometryError(e)
+
+
+def parse_geometry(coords):
+    """Parses the value of a geometry column, which is WKT, EWKT, HEXEWKB,
+    GeoJSON or coordinates in ODK format. Returns None for empty values."""
+    if coords == '':
+        return None
+    try:
+        if ODK_GEOMETRY.fullmatch(coords):
+            return odk_geom_to_geos(coords)
+        try:
+            return GEOSGeometry(coords)
+        except (ValueError, GEOSException):
+            return GEOSGeometry(odk_geom_to_wkt(coords))
+    except InvalidODKGeometryError:
+        raise ValidationError(_("Invalid geometry."))
+
+
+def parse_geometry_to_ewkb(coords):
+    """Parses a geometry in a worker and returns it as EWKB, None for empty
+    values or INVALID."""
+    try:
+        geometry = parse_geometry(coords)
+    except ValidationError:
+        return INVALID
+    return None if geometry is None else bytes(geometry.ewkb)
+
+
+def from_ewkb(ewkb):
+    if ewkb is None or ewkb is INVALID:
+        return ewkb
+    return GEOSGeometry(memoryview(ewkb))
+
+
+class GeometryParser():
+    """
+    Pre-pass of an import that parses the geometry column of batches of rows
+    in a pool of workers, so that the geometries are parsed in parallel before
+    the rows are mapped and inserted one by one.
+
+    Workers are processes, unless the import runs in a daemonic process, such
+    as a celery prefork worker, which cannot start processes; then they are
+    threads, which still parse in parallel while GEOS runs without the GIL.
+    IMPORT_GEOMETRY_WORKERS = 0 parses in-process.
+    """
+
+    def __init__(self, position, num_columns, workers=None, batch_size=None):
+        self.position = position
+        self.num_columns = num_columns
+        self.workers = (settings.IMPORT_GEOMETRY_WORKERS
+                        if workers is None else workers)
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            if multiprocessing.current_process().daemon:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers or multiprocessing.cpu_count())
+            else:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers or None)
+        return self.executor
+
+    def parse_batch(self, values):
+        if self.workers == 0 or len(values) < MIN_POOL_BATCH:
+            return [parse_geometry_to_ewkb(value) for value in values]
+        return list(self.get_executor().map(
+            parse_geometry_to_ewkb, values,
+            chunksize=max(1, len(values) // (4 * (self.workers or 4)))))
+
+    def parse(self, rows):
+        """Reads (line number, row) pairs in batches and yields (line number,
+        row, geometry) triples. The geometry is UNPARSED if the file has no
+        geometry column or the row has the wrong number of columns, which
+        the row validator reports."""
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return
+            if self.position is None:
+                for line_num, row in batch:
+                    yield line_num, row, UNPARSED
+                continue
+
+            positions, values = [], []
+            for i, (line_num, row) in enumerate(batch):
+                if len(row) == self.num_columns:
+                    positions.append(i)
+                    values.append(row[self.position])
+            geometries = [UNPARSED] * len(batch)
+            for i, ewkb in zip(positions, self.parse_batch(values)):
+                geometries[i] = from_ewkb(ewkb)
+
+            for (line_num, row), geometry in zip(batch, geometries):
+                yield line_num, row, geometry
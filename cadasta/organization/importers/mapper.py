@@ -0,0 +1,173 @@
+from core.messages import SANITIZE_ERROR
+from core.validators import sanitize_string
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from . import validators
+from .geometry import UNPARSED
+
+ATTRIBUTE_GROUPS = settings.ATTRIBUTE_GROUPS
+
+
+def get_content_type_keys():
+    return ['{}.{}'.format(group['app_label'], group['model'])
+            for group in ATTRIBUTE_GROUPS.values()]
+
+
+def cast_to_type(val, type):
+    if type == 'integer':
+        try:
+            val = int(float(val))
+        except (ValueError, TypeError):
+            val = 0
+    if type == 'decimal':
+        try:
+            val = float(val)
+        except (ValueError, TypeError):
+            val = 0.0
+    return val
+
+
+def split_multiple(val):
+    return [v.strip() for v in val.split(',')]
+
+
+def compile_attribute(attribute, attr_label, positions):
+    """Returns (position, name, required, converter) for an attribute;
+    `position` is None if the attribute has no column."""
+    position = positions.get(attribute.name.lower())
+    if position is None:
+        position = positions.get(attr_label)
+
+    type_name = attribute.attr_type.name
+    converter = None
+    if type_name == 'select_multiple':
+        converter = split_multiple
+    elif type_name in ['integer', 'decimal']:
+        def converter(val, type_name=type_name):
+            return cast_to_type(val, type_name)
+    return (position, attribute.name, attribute.required, converter)
+
+
+class AttributeMapper():
+    """
+    Compiled form of an attribute map for the header row of an imported file.
+    The columns of the attributes selected for import, their casters and
+    select_multiple splitters are resolved once, so that mapping a row only
+    indexes into it.
+    """
+
+    def __init__(self, headers, attributes, attr_map):
+        positions = validators.get_column_positions(headers)
+        self.headers = headers
+        # [(model, [(selector, [compiled attribute, ...]), ...]), ...] in the
+        # order of the attribute map
+        self.models = []
+        for model, selectors in attr_map.items():
+            compiled_selectors = []
+            for selector, attrs in selectors.items():
+                compiled_attrs = []
+                for attr in attrs:
+                    attr_label = '{0}::{1}'.format(model.split('.')[1], attr)
+                    if attr_label not in attributes:
+                        continue
+                    compiled_attrs.append((attr_label,) + compile_attribute(
+                        attrs[attr][0], attr_label, positions))
+                compiled_selectors.append((selector, compiled_attrs))
+            self.models.append((model, compiled_selectors))
+
+    def map(self, row, content_types):
+        for model, selectors in self.models:
+            content_type = content_types.get(model, None)
+            if not content_type:
+                continue
+            type = content_type.get('type', '')
+            for selector, attrs in selectors:
+                if selector != 'DEFAULT' and selector != type:
+                    continue
+                for (attr_label, position, name, required,
+                        converter) in attrs:
+                    if position is None:
+                        # Raises the ValueError of a missing column
+                        position = self.headers.index(attr_label)
+                    val = row[position]
+
+                    if not sanitize_string(val):
+                        raise ValidationError(SANITIZE_ERROR)
+
+                    if not required and val == '':
+                        continue
+                    if converter:
+                        val = converter(val)
+                    content_type['attributes'][name] = val
+        return content_types
+
+
+class RowMapper():
+    """
+    Compiled form of an import config and attribute map for the header row of
+    an imported file, built once per import. Maps each row to the keyword
+    arguments of the instances to create, the tenure type and the IDs that
+    relate parties and spatial units across rows.
+    """
+
+    def __init__(self, project, headers, config, attr_map):
+        self.project = project
+        self.content_type_keys = get_content_type_keys()
+        entity_types = config.get('entity_types', None)
+        self.import_parties = 'PT' in entity_types
+        self.import_locations = 'SU' in entity_types
+
+        self.validator = validators.RowValidator(headers, config)
+        self.attributes = AttributeMapper(
+            headers, config.get('attributes', None), attr_map)
+
+        positions = validators.get_column_positions(headers)
+        prefix = ('tenurerelationship::'
+                  if config.get('type', None) == 'xls' else '')
+        self.spatial_unit_id_position = positions.get(
+            prefix + 'spatial_unit_id')
+        self.party_id_position = positions.get(prefix + 'party_id')
+
+    def map(self, row, geometry=UNPARSED):
+        """Returns the content types of the row and its tenure type. A
+        `geometry` parsed by the `GeometryParser` is used instead of parsing
+        the geometry column again."""
+        content_types = dict.fromkeys(self.content_type_keys)
+        (party_name, party_type, geometry, location_type,
+            tenure_type) = self.validator.validate(row, geometry)
+        if self.import_parties and party_type:
+            content_types['party.party'] = {
+                'project': self.project,
+                'name': party_name,
+                'type': party_type,
+                'attributes': {}
+            }
+        if self.import_locations and location_type:
+            content_types['spatial.spatialunit'] = {
+                'project': self.project,
+                'type': location_type,
+                'geometry': geometry,
+                'attributes': {}
+            }
+        if location_type and party_type and tenure_type:
+            content_types['party.tenurerelationship'] = {
+                'project': self.project,
+                'attributes': {}
+            }
+        self.attributes.map(row, content_types)
+        return content_types, tenure_type
+
+    def get_spatial_unit_id(self, row):
+        """Returns the spatial unit ID of the row, or None if the file has no
+        such column."""
+        if self.spatial_unit_id_position is None:
+            return None
+        return row[self.spatial_unit_id_position]
+
+    def get_party_id(self, row):
+        """Returns the party ID of the row, or None if the file has no such
+        column."""
+        if self.party_id_position is None:
+            return None
+        return row[self.party_id_position]
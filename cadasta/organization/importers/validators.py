@@ -1,76 +1,171 @@
-from functools import partial
+from collections import OrderedDict
 
-from django.contrib.gis.geos import GEOSGeometry, GEOSException
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext as _
+from django.utils.translation import ungettext
 
 from core.validators import sanitize_string
 from core.messages import SANITIZE_ERROR
-from xforms.utils import InvalidODKGeometryError, odk_geom_to_wkt
 
-
-def get_field_value(headers, row, header, field_name):
-    try:
-        return row[headers.index(header)]
-    except ValueError:
-        raise ValidationError(
-            _("No '{}' column found.".format(field_name))
-        )
-
-
-def validate_row(headers, row, config):
-    party_name, party_type, geometry, tenure_type, location_type = (
-        None, None, None, None, None)
-
-    (party_name_field, party_type_field, location_type_field, type,
-        geometry_field, tenure_type_field) = get_fields_from_config(config)
-
-    if len(headers) != len(row):
-        raise ValidationError(
-            _("Number of headers and columns do not match.")
-        )
-
-    _get_field_value = partial(get_field_value, headers, row)
-
-    if party_name_field and party_type_field:
-        party_name = _get_field_value(party_name_field, "party_name")
-        party_type = _get_field_value(party_type_field, "party_type")
-
-    if geometry_field:
-        coords = _get_field_value(geometry_field, "geometry_field")
-        if coords == '':
-            geometry = None
-        else:
-            try:
-                geometry = GEOSGeometry(coords)
-            except (ValueError, GEOSException):
-                try:
-                    geometry = GEOSGeometry(odk_geom_to_wkt(coords))
-                except InvalidODKGeometryError:
-                    raise ValidationError(_("Invalid geometry."))
-
-    if location_type_field:
-        location_type = _get_field_value(location_type_field, "location_type")
-        type_choices = config['allowed_location_types']
-        if location_type and location_type not in type_choices:
+from .geometry import INVALID, UNPARSED, parse_geometry
+
+
+def get_column_positions(headers):
+    """Maps each header to the position of its first column."""
+    positions = {}
+    for i, header in enumerate(headers):
+        positions.setdefault(header, i)
+    return positions
+
+
+class RowValidator():
+    """
+    Compiled form of `validate_row()` for the header row of an imported file:
+    the positions of the configured columns are looked up once instead of
+    for every row.
+    """
+
+    def __init__(self, headers, config):
+        (party_name_field, party_type_field, location_type_field, type,
+            geometry_field, tenure_type_field) = get_fields_from_config(config)
+        positions = get_column_positions(headers)
+
+        def column(header, field_name):
+            return (positions.get(header), field_name)
+
+        self.num_headers = len(headers)
+        self.party_fields = None
+        if party_name_field and party_type_field:
+            self.party_fields = (column(party_name_field, 'party_name'),
+                                 column(party_type_field, 'party_type'))
+        self.geometry_field = None
+        if geometry_field:
+            self.geometry_field = column(geometry_field, 'geometry_field')
+        self.location_type_field = None
+        if location_type_field:
+            self.location_type_field = column(location_type_field,
+                                              'location_type')
+            self.location_types = config.get('allowed_location_types')
+        self.tenure_type_field = None
+        if party_name_field and geometry_field:
+            self.tenure_type_field = column(tenure_type_field, 'tenure_type')
+            self.tenure_types = config.get('allowed_tenure_types')
+
+    def get_value(self, row, field):
+        position, field_name = field
+        if position is None:
             raise ValidationError(
-                _("Invalid location_type: '%s'.") % location_type
+                _("No '{}' column found.".format(field_name))
             )
+        return row[position]
 
-    if party_name_field and geometry_field:
-        tenure_type = _get_field_value(tenure_type_field, 'tenure_type')
+    @property
+    def geometry_position(self):
+        return self.geometry_field[0] if self.geometry_field else None
 
-        if tenure_type and tenure_type not in config['allowed_tenure_types']:
+    def validate(self, row, geometry=UNPARSED):
+        """Validates a row. A `geometry` parsed by the `GeometryParser` is
+        used instead of parsing the geometry column again."""
+        party_name, party_type, tenure_type, location_type = (
+            None, None, None, None)
+
+        if self.num_headers != len(row):
             raise ValidationError(
-                _("Invalid tenure_type: '%s'.") % tenure_type
+                _("Number of headers and columns do not match.")
             )
 
-    values = (party_name, party_type, geometry, location_type, tenure_type)
+        if self.party_fields:
+            party_name = self.get_value(row, self.party_fields[0])
+            party_type = self.get_value(row, self.party_fields[1])
+
+        if self.geometry_field:
+            if geometry is UNPARSED:
+                geometry = parse_geometry(
+                    self.get_value(row, self.geometry_field))
+            elif geometry is INVALID:
+                raise ValidationError(_("Invalid geometry."))
+
+        if self.location_type_field:
+            location_type = self.get_value(row, self.location_type_field)
+            if location_type and location_type not in self.location_types:
+                raise ValidationError(
+                    _("Invalid location_type: '%s'.") % location_type
+                )
+
+        if self.tenure_type_field:
+            tenure_type = self.get_value(row, self.tenure_type_field)
+
+            if tenure_type and tenure_type not in self.tenure_types:
+                raise ValidationError(
+                    _("Invalid tenure_type: '%s'.") % tenure_type
+                )
+
+        values = (party_name, party_type, geometry, location_type, tenure_type)
+
+        if not all(sanitize_string(val) for val in values):
+            raise ValidationError(SANITIZE_ERROR)
+
+        return values
+
+
+class ValidationReport():
+    """
+    Errors found by validating all rows of an imported file, grouped by
+    message. At most `max_messages` distinct messages and the first
+    `max_lines` line numbers of each are kept; rows with other messages are
+    only counted.
+    """
+
+    max_messages = 20
+    max_lines = 10
+
+    def __init__(self):
+        self.num_rows = 0
+        self.num_invalid_rows = 0
+        self.num_other_errors = 0
+        # {message: [count, [line_num, ...]]}
+        self.errors = OrderedDict()
+
+    @property
+    def is_valid(self):
+        return self.num_invalid_rows == 0
+
+    def add_row(self):
+        self.num_rows += 1
+
+    def add_error(self, message, line_num):
+        self.num_invalid_rows += 1
+        error = self.errors.get(message)
+        if error is None:
+            if len(self.errors) >= self.max_messages:
+                self.num_other_errors += 1
+                return
+            error = self.errors[message] = [0, []]
+        error[0] += 1
+        if len(error[1]) < self.max_lines:
+            error[1].append(line_num)
+
+    def get_messages(self):
+        messages = []
+        for message, (count, lines) in self.errors.items():
+            line_nums = ', '.join(str(line_num) for line_num in lines)
+            if count > len(lines):
+                line_nums += ', ...'
+            messages.append(ungettext(
+                "%(message)s (%(count)d row: line %(lines)s)",
+                "%(message)s (%(count)d rows: lines %(lines)s)",
+                count) % {'message': message, 'count': count,
+                          'lines': line_nums})
+        if self.num_other_errors:
+            messages.append(ungettext(
+                "%d more row has other errors.",
+                "%d more rows have other errors.",
+                self.num_other_errors) % self.num_other_errors)
+        return messages
 
-    if not all(sanitize_string(val) for val in values):
-        raise ValidationError(SANITIZE_ERROR)
 
-    return values
+def validate_row(headers, row, config):
+    return RowValidator(headers, config).validate(row)
 
 
 def get_fields_from_config(config):
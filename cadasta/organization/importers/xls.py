@@ -1,8 +1,8 @@
-import io
-import itertools
+import datetime
+from collections import OrderedDict
 
-import pandas as pd
 from django.utils.translation import ugettext as _
+from openpyxl import load_workbook
 
 from . import base, exceptions
 
@@ -17,91 +17,253 @@ class XLSImporter(base.Importer):
     def __init__(self, project=None, path=None):
         super(XLSImporter, self).__init__(project=project)
         self.path = path
+        self._header_map = None
 
     def get_header_map(self):
-        headers = {}
-        EXCLUDE_HEADERS = base.EXCLUDE_HEADERS.copy()
-        EXCLUDE_HEADERS.extend(self.EXCLUDE_IDS)
-        workbook = pd.read_excel(self.path, sheetname=None)
-        for sheet in workbook.keys():
-            worksheet = workbook[sheet]
-            heads = []
-            headers[sheet] = heads
-            for col in worksheet.columns.tolist():
-                if not (col.startswith(
-                        ('_', 'meta/')) or col in EXCLUDE_HEADERS):
-                    heads.append(col.lower())
-        return headers
+        if self._header_map is None:
+            headers = {}
+            EXCLUDE_HEADERS = base.EXCLUDE_HEADERS.copy()
+            EXCLUDE_HEADERS.extend(self.EXCLUDE_IDS)
+            workbook = load_workbook(self.path, read_only=True,
+                                     data_only=True)
+            try:
+                for sheet, worksheet in read_workbook(workbook).items():
+                    headers[sheet] = [
+                        col.lower() for col in worksheet.columns
+                        if not (col.startswith(('_', 'meta/')) or
+                                col in EXCLUDE_HEADERS)
+                    ]
+            finally:
+                workbook.close()
+            self._header_map = headers
+        return self._header_map
 
     def get_headers(self):
-        return itertools.chain.from_iterable(self.get_header_map().values())
+        return [header for heads in self.get_header_map().values()
+                for header in heads]
 
     def import_data(self, config, **kwargs):
         entity_types = config['entity_types']
-        df = pd.read_excel(self.path, sheetname=None)
-        data = get_csv_from_dataframe(df, entity_types)
-        with io.StringIO(data) as csvfile:
-            self._import(config, csvfile)
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            rows = get_rows_from_worksheets(
+                read_workbook(workbook), entity_types)
+            return self._import(config, RowReader(rows), **kwargs)
+        finally:
+            workbook.close()
 
+    def validate_data(self, config, **kwargs):
+        entity_types = config['entity_types']
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            rows = get_rows_from_worksheets(
+                read_workbook(workbook), entity_types)
+            return self._validate(config, RowReader(rows), **kwargs)
+        finally:
+            workbook.close()
+
+
+class Sheet():
+    """The column names of a worksheet and an iterator over its rows, which
+    are lists of strings formatted like pandas writes them to a CSV file."""
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def is_empty(self):
+        try:
+            first = next(self.rows)
+        except StopIteration:
+            return True
+        self.rows = _prepend(first, self.rows)
+        return False
+
+
+class RowReader():
+    """Iterates over rows like a `csv.reader`, including `line_num`."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.line_num = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = next(self.rows)
+        self.line_num += 1
+        return row
+
+
+def _prepend(item, iterator):
+    yield item
+    yield from iterator
+
+
+def format_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime.date) and not isinstance(
+            value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    return str(value)
+
+
+def get_column_names(header):
+    """Names the columns of a header row, naming blank headers and numbering
+    repeated ones like pandas does."""
+    header = list(header)
+    while header and header[-1] in (None, ''):
+        header.pop()
+
+    columns, seen = [], {}
+    for i, name in enumerate(header):
+        name = 'Unnamed: {}'.format(i) if name in (None, '') else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = '{}.{}'.format(name, seen[name])
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
+
+
+def read_worksheet(worksheet):
+    """Reads a read-only worksheet lazily, one row at a time. Blank rows are
+    skipped."""
+    rows = worksheet.iter_rows()
+    header = next(rows, ())
+    columns = get_column_names(cell.value for cell in header)
 
-def get_csv_from_dataframe(df, entity_types):
-    locations, parties, relationships = None, None, None
+    def read_rows():
+        num_columns = len(columns)
+        for cells in rows:
+            values = [cell.value for cell in cells[:num_columns]]
+            if all(value in (None, '') for value in values):
+                continue
+            row = [format_cell(value) for value in values]
+            row.extend([''] * (num_columns - len(row)))
+            yield row
+
+    return Sheet(columns, read_rows())
+
+
+def read_workbook(workbook):
+    return OrderedDict(
+        (worksheet.title, read_worksheet(worksheet))
+        for worksheet in workbook.worksheets)
+
+
+def prefix_columns(worksheet, prefix):
+    return [prefix + col.lower() for col in worksheet.columns]
+
+
+def get_position(columns, name):
+    try:
+        return columns.index(name)
+    except ValueError:
+        raise exceptions.DataImportError(
+            _("Missing '%s' column.") % name)
+
+
+def index_rows(rows, position):
+    """Groups rows by the value in the given column, in order."""
+    index = OrderedDict()
+    for row in rows:
+        index.setdefault(row[position], []).append(row)
+    return index
+
+
+def outer_join(left_rows, left_position, right_index, num_left_columns,
+               num_right_columns):
+    """
+    Streams the full outer join of rows with the rows in an index by a key
+    column: each left row is joined with all right rows of its key, or padded
+    if there are none; right rows that no left row joined with follow at the
+    end.
+    """
+    joined = set()
+    for left in left_rows:
+        key = left[left_position]
+        matches = right_index.get(key)
+        if matches is None:
+            yield left + [''] * num_right_columns
+            continue
+        joined.add(key)
+        for right in matches:
+            yield left + right
+    for key, matches in right_index.items():
+        if key not in joined:
+            for right in matches:
+                yield [''] * num_left_columns + right
+
+
+def drop_columns(columns, rows, drop):
+    positions = [i for i, col in enumerate(columns) if col not in drop]
+    return ([columns[i] for i in positions],
+            ([row[i] for i in positions] for row in rows))
+
+
+def get_rows_from_worksheets(worksheets, entity_types):
+    """
+    Returns the rows to import from the worksheets of an XLS file, header row
+    first. When importing locations and parties, the locations are joined with
+    their relationships and the relationships with their parties; the
+    relationships and parties are indexed by the IDs they are joined on, while
+    the locations are streamed.
+    """
     try:
         if 'SU' in entity_types and 'PT' in entity_types:
-            locations = df['locations']
-            parties = df['parties']
-            relationships = df['relationships']
-            if not (locations.empty or
-                    relationships.empty or parties.empty):
-                locations.rename(
-                    columns=lambda x: 'spatialunit::' + x.lower(),
-                    inplace=True
-                )
-                relationships.rename(
-                    columns=lambda x: 'tenurerelationship::' + x.lower(),
-                    inplace=True)
-                parties.rename(
-                    columns=lambda x: 'party::' + x.lower(), inplace=True
-                )
-                # join locations and relationships on spatial_id's
-                joined = pd.merge(
-                    locations, relationships, left_on='spatialunit::id',
-                    right_on='tenurerelationship::spatial_unit_id',
-                    how='outer'
-                )
-                # then join to parties on party_id
-                merged = pd.merge(
-                    joined, parties, left_on='tenurerelationship::party_id',
-                    right_on='party::id', how='outer'
-                )
-                # drop unused columns
-                drop_cols = ['spatialunit::id', 'party::id']
-                merged.drop(drop_cols, inplace=True, axis=1)
-
-                return merged.to_csv(index=False, index_label=False)
-            else:
-                raise exceptions.DataImportError(
-                    _('Empty worksheet.'))
+            locations = worksheets['locations']
+            parties = worksheets['parties']
+            relationships = worksheets['relationships']
+            if (locations.is_empty() or relationships.is_empty() or
+                    parties.is_empty()):
+                raise exceptions.DataImportError(_('Empty worksheet.'))
+
+            location_cols = prefix_columns(locations, 'spatialunit::')
+            relationship_cols = prefix_columns(
+                relationships, 'tenurerelationship::')
+            party_cols = prefix_columns(parties, 'party::')
+
+            # join locations and relationships on spatial_id's
+            joined_cols = location_cols + relationship_cols
+            joined = outer_join(
+                locations.rows,
+                get_position(location_cols, 'spatialunit::id'),
+                index_rows(
+                    relationships.rows,
+                    get_position(relationship_cols,
+                                 'tenurerelationship::spatial_unit_id')),
+                len(location_cols), len(relationship_cols))
+            # then join to parties on party_id
+            merged = outer_join(
+                joined,
+                get_position(joined_cols, 'tenurerelationship::party_id'),
+                index_rows(parties.rows,
+                           get_position(party_cols, 'party::id')),
+                len(joined_cols), len(party_cols))
+            # drop unused columns
+            columns, rows = drop_columns(
+                joined_cols + party_cols, merged,
+                ['spatialunit::id', 'party::id'])
         elif 'SU' in entity_types and 'PT' not in entity_types:
-            locations = df['locations']
-            # rename location type
-            locations.rename(
-                columns=lambda x: 'spatialunit::' + x.lower(), inplace=True
-            )
-            drop_cols = ['spatialunit::id']
-            locations.drop(drop_cols, inplace=True, axis=1)
-            return locations.to_csv(index=False, index_label=False)
+            locations = worksheets['locations']
+            columns, rows = drop_columns(
+                prefix_columns(locations, 'spatialunit::'), locations.rows,
+                ['spatialunit::id'])
         elif 'SU' not in entity_types and 'PT' in entity_types:
-            parties = df['parties']
-            parties.rename(
-                columns=lambda x: 'party::' + x.lower(), inplace=True
-            )
-            drop_cols = ['party::id']
-            parties.drop(drop_cols, inplace=True, axis=1)
-            return parties.to_csv(index=False, index_label=False)
+            parties = worksheets['parties']
+            columns, rows = drop_columns(
+                prefix_columns(parties, 'party::'), parties.rows,
+                ['party::id'])
         else:
             raise exceptions.DataImportError(
                 _('Unsupported import format.'))
     except KeyError as e:
         raise exceptions.DataImportError(
             _("Missing '%s' worksheet.") % e.args[0])
+    return _prepend(columns, rows)
@@ -1,6 +1,7 @@
 from django.utils.functional import cached_property
 from django.core.urlresolvers import reverse
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django_countries.fields import CountryField
 from django.contrib.contenttypes.fields import GenericRelation
@@ -32,6 +33,17 @@ def get_policy_instance(policy_name, variables):
     return (policy, variables)
 
 
+def get_contributor_cache_key(user_id, project_id):
+    return 'organization:contributor:{}:{}'.format(user_id, project_id)
+
+
+def invalidate_contributor_cache(user_id, project_ids):
+    """Clears the cached permissions of a user to contribute data to
+    projects, after the user's roles in them have changed."""
+    cache.delete_many([get_contributor_cache_key(user_id, project_id)
+                       for project_id in project_ids])
+
+
 @permissioned_model
 class Organization(SlugModel, RandomIDModel):
     name = models.CharField(max_length=200, unique=True)
@@ -159,6 +171,9 @@ def assign_org_policies(instance, delete=False):
         assigned_policies.remove(org_member)
 
     instance.user.assign_policies(*assigned_policies)
+    invalidate_contributor_cache(
+        instance.user_id,
+        instance.organization.projects.values_list('id', flat=True))
 
 
 @receiver(models.signals.post_save, sender=OrganizationRole)
@@ -391,6 +406,7 @@ def assign_prj_policies(role, delete=False):
         assigned_policies.append(project_manager)
 
     role.user.assign_policies(*assigned_policies)
+    invalidate_contributor_cache(role.user_id, [role.project_id])
 
 
 @receiver(models.signals.post_save, sender=ProjectRole)
@@ -1,37 +1,190 @@
+import glob
+import os
+import shutil
+from functools import partial
+
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.core.urlresolvers import reverse
-from rest_framework_tmp_scoped_token import TokenManager
+from django.core.files import File
+from django.core.files.storage import DefaultStorage
+from django.utils.translation import ungettext
+from celery.exceptions import Ignore
 
+from accounts.models import User
+from core.util import random_id
+from resources.utils.io import ensure_dirs
+from search.export.all import AllExporter
+from search.export.database import (count_project_entities,
+                                    read_project_entities)
+from search.export.resource import ResourceExporter
+from search.export.shape import ShapeExporter
+from search.export.xls import XLSExporter
 from tasks.celery import app
+from tasks.models import TaskResult
 
+from .importers.base import get_importer
+from .importers.exceptions import DataImportError
+from .models import Project
 
-@app.task(name='export.project')
-def export(org_slug, project_slug, api_key, output_type):
-    pass
+EXPORTERS = {
+    'xls': XLSExporter,
+    'shp': ShapeExporter,
+    'res': ResourceExporter,
+    'all': AllExporter,
+}
 
 
-def schedule_project_export(project, user, output_type):
-    org_slug = project.organization.slug
-    prj_slug = project.slug
-    endpoint = reverse(
-        'api:v1:organization:project_detail',
-        kwargs={'organization': org_slug, 'project': prj_slug})
-    token = TokenManager(
-        user=user,
-        endpoints={'GET': [endpoint]},
-        max_age=60 * 60 * 12,  # 12 hr expiration,
-        recipient='export-service')
-    token = token.generate_token()
+def report_progress(task_id, entities, total):
+    """Passes the entities through, recording the number of entities
+    consumed so far in the result of the task every
+    EXPORT_PROGRESS_INTERVAL entities and once all have been consumed."""
+    def record(count):
+        if task_id:
+            TaskResult.objects.update_or_create(
+                task_id=task_id,
+                defaults={'status': 'STARTED',
+                          'result': {'progress': count, 'total': total}})
+
+    count = 0
+    for count, entity in enumerate(entities, 1):
+        if count % settings.EXPORT_PROGRESS_INTERVAL == 0:
+            record(count)
+        yield entity
+    record(count)
+
+
+@app.task(name='export.project', bind=True)
+def export(self, org_slug, project_slug, output_type):
+    project = Project.objects.get(
+        organization__slug=org_slug, slug=project_slug)
+    task_id = self.request.id
+    base_path = os.path.join(
+        ensure_dirs(), '{}-{}'.format(project.id, task_id or random_id()))
+
+    entities = report_progress(
+        task_id,
+        read_project_entities(project),
+        count_project_entities(project))
+    exporter = EXPORTERS[output_type](project)
+    try:
+        path, _ = exporter.make_download(base_path, entities)
+
+        filename = '{}{}'.format(project.slug, os.path.splitext(path)[1])
+        with open(path, 'rb') as f:
+            url = DefaultStorage().save(
+                'exports/{}/{}'.format(random_id(), filename), File(f))
+    finally:
+        for temp_path in glob.glob(base_path + '*'):
+            if os.path.isdir(temp_path):
+                shutil.rmtree(temp_path)
+            else:
+                os.remove(temp_path)
 
+    return {'links': [{'url': url, 'text': filename}]}
+
+
+def schedule_project_export(project, user, output_type):
     payload = {
-        'org_slug': org_slug,
-        'project_slug': prj_slug,
-        'api_key': token,
+        'org_slug': project.organization.slug,
+        'project_slug': project.slug,
         'output_type': output_type,
     }
     return export.apply_async(
         kwargs=payload,
         creator_id=user.id,
         related_content_type_id=ContentType.objects.get_for_model(project).id,
-        related_object_id=project.id
+        related_object_id=project.id,
+        is_result=True,
+    )
+
+
+def get_import_checkpoint(task_id):
+    """Returns the checkpoint of an import task that was interrupted."""
+    try:
+        result = TaskResult.objects.get(task_id=task_id).result
+    except TaskResult.DoesNotExist:
+        return None
+    return result.get('checkpoint') if isinstance(result, dict) else None
+
+
+def record_import_progress(task_id, checkpoint):
+    """Records the number of rows imported and the checkpoint of an import
+    task, in the transaction of the rows last imported."""
+    if task_id:
+        TaskResult.objects.update_or_create(
+            task_id=task_id,
+            defaults={'status': 'STARTED',
+                      'result': {'progress': checkpoint['rows'],
+                                 'checkpoint': checkpoint}})
+
+
+# The message is acknowledged once the task is done, so that an import that
+# is interrupted is delivered again, with its task ID, and resumes from its
+# last checkpoint
+@app.task(name='import.project', bind=True,
+          acks_late=True, reject_on_worker_lost=True)
+def import_data(self, org_slug, project_slug, file_name, config,
+                user_id=None):
+    project = Project.objects.get(
+        organization__slug=org_slug, slug=project_slug)
+    user = User.objects.get(id=user_id) if user_id else None
+    task_id = self.request.id
+    storage = DefaultStorage()
+
+    checkpoint = get_import_checkpoint(task_id)
+    path = storage.open(file_name)
+    config = dict(config, project=project, file=path)
+    importer = get_importer(config['type'], project, path)
+    errors = []
+    try:
+        if checkpoint is None:
+            # All rows are validated before the first one is imported, since
+            # the import wizard only validates the first rows
+            report = importer.validate_data(config)
+            if not report.is_valid:
+                errors = report.get_messages()
+                raise DataImportError(ungettext(
+                    "%d row is invalid.", "%d rows are invalid.",
+                    report.num_invalid_rows) % report.num_invalid_rows)
+        num_rows = importer.import_data(
+            config,
+            chunk_size=settings.IMPORT_CHUNK_SIZE,
+            checkpoint=checkpoint,
+            on_commit=partial(record_import_progress, task_id),
+            user=user)
+    except DataImportError as e:
+        # The importer deleted the rows of the chunks committed before the
+        # error, so the corrected file can be imported again
+        storage.delete(file_name)
+        if not task_id:
+            raise
+        TaskResult.objects.update_or_create(
+            task_id=task_id,
+            defaults={'status': 'FAILURE',
+                      'result': {'progress': 0, 'error': str(e),
+                                 'errors': errors}})
+        raise Ignore()
+    finally:
+        os.remove(path)
+
+    storage.delete(file_name)
+    return {'progress': num_rows}
+
+
+def schedule_project_import(project, user, file_name, config):
+    """Schedules the import of a file saved to the default storage under
+    `file_name`. `config` is the importer config without the project and
+    the path of the file."""
+    payload = {
+        'org_slug': project.organization.slug,
+        'project_slug': project.slug,
+        'file_name': file_name,
+        'config': config,
+        'user_id': user.id,
+    }
+    return import_data.apply_async(
+        kwargs=payload,
+        creator_id=user.id,
+        related_content_type_id=ContentType.objects.get_for_model(project).id,
+        related_object_id=project.id,
     )
@@ -1,23 +1,33 @@
+import datetime
+import os
+from unittest.mock import patch
+
 import pytest
 
-import pandas as pd
 from core.tests.utils.cases import FileStorageTestCase, UserTestCase
 from core.messages import SANITIZE_ERROR
 from django.contrib.contenttypes.models import ContentType
-from django.contrib.gis.geos import LineString, Point, Polygon
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry, LineString, Point, Polygon
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from jsonattrs.models import Attribute, AttributeType, Schema
+from openpyxl import Workbook, load_workbook
 from party.models import Party, TenureRelationship
+from party.tests.factories import PartyFactory
 from party.choices import TENURE_RELATIONSHIP_TYPES
-from questionnaires.models import Questionnaire
+from questionnaires.models import Questionnaire, QuestionOption
 from questionnaires.tests import factories as q_factories
 from resources.tests.utils import clear_temp  # noqa
 from spatial.models import SpatialUnit
 from spatial.choices import TYPE_CHOICES
+from xforms.utils import odk_geom_to_wkt
 
 from ..importers import csv, exceptions, validators, xls
+from ..importers import geometry as geometry_utils
 from ..importers.base import Importer
+from ..importers.bulk import BulkCreator
+from ..importers.mapper import RowMapper
 from ..tests.factories import ProjectFactory
 
 
@@ -40,6 +50,12 @@ class BaseImporterTest(UserTestCase, TestCase):
         with pytest.raises(NotImplementedError):
             importer.import_data(config=None)
 
+    def test_validate_data_not_implemented(self):
+        project = ProjectFactory.create()
+        importer = Importer(project)
+        with pytest.raises(NotImplementedError):
+            importer.validate_data(config=None)
+
     def test_get_headers_not_implemented(self):
         project = ProjectFactory.create()
         importer = Importer(project)
@@ -480,6 +496,118 @@ class CSVImportTest(UserTestCase, FileStorageTestCase, TestCase):
         assert len(tenure_relationships[0].attributes) == 2
         assert tenure_relationships[0].attributes == tr_attrs
 
+    @override_settings(IMPORT_BATCH_SIZE=4)
+    def test_import_data_in_batches(self):
+        importer = csv.CSVImporter(
+            project=self.project, path=self.path + self.valid_csv)
+        config = {
+            'file': self.path + self.valid_csv,
+            'entity_types': ['PT', 'SU'],
+            'party_name_field': 'name_of_hh',
+            'party_type_field': 'party_type',
+            'location_type_field': 'location_type',
+            'geometry_field': 'location_geometry',
+            'attributes': self.attributes,
+            'project': self.project,
+            'allowed_tenure_types': [t[0] for t in TENURE_RELATIONSHIP_TYPES],
+            'allowed_location_types': [choice[0] for choice in TYPE_CHOICES]
+        }
+        importer.import_data(config)
+        assert Party.objects.all().count() == 10
+        assert SpatialUnit.objects.all().count() == 10
+        assert TenureRelationship.objects.all().count() == 10
+
+        # History records are written in bulk
+        assert Party.history.filter(history_type='+').count() == 10
+        assert SpatialUnit.history.filter(history_type='+').count() == 10
+        assert TenureRelationship.history.filter(
+            history_type='+').count() == 10
+
+        # Labels are set from the location type options
+        labels = dict(QuestionOption.objects.filter(
+            question__name='location_type',
+            question__questionnaire__id=self.project.current_questionnaire
+        ).values_list('name', 'label_xlat'))
+        for su in SpatialUnit.objects.all():
+            assert su.label == labels.get(su.type)
+
+        for rel in TenureRelationship.objects.all():
+            assert rel.party.project == self.project
+            assert rel.spatial_unit.project == self.project
+
+    def test_import_data_in_chunks(self):
+        importer = csv.CSVImporter(
+            project=self.project, path=self.path + self.valid_csv)
+        config = {
+            'file': self.path + self.valid_csv,
+            'entity_types': ['PT', 'SU'],
+            'party_name_field': 'name_of_hh',
+            'party_type_field': 'party_type',
+            'location_type_field': 'location_type',
+            'geometry_field': 'location_geometry',
+            'attributes': self.attributes,
+            'project': self.project,
+            'allowed_tenure_types': [t[0] for t in TENURE_RELATIONSHIP_TYPES],
+            'allowed_location_types': [choice[0] for choice in TYPE_CHOICES]
+        }
+        checkpoints = []
+
+        def on_commit(checkpoint):
+            checkpoints.append(checkpoint)
+            assert Party.objects.count() == checkpoint['rows']
+
+        assert importer.import_data(
+            config, chunk_size=4, on_commit=on_commit) == 10
+        assert [c['rows'] for c in checkpoints] == [4, 8, 10]
+        assert Party.objects.count() == 10
+
+        # Resuming after the second chunk imports the remaining rows
+        importer = csv.CSVImporter(
+            project=self.project, path=self.path + self.valid_csv)
+        assert importer.import_data(
+            config, chunk_size=4, checkpoint=checkpoints[1]) == 10
+        assert Party.objects.count() == 12
+        assert SpatialUnit.objects.count() == 12
+        assert TenureRelationship.objects.count() == 12
+
+    def test_failed_import_deletes_committed_chunks(self):
+        project = ProjectFactory.create()
+        path = os.path.join(settings.MEDIA_ROOT, 'temp', 'chunks.csv')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.addCleanup(os.remove, path)
+        with open(path, 'w') as f:
+            f.write('name,party_type,geometry,tenure_type\n')
+            for i in range(5):
+                f.write('Party {},IN,POINT ({} 10),\n'.format(i, i))
+            f.write('Party 5,IN,POINT (x),\n')
+        config = {
+            'entity_types': ['PT'],
+            'party_name_field': 'name',
+            'party_type_field': 'party_type',
+            'geometry_field': 'geometry',
+            'attributes': [],
+            'project': project,
+        }
+        party = PartyFactory.create(project=project)
+        checkpoints = []
+
+        def interrupt(checkpoint):
+            if checkpoints:
+                raise KeyboardInterrupt()
+            checkpoints.append(checkpoint)
+
+        importer = csv.CSVImporter(project=project, path=path)
+        with pytest.raises(KeyboardInterrupt):
+            importer.import_data(config, chunk_size=2, on_commit=interrupt)
+        assert Party.objects.count() == 3
+
+        # The rows committed before the import was resumed are deleted too
+        importer = csv.CSVImporter(project=project, path=path)
+        with pytest.raises(exceptions.DataImportError):
+            importer.import_data(config, chunk_size=2,
+                                 checkpoint=checkpoints[0])
+        assert list(Party.objects.all()) == [party]
+
     def test_import_parties_only(self):
         importer = csv.CSVImporter(
             project=self.project, path=self.path + self.valid_csv)
@@ -743,6 +871,26 @@ class XLSImportTest(UserTestCase, FileStorageTestCase, TestCase):
         assert len(tenure_relationships[0].attributes) == 2
         assert tenure_relationships[0].attributes == tr_attrs
 
+    def test_validate_data(self):
+        importer = xls.XLSImporter(
+            project=self.project, path=self.path + self.valid_xls)
+        config = {
+            'type': 'xls',
+            'entity_types': ['SU', 'PT'],
+            'party_name_field': 'name',
+            'party_type_field': 'type',
+            'location_type_field': 'type',
+            'geometry_field': 'geometry.ewkt',
+            'attributes': self.attributes,
+            'allowed_tenure_types': [t[0] for t in TENURE_RELATIONSHIP_TYPES],
+            'allowed_location_types': [choice[0] for choice in TYPE_CHOICES]
+        }
+        report = importer.validate_data(config)
+        assert report.is_valid
+        assert report.num_rows == 10
+        assert Party.objects.all().count() == 0
+        assert SpatialUnit.objects.all().count() == 0
+
     def test_import_locations_only(self):
         importer = xls.XLSImporter(
             project=self.project, path=self.path + self.valid_xls)
@@ -806,6 +954,44 @@ class XLSImportTest(UserTestCase, FileStorageTestCase, TestCase):
         assert len(pty_attrs) == 8
         assert pty_attrs['name_father_hus'] == 'মৃত কুব্বাত মন্ডল'
 
+    def test_resume_from_checkpoint(self):
+        config = {
+            'file': self.path + self.one_to_many_xls,
+            'type': 'xls',
+            'entity_types': ['SU', 'PT'],
+            'party_name_field': 'name',
+            'party_type_field': 'type',
+            'location_type_field': 'type',
+            'geometry_field': 'geometry.ewkt',
+            'attributes': self.attributes,
+            'project': self.project,
+            'allowed_tenure_types': [t[0] for t in TENURE_RELATIONSHIP_TYPES],
+            'allowed_location_types': [choice[0] for choice in TYPE_CHOICES]
+        }
+        checkpoints = []
+
+        def interrupt(checkpoint):
+            # Fails the second chunk, which is rolled back
+            if checkpoints:
+                raise KeyboardInterrupt()
+            checkpoints.append(checkpoint)
+
+        importer = xls.XLSImporter(
+            project=self.project, path=self.path + self.one_to_many_xls)
+        with pytest.raises(KeyboardInterrupt):
+            importer.import_data(config, chunk_size=3, on_commit=interrupt)
+        assert checkpoints[0]['rows'] == 3
+        assert checkpoints[0]['parties']
+
+        # Rows after the checkpoint refer to locations and parties created
+        # before it
+        importer = xls.XLSImporter(
+            project=self.project, path=self.path + self.one_to_many_xls)
+        importer.import_data(config, chunk_size=3, checkpoint=checkpoints[0])
+        assert Party.objects.all().count() == 10
+        assert SpatialUnit.objects.all().count() == 9
+        assert TenureRelationship.objects.all().count() == 6
+
     def test_one_to_many_relationships(self):
         importer = xls.XLSImporter(
             project=self.project, path=self.path + self.one_to_many_xls)
@@ -840,34 +1026,112 @@ class XLSImportTest(UserTestCase, FileStorageTestCase, TestCase):
         party = parties[0]
         assert party.tenure_relationships.all().count() == 3
 
+    def read_worksheets(self):
+        workbook = load_workbook(self.path + self.valid_xls, read_only=True)
+        self.addCleanup(workbook.close)
+        return xls.read_workbook(workbook)
+
+    def test_get_header_map_is_cached(self):
+        importer = xls.XLSImporter(
+            project=self.project, path=self.path + self.valid_xls)
+        header_map = importer.get_header_map()
+        assert set(header_map.keys()) == {
+            'locations', 'parties', 'relationships'}
+        assert 'party_id' not in header_map['relationships']
+        assert 'geometry.ewkt' in header_map['locations']
+        with patch('organization.importers.xls.load_workbook') as load:
+            assert importer.get_header_map() is header_map
+            assert list(importer.get_headers())
+        load.assert_not_called()
+
+    def test_get_rows_from_worksheets(self):
+        worksheets = {
+            'locations': xls.Sheet(
+                ['id', 'Type'], iter([['l1', 'PA'], ['l2', 'BU']])),
+            'relationships': xls.Sheet(
+                ['id', 'party_id', 'spatial_unit_id', 'tenure_type'],
+                iter([['r1', 'p1', 'l1', 'CU'], ['r2', 'p2', 'l1', 'OW'],
+                      ['r3', 'p1', 'l3', 'CU']])),
+            'parties': xls.Sheet(
+                ['id', 'name'], iter([['p1', 'Jo'], ['p2', 'Al'],
+                                      ['p3', 'Ed']])),
+        }
+        rows = list(xls.get_rows_from_worksheets(worksheets, ['SU', 'PT']))
+        assert rows == [
+            ['spatialunit::type', 'tenurerelationship::id',
+             'tenurerelationship::party_id',
+             'tenurerelationship::spatial_unit_id',
+             'tenurerelationship::tenure_type', 'party::name'],
+            ['PA', 'r1', 'p1', 'l1', 'CU', 'Jo'],
+            ['PA', 'r2', 'p2', 'l1', 'OW', 'Al'],
+            ['BU', '', '', '', '', ''],
+            ['', 'r3', 'p1', 'l3', 'CU', 'Jo'],
+            ['', '', '', '', '', 'Ed'],
+        ]
+
+    def test_read_worksheet(self):
+        worksheet = xls.read_workbook(Workbook())['Sheet']
+        assert worksheet.columns == []
+        assert worksheet.is_empty()
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Name', 'name', None, 'Age', 'Age'])
+        sheet.append(['Jo', None, None, 4.0, 0.5])
+        sheet.append([None, None, None, None, None])
+        sheet.append(['Al', 'x', 'y', True, datetime.date(2018, 1, 2)])
+        worksheet = xls.read_worksheet(sheet)
+        assert worksheet.columns == ['Name', 'name', 'Unnamed: 2', 'Age',
+                                     'Age.1']
+        assert list(worksheet.rows) == [
+            ['Jo', '', '', '4', '0.5'],
+            ['Al', 'x', 'y', 'True', '2018-01-02 00:00:00'],
+        ]
+
+    def test_row_reader(self):
+        reader = xls.RowReader([['a'], ['b']])
+        assert reader.line_num == 0
+        assert next(reader) == ['a']
+        assert list(reader) == [['b']]
+        assert reader.line_num == 2
+
     def test_missing_relationship_tab(self):
-        df = pd.read_excel(self.path + self.valid_xls, sheetname=None)
-        del df['relationships']
+        worksheets = self.read_worksheets()
+        del worksheets['relationships']
         entity_types = ['SU', 'PT']
         with pytest.raises(exceptions.DataImportError) as e:
-            xls.get_csv_from_dataframe(df, entity_types)
+            xls.get_rows_from_worksheets(worksheets, entity_types)
         assert e is not None
         assert str(e.value) == (
             "Error importing file: Missing 'relationships' worksheet."
         )
 
+    def test_missing_id_column(self):
+        worksheets = self.read_worksheets()
+        worksheets['parties'] = xls.Sheet(['name'], iter([['Jo']]))
+        entity_types = ['SU', 'PT']
+        with pytest.raises(exceptions.DataImportError) as e:
+            xls.get_rows_from_worksheets(worksheets, entity_types)
+        assert str(e.value) == (
+            "Error importing file: Missing 'party::id' column."
+        )
+
     def test_empty_party_data(self):
-        df = pd.read_excel(self.path + self.valid_xls, sheetname=None)
-        empty_parties = pd.DataFrame()
-        df['parties'] = empty_parties
+        worksheets = self.read_worksheets()
+        worksheets['parties'] = xls.Sheet([], iter([]))
         entity_types = ['SU', 'PT']
         with pytest.raises(exceptions.DataImportError) as e:
-            xls.get_csv_from_dataframe(df, entity_types)
+            xls.get_rows_from_worksheets(worksheets, entity_types)
         assert e is not None
         assert str(e.value) == (
             'Error importing file: Empty worksheet.'
         )
 
     def test_invalid_entity_type(self):
-        df = pd.read_excel(self.path + self.valid_xls, sheetname=None)
+        worksheets = self.read_worksheets()
         entity_types = ['INVALID']
         with pytest.raises(exceptions.DataImportError) as e:
-            xls.get_csv_from_dataframe(df, entity_types)
+            xls.get_rows_from_worksheets(worksheets, entity_types)
         assert e is not None
         assert str(e.value) == (
             'Error importing file: Unsupported import format.'
@@ -1098,3 +1362,299 @@ class ImportConditionalAttributesTest(UserTestCase, FileStorageTestCase,
         # test tenure relationship creation
         tenure_relationships = TenureRelationship.objects.all()
         assert len(tenure_relationships) == 2
+
+
+class BulkCreatorTest(UserTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = ProjectFactory.create()
+
+    def test_add_and_flush(self):
+        creator = BulkCreator(self.project, batch_size=10)
+        su = creator.add(SpatialUnit(project=self.project, type='PA'))
+        party = creator.add(Party(project=self.project, name='Party',
+                                  type='IN'))
+        creator.add(TenureRelationship(
+            project=self.project, party=party, spatial_unit=su,
+            tenure_type='CU'))
+        assert su.id and party.id
+        assert SpatialUnit.objects.count() == 0
+
+        creator.flush()
+        assert SpatialUnit.objects.get(id=su.id)
+        assert Party.objects.get(id=party.id)
+        rel = TenureRelationship.objects.get()
+        assert rel.party_id == party.id
+        assert rel.spatial_unit_id == su.id
+        assert Party.history.get().id == party.id
+        assert Party.history.get().history_type == '+'
+
+    def test_add_flushes_full_batches(self):
+        creator = BulkCreator(self.project, batch_size=2)
+        creator.add(Party(project=self.project, name='Party 1', type='IN'))
+        assert Party.objects.count() == 0
+        creator.add(Party(project=self.project, name='Party 2', type='IN'))
+        assert Party.objects.count() == 2
+        creator.add(Party(project=self.project, name='Party 3', type='IN'))
+        assert Party.objects.count() == 2
+        creator.flush()
+        assert Party.objects.count() == 3
+
+    def test_flush_replaces_taken_ids(self):
+        taken = PartyFactory.create(project=self.project)
+        creator = BulkCreator(self.project)
+        su = creator.add(SpatialUnit(project=self.project, type='PA'))
+        party = creator.add(Party(project=self.project, name='Party',
+                                  type='IN'))
+        creator.add(TenureRelationship(
+            project=self.project, party=party, spatial_unit=su,
+            tenure_type='CU'))
+        party.id = taken.id
+
+        creator.flush()
+        assert party.id != taken.id
+        assert Party.objects.count() == 2
+        rel = TenureRelationship.objects.get()
+        assert rel.party_id == party.id
+
+    def test_flush_queries(self):
+        creator = BulkCreator(self.project, batch_size=100)
+        for i in range(20):
+            creator.add(Party(project=self.project, name='Party', type='IN'))
+        # Unique ID check, insert and history insert
+        with self.assertNumQueries(3):
+            creator.flush()
+        assert Party.objects.count() == 20
+
+
+class RowMapperTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = ProjectFactory.create(current_questionnaire='123abc')
+        content_type = ContentType.objects.get(
+            app_label='party', model='party')
+        schema = Schema.objects.create(
+            content_type=content_type,
+            selectors=(self.project.organization.id, self.project.id,
+                       '123abc', ))
+
+        def create_attr(name, type, index):
+            return Attribute.objects.create(
+                schema=schema, name=name, long_name=name,
+                attr_type=AttributeType.objects.get(name=type), index=index,
+                required=False, omit=False)
+
+        self.attr_map = {
+            'party.party': {
+                'DEFAULT': {
+                    'party_age': (create_attr('party_age', 'integer', 0),
+                                  'party.party', 'Party'),
+                    'party_hobbies': (
+                        create_attr('party_hobbies', 'select_multiple', 1),
+                        'party.party', 'Party'),
+                },
+                'GR': {
+                    'party_size': (create_attr('party_size', 'decimal', 2),
+                                   'party.party', 'Party'),
+                }
+            }
+        }
+        self.config = {
+            'party_name_field': 'party_name',
+            'party_type_field': 'party_type',
+            'entity_types': ['PT'],
+            'attributes': ['party::party_age', 'party::party_hobbies',
+                           'party::party_size'],
+            'type': 'xls',
+        }
+
+    def test_map(self):
+        headers = ['party::party_name', 'party::party_type',
+                   'party::party_age', 'party::party_hobbies',
+                   'party::party_size', 'tenurerelationship::party_id']
+        mapper = RowMapper(self.project, headers, self.config, self.attr_map)
+        assert mapper.party_id_position == 5
+        assert mapper.spatial_unit_id_position is None
+
+        row = ['John', 'IN', '42.0', 'chess, go', '3', 'p1']
+        content_types, tenure_type = mapper.map(row)
+        assert tenure_type is None
+        assert content_types['spatial.spatialunit'] is None
+        assert content_types['party.party'] == {
+            'project': self.project,
+            'name': 'John',
+            'type': 'IN',
+            'attributes': {'party_age': 42, 'party_hobbies': ['chess', 'go']}
+        }
+        assert mapper.get_party_id(row) == 'p1'
+        assert mapper.get_spatial_unit_id(row) is None
+
+        row = ['Group', 'GR', '', '', '3', '']
+        content_types, _ = mapper.map(row)
+        assert content_types['party.party']['attributes'] == {
+            'party_size': 3.0}
+
+    def test_missing_column_is_reported_per_row(self):
+        headers = ['party::party_type']
+        mapper = RowMapper(self.project, headers, self.config, {})
+        with pytest.raises(ValidationError) as e:
+            mapper.map(['IN'])
+        assert e.value.message == "No 'party_name' column found."
+
+
+class GeometryParserTest(TestCase):
+
+    def test_parse_odk_geometries(self):
+        values = [
+            '45.56342779158167 -122.67650283873081 0.0 0.0;',
+            '45.56342779158167 -122.67650283873081 0.0 0.0;'
+            '45.56176327330353 -122.67669159919024 0.0 0.0;',
+            '52.9414478 -8.034659 0.0 0.0;52.94134675 -8.0354197 0.0 0.0;'
+            '52.94129841 -8.03517551 0.0 0.0;52.9414478 -8.034659 0.0 0.0;',
+        ]
+        for value in values:
+            # The fast path matches the geometries built through WKT
+            geometry = geometry_utils.parse_geometry(value)
+            expected = GEOSGeometry(odk_geom_to_wkt(value))
+            assert geometry.geom_type == expected.geom_type
+            assert geometry.equals_exact(expected, tolerance=1e-12)
+
+    def test_parse_geometry(self):
+        assert geometry_utils.parse_geometry('') is None
+        point = geometry_utils.parse_geometry('SRID=4326;POINT (30 10)')
+        assert point.srid == 4326
+        assert point.coords == (30, 10)
+        assert geometry_utils.parse_geometry(point.hexewkb.decode()) == point
+        with pytest.raises(ValidationError) as e:
+            geometry_utils.parse_geometry('45.5 -122.6 0.0 0.0;45.5')
+        assert e.value.message == "Invalid geometry."
+
+    def test_parse(self):
+        rows = [(i + 2, ['IN', '10 {} 0 0'.format(i)]) for i in range(250)]
+        rows[5] = (7, ['IN', 'not a geometry'])
+        rows[6] = (8, ['IN'])
+        rows[7] = (9, ['IN', ''])
+
+        for workers in (0, 2):
+            with geometry_utils.GeometryParser(
+                    1, 2, workers=workers, batch_size=240) as parser:
+                parsed = list(parser.parse(rows))
+            assert [(line_num, row) for line_num, row, _ in parsed] == rows
+            geometries = [geometry for _, _, geometry in parsed]
+            assert geometries[0] == Point(0, 10)
+            assert geometries[249] == Point(249, 10)
+            assert geometries[5] is geometry_utils.INVALID
+            assert geometries[6] is geometry_utils.UNPARSED
+            assert geometries[7] is None
+
+    def test_parse_without_geometry_column(self):
+        parser = geometry_utils.GeometryParser(None, 1)
+        assert list(parser.parse([(2, ['a'])])) == [
+            (2, ['a'], geometry_utils.UNPARSED)]
+
+    def test_validate_parsed_geometry(self):
+        config = {
+            'party_name_field': 'party_name',
+            'party_type_field': 'party_type',
+            'geometry_field': 'location_geometry',
+            'type': 'csv'
+        }
+        headers = ['party_name', 'party_type', 'location_geometry']
+        validator = validators.RowValidator(headers, config)
+        assert validator.geometry_position == 2
+        row = ['Party Name', 'IN', 'POINT (30 10)']
+        point = Point(1, 2)
+        assert validator.validate(row, point)[2] is point
+        with pytest.raises(ValidationError) as e:
+            validator.validate(row, geometry_utils.INVALID)
+        assert e.value.message == "Invalid geometry."
+
+    @override_settings(IMPORT_BATCH_SIZE=3)
+    def test_invalid_geometry_line_number(self):
+        project = ProjectFactory.create()
+        path = os.path.join(settings.MEDIA_ROOT, 'temp', 'geometries.csv')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.addCleanup(os.remove, path)
+        with open(path, 'w') as f:
+            f.write('name,party_type,geometry,tenure_type\n')
+            for i in range(5):
+                f.write('Party {},IN,POINT ({} 10),\n'.format(i, i))
+            f.write('Party 5,IN,POINT (x),\n')
+
+        importer = csv.CSVImporter(project=project, path=path)
+        config = {
+            'entity_types': ['PT'],
+            'party_name_field': 'name',
+            'party_type_field': 'party_type',
+            'geometry_field': 'geometry',
+            'attributes': [],
+            'project': project,
+        }
+        with pytest.raises(exceptions.DataImportError) as e:
+            importer.import_data(config)
+        assert e.value.line_num == 7
+        assert str(e.value) == (
+            'Error importing file at line 7: Invalid geometry.')
+        assert Party.objects.count() == 0
+
+
+class ValidateDataTest(UserTestCase, TestCase):
+
+    def test_report(self):
+        report = validators.ValidationReport()
+        report.max_messages = 2
+        report.max_lines = 2
+        assert report.is_valid
+        assert report.get_messages() == []
+
+        for line_num in (2, 3, 5):
+            report.add_error('Invalid geometry.', line_num)
+        report.add_error('Invalid tenure_type.', 4)
+        report.add_error('Invalid location_type.', 6)
+        assert not report.is_valid
+        assert report.num_invalid_rows == 5
+        assert report.get_messages() == [
+            'Invalid geometry. (3 rows: lines 2, 3, ...)',
+            'Invalid tenure_type. (1 row: line 4)',
+            '1 more row has other errors.',
+        ]
+
+    def test_validate_csv(self):
+        project = ProjectFactory.create()
+        path = os.path.join(settings.MEDIA_ROOT, 'temp', 'validate.csv')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.addCleanup(os.remove, path)
+        with open(path, 'w') as f:
+            f.write('name,party_type,geometry,tenure_type\n'
+                    'Party 0,IN,POINT (0 10),\n'
+                    'Party 1,IN,POINT (x),\n'
+                    'Party 2,IN,POINT (2 10),XX\n'
+                    'Party 3,IN\n'
+                    'Party 4,IN,POINT (y),\n')
+
+        importer = csv.CSVImporter(project=project, path=path)
+        config = {
+            'type': 'csv',
+            'entity_types': ['PT'],
+            'party_name_field': 'name',
+            'party_type_field': 'party_type',
+            'geometry_field': 'geometry',
+            'attributes': [],
+            'allowed_tenure_types': [t[0] for t in TENURE_RELATIONSHIP_TYPES],
+        }
+        report = importer.validate_data(config)
+        assert report.num_rows == 5
+        assert report.num_invalid_rows == 4
+        assert report.get_messages() == [
+            'Invalid geometry. (2 rows: lines 3, 6)',
+            "Invalid tenure_type: 'XX'. (1 row: line 4)",
+            'Number of headers and columns do not match. (1 row: line 5)',
+        ]
+        assert config['entity_types'] == ['PT']
+        assert Party.objects.count() == 0
+
+        report = importer.validate_data(config, max_rows=1)
+        assert report.num_rows == 1
+        assert report.is_valid
@@ -1,62 +1,225 @@
+import os
 from unittest.mock import patch
 
+import pytest
 from django.contrib.contenttypes.models import ContentType
-from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.core.files import File
+from django.test import TestCase, override_settings
 from celery import Task
 
 from accounts.tests.factories import UserFactory
+from core.tests.utils.cases import FileStorageTestCase, UserTestCase
+from core.tests.utils.files import make_dirs  # noqa
+from core.util import random_id
+from party.choices import TENURE_RELATIONSHIP_TYPES
+from party.models import Party, TenureRelationship
+from party.tests.factories import TenureRelationshipFactory
+from resources.tests.utils import clear_temp  # noqa
+from resources.utils.io import ensure_dirs
+from search.export.database import count_project_entities
+from spatial.choices import TYPE_CHOICES
+from spatial.models import SpatialUnit
+from spatial.tests.factories import SpatialUnitFactory
+from tasks.models import TaskResult
 
 from .factories import ProjectFactory
-from ..tasks import schedule_project_export, export
+from ..models import Project
+from ..tasks import (schedule_project_export, schedule_project_import,
+                     export, import_data, report_progress)
 
 
+@pytest.mark.usefixtures('clear_temp')
+@pytest.mark.usefixtures('make_dirs')
 class TaskTest(TestCase):
 
-    def test_export_task(self):
+    @patch('organization.tasks.DefaultStorage')
+    def test_export_task(self, storage):
         assert isinstance(export, Task)
         assert export.name == 'export.project'
-        kwargs = {
-            'org_slug': 'my-org',
-            'project_slug': 'my-proj',
-            'api_key': 'a-key',
-            'output_type': 'all',
-        }
-        export(**kwargs)
 
-    @patch('organization.tasks.TokenManager')
+        # The file is passed to the storage, which streams it
+        saved = {}
+
+        def save(name, content):
+            assert isinstance(content, File)
+            saved[name] = b''.join(content.chunks())
+            return '/media/s3/uploads/' + name
+        storage.return_value.save.side_effect = save
+
+        project = ProjectFactory.create()
+        SpatialUnitFactory.create(project=project)
+        TenureRelationshipFactory.create(project=project)
+        result = export.apply(kwargs={
+            'org_slug': project.organization.slug,
+            'project_slug': project.slug,
+            'output_type': 'xls',
+        })
+
+        links = result.get()['links']
+        assert len(links) == 1
+        assert links[0]['text'] == project.slug + '.xlsx'
+        name, content = saved.popitem()
+        assert name.startswith('exports/')
+        assert name.endswith('/' + project.slug + '.xlsx')
+        assert content.startswith(b'PK')
+        assert links[0]['url'] == '/media/s3/uploads/' + name
+
+        # Progress is recorded and temp files are removed
+        task_result = TaskResult.objects.get(task_id=result.id)
+        assert task_result.status == 'STARTED'
+        total = count_project_entities(project)
+        assert total == 4
+        assert task_result.result == {'progress': total, 'total': total}
+        assert not [f for f in os.listdir(ensure_dirs())
+                    if f.startswith(project.id)]
+
+    def test_export_task_with_unknown_project(self):
+        with pytest.raises(Project.DoesNotExist):
+            export(org_slug='my-org', project_slug='my-proj',
+                   output_type='all')
+
+    @override_settings(EXPORT_PROGRESS_INTERVAL=2)
+    def test_report_progress(self):
+        entities = report_progress('abc', iter(range(5)), 5)
+        assert next(entities) == 0
+        assert not TaskResult.objects.filter(task_id='abc').exists()
+        assert next(entities) == 1
+        assert TaskResult.objects.get(task_id='abc').result == {
+            'progress': 2, 'total': 5}
+        assert list(entities) == [2, 3, 4]
+        task_result = TaskResult.objects.get(task_id='abc')
+        assert task_result.status == 'STARTED'
+        assert task_result.result == {'progress': 5, 'total': 5}
+
+    def test_report_progress_without_task_id(self):
+        assert list(report_progress(None, iter(range(3)), 3)) == [0, 1, 2]
+        assert not TaskResult.objects.exists()
+
     @patch('organization.tasks.export')
-    def test_schedule_project_export(self, export_task, token_mgr):
+    def test_schedule_project_export(self, export_task):
         proj = ProjectFactory.build(id='abcd')
         user = UserFactory.build(id=123)
         output_type = 'all'
-        token_mgr.return_value.generate_token.return_value = 'fakeKey'
 
         schedule_project_export(proj, user, output_type)
 
-        # Assert token generated
-        token_mgr.assert_called_once_with(
-            endpoints={'GET': [
-                reverse(
-                    'api:v1:organization:project_detail',
-                    kwargs={
-                        'organization': proj.organization.slug,
-                        'project': proj.slug
-                    }
-                )]},
-            max_age=43200,
-            recipient='export-service',
-            user=user,
-        )
-        token_mgr.return_value.generate_token.assert_called_once_with()
-
         # Assert task scheduled
         export_task.apply_async.assert_called_once_with(
             kwargs={
                 'output_type': output_type,
                 'org_slug': proj.organization.slug,
                 'project_slug': proj.slug,
-                'api_key': 'fakeKey',
+            },
+            creator_id=user.id,
+            related_content_type_id=ContentType.objects.get_for_model(proj).id,
+            related_object_id=proj.id,
+            is_result=True,
+        )
+
+
+@pytest.mark.usefixtures('clear_temp')
+@pytest.mark.usefixtures('make_dirs')
+class ImportTaskTest(UserTestCase, FileStorageTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = ProjectFactory.create()
+        self.config = {
+            'type': 'csv',
+            'entity_types': ['PT', 'SU'],
+            'party_name_field': 'name_of_hh',
+            'party_type_field': 'party_type',
+            'location_type_field': 'location_type',
+            'geometry_field': 'location_geometry',
+            'attributes': [],
+            'allowed_tenure_types': [t[0] for t in TENURE_RELATIONSHIP_TYPES],
+            'allowed_location_types': [choice[0] for choice in TYPE_CHOICES]
+        }
+
+    def save_file(self, path):
+        file_name = 'imports/{}.csv'.format(random_id())
+        with self.get_file(path, 'rb') as f:
+            self.storage.save(file_name, f.read())
+        return file_name
+
+    def apply(self, path, **options):
+        file_name = self.save_file(path)
+        result = import_data.apply(kwargs={
+            'org_slug': self.project.organization.slug,
+            'project_slug': self.project.slug,
+            'file_name': file_name,
+            'config': self.config,
+        }, **options)
+        assert not self.storage.exists(file_name)
+        return result
+
+    def test_import_task(self):
+        assert isinstance(import_data, Task)
+        assert import_data.name == 'import.project'
+        assert import_data.acks_late
+        assert import_data.reject_on_worker_lost
+
+        result = self.apply('/organization/tests/files/test.csv')
+        assert result.get() == {'progress': 10}
+        assert Party.objects.filter(project=self.project).count() == 10
+
+        task_result = TaskResult.objects.get(task_id=result.id)
+        assert task_result.status == 'STARTED'
+        assert task_result.result['progress'] == 10
+        assert task_result.result['checkpoint']['rows'] == 10
+
+    def test_import_task_records_history_user(self):
+        user = UserFactory.create()
+        import_data(org_slug=self.project.organization.slug,
+                    project_slug=self.project.slug,
+                    file_name=self.save_file(
+                        '/organization/tests/files/test.csv'),
+                    config=self.config,
+                    user_id=user.id)
+
+        for model in (SpatialUnit, Party, TenureRelationship):
+            history = model.history.filter(project=self.project)
+            assert history.count() == 10
+            assert all(record.history_user == user for record in history)
+
+    def test_import_task_resumes_after_checkpoint(self):
+        TaskResult.objects.create(
+            task_id='abc', status='STARTED',
+            result={'progress': 6, 'checkpoint': {
+                'rows': 6, 'locations': {}, 'parties': {}}})
+        result = self.apply('/organization/tests/files/test.csv',
+                            task_id='abc')
+        assert result.get() == {'progress': 10}
+        assert Party.objects.filter(project=self.project).count() == 4
+
+    def test_import_task_with_invalid_file(self):
+        result = self.apply('/organization/tests/files/test_invalid.csv')
+        assert result.state == 'IGNORED'
+        assert Party.objects.filter(project=self.project).count() == 0
+
+        task_result = TaskResult.objects.get(task_id=result.id)
+        assert task_result.status == 'FAILURE'
+        assert task_result.result['progress'] == 0
+        # All rows are validated before any is imported
+        assert task_result.result['error'].startswith(
+            'Error importing file: ')
+        assert task_result.result['error'].endswith(' invalid.')
+        assert task_result.result['errors']
+
+    @patch('organization.tasks.import_data')
+    def test_schedule_project_import(self, import_task):
+        proj = ProjectFactory.build(id='abcd')
+        user = UserFactory.build(id=123)
+
+        schedule_project_import(proj, user, 'imports/abc.csv', self.config)
+
+        import_task.apply_async.assert_called_once_with(
+            kwargs={
+                'org_slug': proj.organization.slug,
+                'project_slug': proj.slug,
+                'file_name': 'imports/abc.csv',
+                'config': self.config,
+                'user_id': user.id,
             },
             creator_id=user.id,
             related_content_type_id=ContentType.objects.get_for_model(proj).id,
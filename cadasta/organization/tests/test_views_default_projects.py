@@ -16,7 +16,7 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 from django.http import Http404, HttpRequest
 from django.template.loader import render_to_string
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from jsonattrs.models import Attribute, Schema
 from skivvy import remove_csrf
 from organization.models import OrganizationRole, Project, ProjectRole
@@ -32,9 +32,12 @@ from resources.utils.io import ensure_dirs
 from skivvy import ViewTestCase
 from spatial.models import SpatialUnit
 from spatial.tests.factories import SpatialUnitFactory
+from tasks.models import TaskResult
 from tutelary.models import Policy, assign_user_policies
 
 from .. import forms
+from ..importers.csv import CSVImporter
+from ..tasks import import_data
 from ..views import default
 from .factories import OrganizationFactory, ProjectFactory, clause
 
@@ -1499,12 +1502,24 @@ class ProjectDataDownloadTest(ViewTestCase, UserTestCase, TestCase):
         assert schedule_export.called is False
 
 
+def run_import_locally(kwargs, **options):
+    """Stands in for the broker by running import tasks in the test
+    process."""
+    return import_data.apply(kwargs=kwargs)
+
+
 @pytest.mark.usefixtures('make_dirs')
 @pytest.mark.usefixtures('clear_temp')
+@override_settings(
+    DEFAULT_FILE_STORAGE='core.tests.utils.cases.StreamingFakeS3Storage')
 class ProjectDataImportTest(UserTestCase, FileStorageTestCase, TestCase):
 
     def setUp(self):
         super().setUp()
+        patcher = patch('organization.tasks.import_data.apply_async',
+                        side_effect=run_import_locally)
+        self.scheduled_import = patcher.start()
+        self.addCleanup(patcher.stop)
         self.view = default.ProjectDataImportWizard.as_view()
         self.request = HttpRequest()
         setattr(self.request, 'method', 'GET')
@@ -1710,6 +1725,38 @@ class ProjectDataImportTest(UserTestCase, FileStorageTestCase, TestCase):
         assert random_filename.endswith('.csv')
         assert len(random_filename.split('.')[0].strip('/')) == 24
 
+    @override_settings(IMPORT_WIZARD_VALIDATION_ROWS=5)
+    @patch('organization.views.default.schedule_project_import')
+    @patch('organization.importers.geometry.ThreadPoolExecutor')
+    @patch('organization.importers.geometry.ProcessPoolExecutor')
+    @patch('organization.importers.geometry.MIN_POOL_BATCH', 1)
+    @patch('organization.importers.csv.CSVImporter.validate_data',
+           autospec=True, side_effect=CSVImporter.validate_data)
+    def test_full_flow_validates_in_process(self, validate_data,
+                                            process_pool, thread_pool,
+                                            schedule_import):
+        self.client.force_login(self.user)
+        csvfile = self.get_file(self.valid_csv, 'rb')
+        file = SimpleUploadedFile('test.csv', csvfile.read(), 'text/csv')
+        csvfile.close()
+        post_data = self.SELECT_FILE_POST_DATA.copy()
+        post_data['select_file-file'] = file
+        url = reverse('organization:project-import',
+                      kwargs={'organization': self.org.slug,
+                              'project': self.project.slug})
+        assert self.client.post(url, post_data).status_code == 200
+        assert self.client.post(
+            url, self.MAP_ATTRIBUTES_POST_DATA).status_code == 200
+        assert self.client.post(
+            url, self.SELECT_DEFAULTS_POST_DATA).status_code == 302
+
+        assert schedule_import.called
+        assert not process_pool.called
+        assert not thread_pool.called
+        # Only the first rows are validated in the request
+        assert validate_data.call_count == 1
+        assert validate_data.call_args[1] == {'workers': 0, 'max_rows': 5}
+
     def test_full_flow_valid_custom_types(self):
         questionnaire = q_factories.QuestionnaireFactory.create(
             project=self.project)
@@ -1886,7 +1933,13 @@ class ProjectDataImportTest(UserTestCase, FileStorageTestCase, TestCase):
                         'project': self.project.slug}),
             self.SELECT_DEFAULTS_POST_DATA
         )
+        # The rows are validated before the import is scheduled
         assert select_defaults_response.status_code == 200
+        errors = select_defaults_response.context_data[
+            'form'].non_field_errors()
+        assert errors
+        assert self.scheduled_import.call_count == 0
+        assert not TaskResult.objects.exists()
 
         proj = Project.objects.get(
             organization=self.org, name='Test Imports')
@@ -1928,7 +1981,13 @@ class ProjectDataImportTest(UserTestCase, FileStorageTestCase, TestCase):
                         'project': self.project.slug}),
             self.SELECT_DEFAULTS_POST_DATA
         )
+        # The rows are validated before the import is scheduled
         assert select_defaults_response.status_code == 200
+        errors = select_defaults_response.context_data[
+            'form'].non_field_errors()
+        assert errors
+        assert self.scheduled_import.call_count == 0
+        assert not TaskResult.objects.exists()
 
         proj = Project.objects.get(
             organization=self.org, name='Test Imports')
@@ -1,10 +1,10 @@
-import importlib
 import os
 from collections import OrderedDict
 
 import django.views.generic as base_generic
 from django.contrib import messages
 from django.conf import settings
+from django.core.files import File
 from django.core.files.storage import DefaultStorage, FileSystemStorage
 from django.core.urlresolvers import reverse
 from django.db import transaction
@@ -33,9 +33,11 @@ from . import mixins
 from ..choices import ROLE_CHOICES
 from .. import messages as error_messages
 from .. import forms
+from ..importers.base import get_importer
 from ..importers.exceptions import DataImportError
 from ..models import Organization, OrganizationRole, Project, ProjectRole
-from ..tasks import schedule_project_export, export
+from ..tasks import (schedule_project_export, schedule_project_import,
+                     export, import_data)
 
 
 class OrganizationList(PermissionRequiredMixin, generic.ListView):
@@ -423,11 +425,13 @@ class ProjectDashboard(PermissionRequiredMixin,
         context['members'] = members
 
         context['export_disabled'] = breakers.celery.is_open
-        exports = self.object.tasks.filter(type=export.name)
-        exports = exports.select_related('result').order_by('-created_date')
         last_week = timezone.now() - timezone.timedelta(days=7)
-        exports = exports.filter(created_date__gte=last_week)[:5]
-        context['recent_exports'] = exports
+        recent_tasks = self.object.tasks.filter(
+            created_date__gte=last_week
+        ).select_related('result').order_by('-created_date')
+        context['recent_exports'] = recent_tasks.filter(type=export.name)[:5]
+        context['recent_imports'] = recent_tasks.filter(
+            type=import_data.name)[:5]
         try:
             context['questionnaire'] = Questionnaire.objects.get(
                 id=self.object.current_questionnaire)
@@ -903,37 +907,34 @@ class ProjectDataImportWizard(mixins.ProjectMixin,
                 extra_attrs=extra_attrs, extra_headers=extra_headers, **kwargs
             )
         if next_step == 'select_defaults':
-            heads = self.request.POST.get('extra_headers', None)
-            available_headers = heads.split(',')
-            entity_types = self.storage.get_step_data('select_file').getlist(
-                'select_file-entity_types'
-            )
-            unique_headers = []
-            for header in available_headers:
-                if header not in unique_headers:
-                    unique_headers.append(header)
             return self.render(
-                new_form, available_headers=unique_headers,
-                entity_types=entity_types, **kwargs
+                new_form, **self.get_select_defaults_context(), **kwargs
             )
 
-    def done(self, form_list, **kwargs):
-        form_data = [form.cleaned_data for form in form_list]
-        name = form_data[0]['name']
-        description = form_data[0]['description']
-        mime_type = form_data[0]['mime_type']
-        is_resource = form_data[0]['is_resource']
-        original_file = form_data[0]['original_file']
-        file = form_data[0]['file']
+    def get_select_defaults_context(self):
+        heads = self.storage.get_step_data('map_attributes').get(
+            'extra_headers', None)
+        available_headers = heads.split(',')
+        entity_types = self.storage.get_step_data('select_file').getlist(
+            'select_file-entity_types'
+        )
+        unique_headers = []
+        for header in available_headers:
+            if header not in unique_headers:
+                unique_headers.append(header)
+        return {
+            'available_headers': unique_headers,
+            'entity_types': entity_types,
+        }
+
+    def get_import_config(self, defaults):
         type = self.storage.get_step_data(
             'select_file').get('select_file-type')
         entity_types = self.storage.get_step_data('select_file').getlist(
             'select_file-entity_types'
         )
-        path = self.file_storage.path(file.name)
         map_attrs_data = self.storage.get_step_data('map_attributes')
         project = self.get_project()
-        org = project.organization
         allowed_tenure_types = get_types(
             'tenure_type',
             TENURE_RELATIONSHIP_TYPES,
@@ -943,27 +944,41 @@ class ProjectDataImportWizard(mixins.ProjectMixin,
             TYPE_CHOICES,
             questionnaire_id=project.current_questionnaire)
 
-        config_dict = {
-            'project': project,
-            'file': path,
+        return {
             'type': type,
             'entity_types': entity_types.copy(),
-            'party_name_field': form_data[2]['party_name_field'],
-            'party_type_field': form_data[2]['party_type_field'],
-            'location_type_field': form_data[2]['location_type_field'],
-            'geometry_field': form_data[2]['geometry_field'],
+            'party_name_field': defaults['party_name_field'],
+            'party_type_field': defaults['party_type_field'],
+            'location_type_field': defaults['location_type_field'],
+            'geometry_field': defaults['geometry_field'],
             'attributes': map_attrs_data.getlist('attributes', None),
             'allowed_tenure_types': allowed_tenure_types,
             'allowed_location_types': allowed_location_types
         }
 
-        importer = self._get_importer(type, path)
-        importer.import_data(config_dict)
+    def done(self, form_list, **kwargs):
+        form_data = [form.cleaned_data for form in form_list]
+        name = form_data[0]['name']
+        description = form_data[0]['description']
+        mime_type = form_data[0]['mime_type']
+        is_resource = form_data[0]['is_resource']
+        original_file = form_data[0]['original_file']
+        file = form_data[0]['file']
+        path = self.file_storage.path(file.name)
+        project = self.get_project()
+        org = project.organization
+        config_dict = self.get_import_config(form_data[2])
+
+        default_storage = DefaultStorage()
+        ext = file.name[file.name.rfind('.'):]
+        file_name = 'imports/{}{}'.format(random_id(), ext)
+        with open(path, 'rb') as f:
+            default_storage.save(file_name, File(f))
+        schedule_project_import(
+            project, self.request.user, file_name, config_dict)
 
         if is_resource:
-            default_storage = DefaultStorage()
             file.seek(0)
-            ext = file.name[file.name.rfind('.'):]
             resource = Resource(
                 name=name, description=description,
                 original_file=original_file, mime_type=mime_type,
@@ -998,31 +1013,38 @@ class ProjectDataImportWizard(mixins.ProjectMixin,
                 )
             final_forms[form_key] = form_obj
 
-        # catch bad import here
+        # validate the first rows before the import is scheduled, in-process,
+        # so that no geometry workers are started from a web server worker;
+        # the import task validates all rows
+        select_file = final_forms['select_file']
+        select_defaults = final_forms['select_defaults']
+        file = select_file.cleaned_data['file']
+        importer = self._get_importer(
+            select_file.cleaned_data['type'],
+            self.file_storage.path(file.name))
         try:
-            done_response = self.done(
-                final_forms.values(), form_dict=final_forms, **kwargs
-            )
+            report = importer.validate_data(
+                self.get_import_config(select_defaults.cleaned_data),
+                workers=0, max_rows=settings.IMPORT_WIZARD_VALIDATION_ROWS)
         except DataImportError as e:
-            form_key = 'select_file'
-            form_obj = self.get_form(
-                step=form_key,
-                data=self.storage.get_step_data(form_key),
-                files=self.storage.get_step_files(form_key)
-            )
-            form_obj.add_error('file', str(e))
-            file = form_obj.files['select_file-file']
+            select_file.add_error('file', str(e))
             self.file_storage.delete(file.name)
             return self.render_revalidation_failure(
-                'select_file', form_obj, **kwargs
+                'select_file', select_file, **kwargs
+            )
+        if not report.is_valid:
+            for message in report.get_messages():
+                select_defaults.add_error(None, message)
+            return self.render_revalidation_failure(
+                'select_defaults', select_defaults,
+                **self.get_select_defaults_context(), **kwargs
             )
+
+        done_response = self.done(
+            final_forms.values(), form_dict=final_forms, **kwargs
+        )
         self.storage.reset()
         return done_response
 
     def _get_importer(self, type, path):
-        fqn = settings.IMPORTERS.get(type)
-        parts = fqn.rpartition('.')
-        module = importlib.import_module(parts[0])
-        clazz = parts[-1]
-        importer = getattr(module, clazz)
-        return importer(project=self.get_project(), path=path)
+        return get_importer(type, self.get_project(), path)
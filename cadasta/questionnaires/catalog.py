@@ -0,0 +1,131 @@
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import get_language
+
+# Catalogs kept in process, least recently used first
+_catalogs = OrderedDict()
+MAX_CATALOGS = 100
+
+
+def get_catalog_cache_key(questionnaire_id):
+    return 'questionnaires:options:{}'.format(questionnaire_id)
+
+
+def get_attribute_types_cache_key(questionnaire_id):
+    return 'questionnaires:attribute_types:{}'.format(questionnaire_id)
+
+
+class OptionCatalog():
+    """
+    The options of the questions of a questionnaire and their labels, loaded
+    with one query per questionnaire. Labels are translated once per
+    language.
+    """
+
+    def __init__(self, default_language, options):
+        self.default_language = default_language
+        # {question name: [(option name, label_xlat), ...]}
+        self.options = options
+        self._labels = {}
+
+    @classmethod
+    def load(cls, questionnaire_id):
+        Questionnaire = apps.get_model('questionnaires', 'Questionnaire')
+        QuestionOption = apps.get_model('questionnaires', 'QuestionOption')
+        default_language = Questionnaire.objects.filter(
+            id=questionnaire_id
+        ).values_list('default_language', flat=True).first()
+        options = OrderedDict()
+        for question, name, label in QuestionOption.objects.filter(
+            question__questionnaire_id=questionnaire_id
+        ).values_list('question__name', 'name', 'label_xlat'):
+            options.setdefault(question, []).append((name, label))
+        return cls(default_language, options)
+
+    def get_options(self, question_name):
+        return self.options.get(question_name, [])
+
+    def get_labels(self, question_name):
+        """Returns (name, label) pairs of the options of a question, with
+        labels in the current language, or the questionnaire's default
+        language if there is no translation."""
+        lang = get_language()
+        labels = self._labels.get((question_name, lang))
+        if labels is None:
+            labels = []
+            for name, label in self.get_options(question_name):
+                if isinstance(label, dict):
+                    label = label.get(lang, label.get(self.default_language))
+                labels.append((name, label))
+            self._labels[(question_name, lang)] = labels
+        return labels
+
+    def get_label_xlat(self, question_name, option_name, default=None):
+        for name, label in self.get_options(question_name):
+            if name == option_name:
+                return label
+        return default
+
+
+def get_option_catalog(questionnaire_id):
+    """
+    Returns the option catalog of a questionnaire. Catalogs are kept in
+    process and in the cache for QUESTIONNAIRE_CATALOG_CACHE_TIMEOUT, since
+    questionnaires do not change once they are created: a new questionnaire
+    is created for each form uploaded to a project.
+    """
+    catalog = _catalogs.get(questionnaire_id)
+    if catalog is not None:
+        _catalogs.move_to_end(questionnaire_id)
+        return catalog
+
+    key = get_catalog_cache_key(questionnaire_id)
+    cached = cache.get(key)
+    if cached is not None:
+        catalog = OptionCatalog(*cached)
+    else:
+        catalog = OptionCatalog.load(questionnaire_id)
+        cache.set(key, (catalog.default_language, catalog.options),
+                  settings.QUESTIONNAIRE_CATALOG_CACHE_TIMEOUT)
+
+    _catalogs[questionnaire_id] = catalog
+    if len(_catalogs) > MAX_CATALOGS:
+        _catalogs.popitem(last=False)
+    return catalog
+
+
+def invalidate_option_catalog(questionnaire_id):
+    _catalogs.pop(questionnaire_id, None)
+    cache.delete(get_catalog_cache_key(questionnaire_id))
+
+
+def get_attribute_types(questionnaire_id):
+    """
+    Returns the types of the attributes in the schemas of a questionnaire,
+    as {model name: {attribute name: attribute type name}}, e.g.
+    {'party': {'occupations': 'select_multiple'}}. The map is cached like
+    option catalogs, for QUESTIONNAIRE_CATALOG_CACHE_TIMEOUT.
+    """
+    if not questionnaire_id:
+        return {}
+
+    key = get_attribute_types_cache_key(questionnaire_id)
+    attribute_types = cache.get(key)
+    if attribute_types is None:
+        Attribute = apps.get_model('jsonattrs', 'Attribute')
+        attribute_types = {}
+        for model, name, type_name in Attribute.objects.filter(
+            schema__selectors__2=questionnaire_id
+        ).values_list('schema__content_type__model', 'name',
+                      'attr_type__name'):
+            attribute_types.setdefault(model, {})[name] = type_name
+        cache.set(key, attribute_types,
+                  settings.QUESTIONNAIRE_CATALOG_CACHE_TIMEOUT)
+    return attribute_types
+
+
+def invalidate_attribute_types(questionnaire_id):
+    cache.delete(get_attribute_types_cache_key(questionnaire_id))
@@ -7,10 +7,12 @@ from django.dispatch import receiver
 from django.utils.translation import ugettext as _
 from django.utils.translation import get_language
 from django.contrib.postgres.fields import JSONField
+from jsonattrs.models import Attribute, Schema, SchemaManager
 from simple_history.models import HistoricalRecords
 from tutelary.decorators import permissioned_model
 
 from . import managers, messages, choices
+from .catalog import invalidate_attribute_types, invalidate_option_catalog
 from .validators import validate_accuracy
 
 
@@ -210,3 +212,38 @@ def set_label_on_spatialunits(sender, instance, **kwargs):
         type=instance.name,
         project__current_questionnaire=instance.question.questionnaire.id,
     ).update(label=instance.label_xlat)
+
+
+@receiver(models.signals.post_save, sender=Attribute)
+@receiver(models.signals.post_delete, sender=Attribute)
+@receiver(models.signals.post_delete, sender=Schema)
+def invalidate_schema_cache(sender, instance, **kwargs):
+    """
+    Clears the jsonattrs cache, and with it the compiled schema attributes
+    of all projects, when attributes change. jsonattrs itself only does this
+    when schemas are saved and attributes created. The attribute types of the
+    schema's questionnaire are cleared too.
+    """
+    SchemaManager.invalidate_cache()
+
+    schema = instance if sender is Schema else instance.schema
+    if len(schema.selectors) > 2:
+        invalidate_attribute_types(schema.selectors[2])
+
+
+@receiver(models.signals.post_save, sender=Questionnaire)
+@receiver(models.signals.post_delete, sender=Questionnaire)
+def invalidate_questionnaire_catalog(sender, instance, **kwargs):
+    invalidate_option_catalog(instance.id)
+
+
+@receiver(models.signals.post_save, sender=Question)
+@receiver(models.signals.post_delete, sender=Question)
+def invalidate_question_catalog(sender, instance, **kwargs):
+    invalidate_option_catalog(instance.questionnaire_id)
+
+
+@receiver(models.signals.post_save, sender=QuestionOption)
+@receiver(models.signals.post_delete, sender=QuestionOption)
+def invalidate_option_catalog_of_option(sender, instance, **kwargs):
+    invalidate_option_catalog(instance.question.questionnaire_id)
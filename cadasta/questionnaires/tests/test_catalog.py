@@ -0,0 +1,112 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils.translation import override
+from jsonattrs.models import (Attribute, AttributeType, Schema,
+                              create_attribute_types)
+
+from organization.tests.factories import ProjectFactory
+from . import factories
+from ..catalog import get_attribute_types, get_option_catalog
+
+
+class OptionCatalogTest(TestCase):
+
+    def setUp(self):
+        self.questionnaire = factories.QuestionnaireFactory.create(
+            default_language='kar')
+        self.question = factories.QuestionFactory.create(
+            type='S1',
+            name='location_type',
+            questionnaire=self.questionnaire)
+        factories.QuestionOptionFactory.create(
+            question=self.question,
+            name='PA',
+            label={'kar': 'PA Karen', 'cs': 'PA Czech'},
+            index=0)
+        factories.QuestionOptionFactory.create(
+            question=self.question,
+            name='BU',
+            label={'kar': 'BU Karen'},
+            index=1)
+
+    def test_get_labels(self):
+        catalog = get_option_catalog(self.questionnaire.id)
+        assert catalog.default_language == 'kar'
+        with override('cs'):
+            assert catalog.get_labels('location_type') == [
+                ('PA', 'PA Czech'), ('BU', 'BU Karen')]
+        with override('en'):
+            assert catalog.get_labels('location_type') == [
+                ('PA', 'PA Karen'), ('BU', 'BU Karen')]
+        assert catalog.get_labels('tenure_type') == []
+
+    def test_get_label_xlat(self):
+        catalog = get_option_catalog(self.questionnaire.id)
+        assert catalog.get_label_xlat('location_type', 'BU') == {
+            'kar': 'BU Karen'}
+        assert catalog.get_label_xlat('location_type', 'XX') is None
+        assert catalog.get_label_xlat('location_type', 'XX', 'missing') == (
+            'missing')
+
+    def test_catalog_is_cached(self):
+        catalog = get_option_catalog(self.questionnaire.id)
+        with self.assertNumQueries(0):
+            assert get_option_catalog(self.questionnaire.id) is catalog
+
+    def test_catalog_is_invalidated(self):
+        catalog = get_option_catalog(self.questionnaire.id)
+        factories.QuestionOptionFactory.create(
+            question=self.question,
+            name='MI',
+            label='Miscellaneous',
+            index=2)
+        new_catalog = get_option_catalog(self.questionnaire.id)
+        assert new_catalog is not catalog
+        assert [name for name, _ in new_catalog.get_options(
+            'location_type')] == ['PA', 'BU', 'MI']
+
+        self.question.name = 'tenure_type'
+        self.question.save()
+        assert get_option_catalog(
+            self.questionnaire.id).get_options('location_type') == []
+
+
+class AttributeTypesTest(TestCase):
+
+    def setUp(self):
+        create_attribute_types()
+        self.project = ProjectFactory.create()
+        self.questionnaire = factories.QuestionnaireFactory.create(
+            project=self.project)
+
+    def create_attribute(self, questionnaire_id, attr_type):
+        schema = Schema.objects.create(
+            content_type=ContentType.objects.get(
+                app_label='party', model='party'),
+            selectors=(self.project.organization.id, self.project.id,
+                       questionnaire_id))
+        Attribute.objects.create(
+            schema=schema,
+            name='occupations', long_name='Occupations',
+            attr_type=AttributeType.objects.get(name=attr_type),
+            index=0)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    def test_get_attribute_types(self):
+        cache.clear()
+        other_questionnaire = factories.QuestionnaireFactory.create(
+            project=self.project)
+        self.create_attribute(self.questionnaire.id, 'select_multiple')
+        self.create_attribute(other_questionnaire.id, 'text')
+
+        assert get_attribute_types(self.questionnaire.id) == {
+            'party': {'occupations': 'select_multiple'}}
+        assert get_attribute_types(other_questionnaire.id) == {
+            'party': {'occupations': 'text'}}
+        with self.assertNumQueries(0):
+            assert get_attribute_types(self.questionnaire.id) == {
+                'party': {'occupations': 'select_multiple'}}
+            assert get_attribute_types('') == {}
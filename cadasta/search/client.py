@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from core import breakers
+
+
+logger = logging.getLogger(__name__)
+
+
+class ESClient():
+    """
+    Elasticsearch HTTP client holding one pooled, keep-alive session per
+    worker process. Sessions are created lazily and re-created after a fork,
+    so uwsgi workers never share sockets inherited from the master.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._in_flight = 0
+        self.reset_stats()
+
+    @property
+    def api_url(self):
+        return '{}://{}:{}'.format(
+            settings.ES_SCHEME, settings.ES_HOST, settings.ES_PORT)
+
+    @property
+    def timeout(self):
+        return (settings.ES_CONNECT_TIMEOUT, settings.ES_TIMEOUT)
+
+    @property
+    def session(self):
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.ES_POOL_SIZE,
+                pool_block=settings.ES_POOL_BLOCK)
+            session.mount(settings.ES_SCHEME + '://', adapter)
+            self._session = session
+            self._pid = pid
+            self._in_flight = 0
+        return self._session
+
+    def reset_stats(self):
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+            'latency': 0.0,
+            'pool_exhausted': 0,
+        }
+
+    def request(self, method, path, **kwargs):
+        """Sends a request to the ES API through the `es` circuit breaker and
+        returns the response. Raises one of `breakers.es.expected_errors` on
+        connection failures, server errors or while the breaker is open."""
+        kwargs.setdefault('timeout', self.timeout)
+        with self._lock:
+            if self._in_flight >= settings.ES_POOL_SIZE:
+                self.stats['pool_exhausted'] += 1
+            self._in_flight += 1
+            self.stats['requests'] += 1
+
+        start = time.monotonic()
+        try:
+            return breakers.es.call(self._send, method, path, **kwargs)
+        except breakers.es.expected_errors:
+            with self._lock:
+                self.stats['errors'] += 1
+            raise
+        finally:
+            latency = time.monotonic() - start
+            with self._lock:
+                self._in_flight -= 1
+                self.stats['latency'] += latency
+            logger.debug("ES %s %s took %.3fs", method, path, latency)
+
+    def _send(self, method, path, **kwargs):
+        r = self.session.request(method, self.api_url + path, **kwargs)
+        if r.status_code >= 500:
+            r.raise_for_status()
+        return r
+
+    def post(self, path, body):
+        return self.request(
+            'POST', path,
+            data=json.dumps(body, sort_keys=True),
+            headers={'content-type': 'application/json'})
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def search_with_timestamp(self, project_id, body):
+        """Runs the search `body` against the project's entity types and
+        fetches the project index timestamp in the same round trip using the
+        multi search API. Returns a tuple of the raw search results and the
+        timestamp, or `None` if ES did not answer successfully."""
+        index = 'project-{}'.format(project_id)
+        lines = [
+            {'index': index, 'type': 'spatial,party,resource'},
+            body,
+            {'index': index, 'type': 'project'},
+            {'query': {'match_all': {}}, 'size': 1},
+        ]
+        r = self.request(
+            'POST', '/_msearch/',
+            data=''.join(
+                json.dumps(line, sort_keys=True) + '\n' for line in lines),
+            headers={'content-type': 'application/x-ndjson'})
+        if r.status_code != 200:
+            return None
+
+        results, project = r.json()['responses']
+        if 'error' in results:
+            return None
+        try:
+            timestamp = project['hits']['hits'][0]['_source'].get(
+                '@timestamp')
+        except (KeyError, IndexError):
+            timestamp = None
+        return results, timestamp
+
+
+client = ESClient()
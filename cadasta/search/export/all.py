@@ -5,6 +5,7 @@ from zipfile import ZipFile
 from .shape import ShapeExporter
 from .xls import XLSExporter
 from .resource import ResourceExporter
+from .pipeline import ExportPipeline
 
 
 class AllExporter():
@@ -12,13 +13,15 @@ class AllExporter():
     def __init__(self, project):
         self.project = project
 
-    def make_download(self, es_dump_path):
+    def make_download(self, es_dump_path, entities=None):
         shp_exporter = ShapeExporter(self.project, is_standalone=False)
         xls_exporter = XLSExporter(self.project)
         res_exporter = ResourceExporter(self.project)
-        shp_dir_path = shp_exporter.make_download(es_dump_path)
-        xls_path, _ = xls_exporter.make_download(es_dump_path)
-        path, mime_type = res_exporter.make_download(es_dump_path)
+        pipeline = ExportPipeline(
+            [shp_exporter, xls_exporter, res_exporter],
+            normalizer=xls_exporter)
+        shp_dir_path, (xls_path, _), (path, mime_type) = pipeline.run(
+            es_dump_path, entities)
 
         with ZipFile(path, 'a') as myzip:
             myzip.write(xls_path, arcname='data.xlsx')
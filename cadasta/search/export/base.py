@@ -6,11 +6,50 @@ from django.contrib.contenttypes.models import ContentType
 from core.mixins import SchemaSelectorMixin
 from party.models import TENURE_RELATIONSHIP_TYPES
 from core.form_mixins import get_types
-from .utils import convert_postgis_ewkb_to_ewkt
+from .utils import convert_postgis_ewkb_to_wkb, convert_wkbs_to_ewkt
+
+
+MODEL_ATTR = 'model_attr'
+SCHEMA_ATTR = 'schema_attr'
+
+
+def compile_row_projector(columns, model_attrs, attributes):
+    """Returns a function mapping an entity to the list of its values for
+    `columns`. Columns of the schema `attributes` are read from the entity
+    attributes, other `model_attrs` from the entity itself, and any other
+    column is left empty."""
+    fields = []
+    for column in columns:
+        if column in attributes:
+            fields.append((SCHEMA_ATTR, column))
+        elif column in model_attrs:
+            fields.append((MODEL_ATTR, column))
+        else:
+            fields.append((None, column))
+    fields = tuple(fields)
+
+    def project(item):
+        row = []
+        for source, name in fields:
+            if source is SCHEMA_ATTR:
+                value = item['attributes'].get(name, '')
+                if type(value) == list:
+                    value = ', '.join(value)
+            elif source is MODEL_ATTR:
+                value = item[name]
+            else:
+                value = ''
+            row.append(value)
+        return row
+
+    return project
 
 
 class Exporter(SchemaSelectorMixin):
 
+    # ES types consumed by this exporter when used as an export sink
+    es_types = ('spatial', 'party')
+
     def __init__(self, project):
         self.project = project
         tenure_types = get_types(
@@ -61,55 +100,63 @@ class Exporter(SchemaSelectorMixin):
                 for a in attrs.values())
             attr_columns.update(schema_columns)
             metadatum['attr_columns'] = attr_columns
+            metadatum['conditional_selector'] = (
+                self.get_conditional_selector(metadatum['content_type']))
+
+        self.compile_row_projectors()
 
-    def get_attr_values(self, item, metadatum):
-        attr_values = {}
-        for attr in metadatum['model_attrs']:
-            attr_values[attr] = item[attr]
+    def compile_row_projectors(self):
+        """Compiles a row projector for each schema of each metadatum. Must
+        be called again after changing model_attrs or attr_columns."""
+        for metadatum in self.metadata.values():
+            columns = list(metadatum['attr_columns'])
+            model_attrs = metadatum['model_attrs']
+            metadatum['row_projectors'] = {
+                selector_value: compile_row_projector(
+                    columns, model_attrs, attributes)
+                for selector_value, attributes
+                in metadatum['schema_attrs'].items()
+            }
+            metadatum['default_row_projector'] = compile_row_projector(
+                columns, model_attrs, {})
 
-        conditional_selector = self.get_conditional_selector(
-            metadatum['content_type'])
+    def get_row(self, item, metadatum):
+        """Returns the values of all attr_columns of the metadatum for the
+        item, in the order of the columns."""
+        conditional_selector = metadatum['conditional_selector']
         if conditional_selector:
-            entity_type = item[conditional_selector]
-            attributes = metadatum['schema_attrs'].get(entity_type, {})
+            selector_value = item[conditional_selector]
         else:
-            attributes = metadatum['schema_attrs'].get('DEFAULT', {})
-        for attr, _ in attributes.items():
-            attr_value = item['attributes'].get(attr, '')
-            if type(attr_value) == list:
-                attr_value = ', '.join(attr_value)
-            attr_values[attr] = attr_value
-
-        return attr_values
-
-    def process_entity(self, es_type_line, es_source_line, write_callback):
-        # Extract ES type and source and skip if not loc/party/rel
-        es_type = json.loads(es_type_line)['index']['_type']
-        if es_type not in ('spatial', 'party'):
-            return
-        source = json.loads(es_source_line)
+            selector_value = 'DEFAULT'
+        projector = metadatum['row_projectors'].get(
+            selector_value, metadatum['default_row_projector'])
+        return projector(item)
+
+    def prepare_entity(self, es_type, source):
+        """Reformats an ES source document of a location, party or
+        relationship in place to match model_attrs. Returns the key of the
+        corresponding metadatum and the entity."""
 
         # Get corresponding metadatum
         if es_type == 'spatial':
-            metadatum = self.metadata['location']
+            key = 'location'
         else:
             if source['tenure_id']:
-                metadatum = self.metadata['tenure_rel']
+                key = 'tenure_rel'
             else:
-                metadatum = self.metadata['party']
+                key = 'party'
+        metadatum = self.metadata[key]
 
         # Reformat data to match model_attrs
         source['attributes'] = json.loads(source['attributes']['value'])
         if metadatum['model_name'] == 'SpatialUnit':
+            # Text representations are added by add_geometry_text() only
+            # where they are written out
             if source['geometry'] is None:
-                ewkt = ''
-                wkt = ''
+                source['geometry.wkb'] = None
             else:
-                ewkt = convert_postgis_ewkb_to_ewkt(
+                source['geometry.wkb'] = convert_postgis_ewkb_to_wkb(
                     source['geometry']['value'])
-                wkt = ewkt[10:]  # Remove SRID
-            source['geometry.ewkt'] = ewkt
-            source['geometry.wkt'] = wkt
         elif metadatum['model_name'] == 'TenureRelationship':
             source['id'] = source['tenure_id']
             source['party_id'] = source['tenure_partyid']
@@ -119,5 +166,24 @@ class Exporter(SchemaSelectorMixin):
             source['attributes'] = json.loads(
                 source['tenure_attributes']['value'])
 
-        # Call callback
-        write_callback(source, metadatum)
+        return key, source
+
+    def add_geometry_text(self, locations):
+        """Returns copies of the locations with their geometries converted
+        to EWKT and WKT, decoding the whole batch in one call."""
+        ewkts = convert_wkbs_to_ewkt(loc['geometry.wkb'] for loc in locations)
+        return [dict(loc, **{'geometry.ewkt': ewkt,
+                             'geometry.wkt': ewkt[10:]})  # Remove SRID
+                for loc, ewkt in zip(locations, ewkts)]
+
+    def write(self, batch):
+        """Export sink interface: writes a batch of prepared entities."""
+        decode = 'geometry.ewkt' in self.metadata['location']['model_attrs']
+        if decode:
+            locations = iter(self.add_geometry_text(
+                [entity for _, key, entity in batch if key == 'location']))
+
+        for es_type, key, entity in batch:
+            if decode and key == 'location':
+                entity = next(locations)
+            self.write_entity(entity, self.metadata[key])
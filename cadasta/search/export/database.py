@@ -0,0 +1,87 @@
+import json
+
+from party.models import Party, TenureRelationship
+from resources.models import Resource
+from spatial.models import SpatialUnit
+
+
+def get_project_querysets(project):
+    """Returns the querysets of the project entities that are exported, in
+    the order in which they appear in an ES dump."""
+    return [
+        ('spatial', SpatialUnit.objects.filter(project=project).values_list(
+            'id', 'type', 'geometry', 'attributes')),
+        ('party', Party.objects.filter(project=project).values_list(
+            'id', 'type', 'name', 'attributes')),
+        ('tenure', TenureRelationship.objects.filter(
+            project=project).values_list(
+                'id', 'party_id', 'spatial_unit_id', 'tenure_type',
+                'attributes', 'party__type', 'party__name',
+                'party__attributes')),
+        ('resource', Resource.objects.filter(
+            project=project, archived=False).values_list(
+                'id', 'name', 'description', 'file', 'original_file',
+                'mime_type', 'archived')),
+    ]
+
+
+def count_project_entities(project):
+    return sum(qs.count() for _, qs in get_project_querysets(project))
+
+
+def read_project_entities(project):
+    """
+    Streams the exported entities of a project from the database as (ES type,
+    source) pairs in the format of an ES dump, so that they can be passed to
+    an `ExportPipeline` instead of a dump.
+
+    Rows are fetched in chunks through server-side cursors, so memory use
+    does not grow with the size of the project.
+    """
+    for kind, queryset in get_project_querysets(project):
+        for row in queryset.iterator():
+            if kind == 'spatial':
+                id, type, geometry, attributes = row
+                yield 'spatial', {
+                    'id': id,
+                    'type': type,
+                    'geometry': (
+                        None if geometry is None
+                        else {'value': geometry.hexewkb.decode()}),
+                    'attributes': {'value': json.dumps(attributes)},
+                }
+            elif kind == 'party':
+                id, type, name, attributes = row
+                yield 'party', {
+                    'id': id,
+                    'type': type,
+                    'name': name,
+                    'attributes': {'value': json.dumps(attributes)},
+                    'tenure_id': None,
+                }
+            elif kind == 'tenure':
+                (id, party_id, spatial_unit_id, tenure_type, attributes,
+                 party_type, party_name, party_attributes) = row
+                yield 'party', {
+                    'id': party_id,
+                    'type': party_type,
+                    'name': party_name,
+                    'attributes': {'value': json.dumps(party_attributes)},
+                    'tenure_id': id,
+                    'tenure_partyid': party_id,
+                    'spatial_unit_id': spatial_unit_id,
+                    'tenure_type': tenure_type,
+                    'tenure_attributes': {'value': json.dumps(attributes)},
+                }
+            else:
+                (id, name, description, file, original_file, mime_type,
+                 archived) = row
+                yield 'resource', {
+                    'id': id,
+                    'name': name,
+                    'description': description,
+                    'file': file,
+                    'original_file': original_file,
+                    'mime_type': mime_type,
+                    'archived': archived,
+                }
@@ -0,0 +1,67 @@
+import json
+
+BUFFER_SIZE = 500
+
+
+def read_es_dump(es_dump_path):
+    """Streams (ES type, source) pairs from an ES dump file, which holds two
+    lines per entity: the bulk index action and the source document."""
+    with open(es_dump_path, encoding='utf-8') as f:
+        while True:
+            # Read 2 lines in the dump file
+            type_line = f.readline()
+            source_line = f.readline()
+            if not type_line:
+                break
+            es_type = json.loads(type_line)['index']['_type']
+            yield es_type, json.loads(source_line)
+
+
+class ExportPipeline():
+    """
+    Reads an ES dump once and fans the entities out to export sinks.
+
+    Instead of the dump, any iterable of (ES type, source) pairs in the format
+    of the dump can be passed to `run()` as `entities`; sinks then derive the
+    paths of their files from `es_dump_path` as usual.
+
+    A sink declares the ES types it consumes in `es_types` and implements
+    `start(es_dump_path)`, `write(batch)` and `finish()`; the results of
+    `finish()` are returned by `run()` in the order of the sinks. Batches are
+    lists of (ES type, metadatum key, entity) tuples holding at most
+    `buffer_size` entities, so memory use does not grow with the dump size.
+
+    Entities of the types consumed by the `normalizer` (an `Exporter`) are
+    prepared once by it and shared by all sinks, which must not modify them.
+    """
+
+    def __init__(self, sinks, normalizer=None, buffer_size=BUFFER_SIZE):
+        self.sinks = sinks
+        self.normalizer = normalizer
+        self.buffer_size = buffer_size
+
+    def run(self, es_dump_path, entities=None):
+        if entities is None:
+            entities = read_es_dump(es_dump_path)
+        for sink in self.sinks:
+            sink.start(es_dump_path)
+
+        buffers = [[] for _ in self.sinks]
+        normalized_types = getattr(self.normalizer, 'es_types', ())
+        for es_type, source in entities:
+            key = None
+            if es_type in normalized_types:
+                key, source = self.normalizer.prepare_entity(es_type, source)
+
+            for i, sink in enumerate(self.sinks):
+                if es_type not in sink.es_types:
+                    continue
+                buffers[i].append((es_type, key, source))
+                if len(buffers[i]) >= self.buffer_size:
+                    sink.write(buffers[i])
+                    buffers[i] = []
+
+        for sink, buffer in zip(self.sinks, buffers):
+            if buffer:
+                sink.write(buffer)
+        return [sink.finish() for sink in self.sinks]
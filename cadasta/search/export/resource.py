@@ -1,106 +1,117 @@
-import json
 import os
-import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+from django.conf import settings
 from openpyxl import Workbook
 from zipfile import ZipFile
 
 from resources.models import ContentObject
+from .pipeline import ExportPipeline
+from .utils import create_download_session, download_file
 
 MIME_TYPE = 'application/zip'
 
 
 class ResourceExporter():
 
+    # ES types consumed by this exporter when used as an export sink
+    es_types = ('resource',)
+
     def __init__(self, project):
         self.project = project
 
-    def make_download(self, es_dump_path):
-        base_path = os.path.splitext(es_dump_path)[0]
-        has_resources = False
+    def make_download(self, es_dump_path, entities=None):
+        return ExportPipeline([self]).run(es_dump_path, entities)[0]
+
+    def start(self, es_dump_path):
+        self.base_path = os.path.splitext(es_dump_path)[0]
+        self.has_resources = False
+        self.filenames = {}
+        self.links = self.get_resource_links()
 
         # Create worksheet for resources metadata
-        workbook = Workbook(write_only=True)
-        worksheet = workbook.create_sheet(title='resources')
-        worksheet.append(['id', 'name', 'description', 'filename',
-                          'locations', 'parties', 'relationships'])
+        self.workbook = Workbook(write_only=True)
+        self.worksheet = self.workbook.create_sheet(title='resources')
+        self.worksheet.append(['id', 'name', 'description', 'filename',
+                               'locations', 'parties', 'relationships'])
 
         # Create temp dir where S3 files will be downloaded
-        dir_path = base_path + '-res-dir'
-        os.makedirs(dir_path)
-
-        # Create zip file and start processing
-        zip_path = base_path + '-res.zip'
-        filenames = {}
-        with ZipFile(zip_path, 'a') as myzip:
-
-            f = open(es_dump_path, encoding='utf-8')
-            while True:
-                # Read 2 lines in the dump file
-                type_line = f.readline()
-                source_line = f.readline()
-                if not type_line:
-                    break
-
-                # Extract ES type and source and skip if not resource
-                es_type = json.loads(type_line)['index']['_type']
-                if es_type != 'resource':
-                    continue
-                has_resources = True
-                source = json.loads(source_line)
-
-                # Fetch file from S3 using curl and add to zip file
-                # and ensuring filenames are unique
-                temp_resource_path = dir_path + '/' + source['original_file']
-                subprocess.run([
-                    'curl', '-o', temp_resource_path, '-XGET', source['file']
-                ])
-                filename = source['original_file']
-                if filename not in filenames:
-                    filenames[filename] = 1
-                else:
-                    filenames[filename] += 1
-                    basename, ext = os.path.splitext(filename)
-                    filename = '{} ({}){}'.format(
-                        basename, filenames[filename], ext)
-                    source['original_file'] = filename
-                myzip.write(temp_resource_path,
-                            arcname='resources/' + filename)
-
-                self.append_resource_metadata(source, worksheet)
-
-            if has_resources:
-                xls_path = base_path + '-res.xlsx'
-                workbook.save(filename=xls_path)
-                myzip.write(xls_path, arcname='resources.xlsx')
-
-            myzip.close()
-            f.close()
-
-        return zip_path, MIME_TYPE
+        self.dir_path = self.base_path + '-res-dir'
+        os.makedirs(self.dir_path)
+
+        # Create zip file and the pool fetching the S3 files
+        self.zip_path = self.base_path + '-res.zip'
+        self.zip_file = ZipFile(self.zip_path, 'a')
+        self.session = create_download_session(
+            settings.EXPORT_RESOURCE_WORKERS,
+            settings.EXPORT_RESOURCE_RETRIES)
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.EXPORT_RESOURCE_WORKERS)
+
+    def write(self, batch):
+        # Fetch all files of the batch concurrently, ensuring filenames in
+        # the zip file are unique
+        downloads = []
+        for _, _, source in batch:
+            self.has_resources = True
+            filename = self.get_unique_filename(source['original_file'])
+            temp_resource_path = os.path.join(self.dir_path, source['id'])
+            future = self.executor.submit(
+                download_file, self.session, source['file'],
+                temp_resource_path, settings.EXPORT_RESOURCE_MAX_SIZE,
+                timeout=settings.EXPORT_RESOURCE_TIMEOUT)
+            downloads.append((future, temp_resource_path, filename))
+
+            self.append_resource_metadata(
+                dict(source, original_file=filename), self.worksheet)
+
+        # Add files to the zip file as they are fetched
+        for future, temp_resource_path, filename in downloads:
+            if future.result():
+                self.zip_file.write(temp_resource_path,
+                                    arcname='resources/' + filename)
+                os.remove(temp_resource_path)
+
+    def finish(self):
+        self.executor.shutdown()
+        self.session.close()
+
+        if self.has_resources:
+            xls_path = self.base_path + '-res.xlsx'
+            self.workbook.save(filename=xls_path)
+            self.zip_file.write(xls_path, arcname='resources.xlsx')
+        self.zip_file.close()
+
+        return self.zip_path, MIME_TYPE
+
+    def get_unique_filename(self, filename):
+        if filename not in self.filenames:
+            self.filenames[filename] = 1
+            return filename
+        self.filenames[filename] += 1
+        basename, ext = os.path.splitext(filename)
+        return '{} ({}){}'.format(basename, self.filenames[filename], ext)
+
+    def get_resource_links(self):
+        """Returns the IDs of the entities linked to each resource of the
+        project, grouped by resource ID and model name."""
+        links = defaultdict(lambda: defaultdict(list))
+        content_objects = ContentObject.objects.filter(
+            resource__project=self.project).values_list(
+                'resource_id', 'content_type__model', 'object_id')
+        for resource_id, model, object_id in content_objects:
+            links[resource_id][model].append(object_id)
+        return links
 
     def append_resource_metadata(self, source, worksheet):
-        location_ids = []
-        party_ids = []
-        tenure_rel_ids = []
-
-        links = ContentObject.objects.filter(
-            resource__id=source['id']).values_list(
-                'content_type__model', 'object_id')
-        for link in links:
-            if link[0] == 'spatialunit':
-                location_ids.append(link[1])
-            elif link[0] == 'party':
-                party_ids.append(link[1])
-            elif link[0] == 'tenurerelationship':
-                tenure_rel_ids.append(link[1])
-
+        links = self.links.get(source['id'], {})
         worksheet.append([
             source['id'],
             source['name'],
             source['description'],
             source['original_file'],
-            ','.join(location_ids),
-            ','.join(party_ids),
-            ','.join(tenure_rel_ids),
+            ','.join(links.get('spatialunit', [])),
+            ','.join(links.get('party', [])),
+            ','.join(links.get('tenurerelationship', [])),
         ])
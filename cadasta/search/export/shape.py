@@ -6,6 +6,7 @@ from osgeo import ogr, osr
 from django.template.loader import render_to_string
 
 from .base import Exporter
+from .pipeline import ExportPipeline
 
 MIME_TYPE = 'application/zip'
 shp_types = {
@@ -24,27 +25,24 @@ class ShapeExporter(Exporter):
         self.is_standalone = is_standalone
         super().__init__(project)
 
-    def make_download(self, es_dump_path):
-        base_path = os.path.splitext(es_dump_path)[0]
-
         # CSV files do not need the EWKT geometry
         self.metadata['location']['model_attrs'] = ['id', 'type']
         self.metadata['location']['attr_columns'].pop('geometry.ewkt')
+        self.compile_row_projectors()
+
+    def make_download(self, es_dump_path, entities=None):
+        pipeline = ExportPipeline([self], normalizer=self)
+        return pipeline.run(es_dump_path, entities)[0]
 
-        self.dir_path = base_path + '-shp-dir'
+    def start(self, es_dump_path):
+        self.base_path = os.path.splitext(es_dump_path)[0]
+        self.dir_path = self.base_path + '-shp-dir'
         self.shp_datasource = self.create_shp_datasource()
 
-        f = open(es_dump_path, encoding='utf-8')
-        while True:
-            # Read 2 lines in the dump file
-            type_line = f.readline()
-            source_line = f.readline()
-            if not type_line:
-                break
-            self.process_entity(
-                type_line, source_line, self.write_csv_row_and_shp)
-        f.close()
+    def write_entity(self, entity, metadatum):
+        self.write_csv_row_and_shp(entity, metadatum)
 
+    def finish(self):
         # Clean up
         for metadatum in self.metadata.values():
             f = metadatum.get('csv_file')
@@ -63,7 +61,7 @@ class ShapeExporter(Exporter):
             f.close()
 
         if self.is_standalone:
-            zip_path = base_path + '-shp.zip'
+            zip_path = self.base_path + '-shp.zip'
             with ZipFile(zip_path, 'a') as myzip:
                 for f in os.listdir(self.dir_path):
                     myzip.write(os.path.join(self.dir_path, f), arcname=f)
@@ -89,19 +87,15 @@ class ShapeExporter(Exporter):
                 metadatum['csv_writer'] = w
                 w.writerow(metadatum['attr_columns'].keys())
 
-            attr_values = self.get_attr_values(entity, metadatum)
-            data = metadatum['attr_columns'].copy()
-            data.update(attr_values)
-            writer = metadatum['csv_writer']
-            writer.writerow(list(data.values()))
+            metadatum['csv_writer'].writerow(self.get_row(entity, metadatum))
 
         if metadatum['title'] == 'locations':
             self.write_shp_layer(entity)
 
     def write_shp_layer(self, loc_data):
-        if loc_data['geometry.wkt'] == '':
+        if loc_data['geometry.wkb'] is None:
             return
-        geom = ogr.CreateGeometryFromWkt(loc_data['geometry.wkt'])
+        geom = ogr.CreateGeometryFromWkb(loc_data['geometry.wkb'])
         layer_type = geom.GetGeometryName().lower()
         layer = self.shp_layers.get(layer_type, None)
         if layer is None:
@@ -1,11 +1,78 @@
-from django.contrib.gis.gdal import OGRGeometry
+import binascii
+import logging
+import os
+
+import requests
+from osgeo import ogr
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
 from ..exceptions import NotWgs84EwkbValueError
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
-def convert_postgis_ewkb_to_ewkt(ewkb_hex):
+logger = logging.getLogger(__name__)
+
+
+def convert_postgis_ewkb_to_wkb(ewkb_hex):
     # Assert that format is little endian, capitalized, and SRID=4326
     if ewkb_hex[6:18] != '0020E6100000':
         raise NotWgs84EwkbValueError(ewkb_hex)
-    wkb_hex = ewkb_hex[0:6] + '0000' + ewkb_hex[18:]
-    return 'SRID=4326;' + OGRGeometry(wkb_hex).wkt
+    return binascii.unhexlify(ewkb_hex[0:6] + '0000' + ewkb_hex[18:])
+
+
+def convert_wkbs_to_ewkt(wkbs):
+    """Converts a batch of WGS84 WKB geometries to EWKT. `None` geometries
+    are converted to empty strings."""
+    create_geometry = ogr.CreateGeometryFromWkb
+    return ['SRID=4326;' + create_geometry(wkb).ExportToWkt() if wkb else ''
+            for wkb in wkbs]
+
+
+def convert_postgis_ewkb_to_ewkt(ewkb_hex):
+    return convert_wkbs_to_ewkt([convert_postgis_ewkb_to_wkb(ewkb_hex)])[0]
+
+
+def create_download_session(pool_size, retries):
+    """Returns a session that keeps up to `pool_size` connections alive per
+    host and retries failed connections and 5xx responses `retries` times."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=retries,
+                          backoff_factor=0.5,
+                          status_forcelist=(500, 502, 503, 504)))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def download_file(session, url, path, max_size, timeout=None):
+    """Streams the file at `url` to `path` in chunks. Returns `False`, without
+    leaving a partial file behind, if the download fails or the file is larger
+    than `max_size` bytes."""
+    try:
+        with session.get(url, stream=True, timeout=timeout) as r:
+            r.raise_for_status()
+            size = int(r.headers.get('content-length') or 0)
+            if size <= max_size:
+                size = 0
+                with open(path, 'wb') as f:
+                    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > max_size:
+                            break
+                        f.write(chunk)
+    except (requests.RequestException, OSError):
+        logger.exception("Failed to download %s", url)
+        size = None
+    else:
+        if size > max_size:
+            logger.warning("Skipping %s: larger than %d bytes", url, max_size)
+
+    if size is None or size > max_size:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+    return True
@@ -33,3 +33,7 @@ class MockEsUrlsTest(TestCase):
         assert resolved.func.__name__ == views.Dump.__name__
         assert resolved.kwargs['projectid'] == '123abc'
         assert resolved.kwargs['type'] == '456def'
+
+    def test_msearch(self):
+        resolved = resolve('/_msearch/')
+        assert resolved.func.__name__ == views.MultiSearch.__name__
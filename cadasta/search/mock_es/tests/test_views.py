@@ -2,6 +2,7 @@ import json
 
 from django.contrib.contenttypes.models import ContentType
 from django.test import TestCase
+from rest_framework.test import APIRequestFactory
 from skivvy import ViewTestCase, APITestCase
 
 from core.tests.utils.cases import UserTestCase
@@ -333,6 +334,48 @@ class SearchTest(APITestCase, UserTestCase, TestCase):
         assert response.content == {}
 
 
+class MultiSearchTest(UserTestCase, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.project = ProjectFactory.create(slug='test-project')
+        self.location = SpatialUnitFactory.create(
+            project=self.project,
+            geometry='SRID=4326;POINT(0 0)',
+        )
+
+    def request(self, query):
+        index = 'project-{}'.format(self.project.id)
+        lines = [
+            {'index': index, 'type': 'spatial,party,resource'},
+            {'query': {'bool': {'should': [
+                {'multi_match': {'query': query}}]}}},
+            {'index': index, 'type': 'project'},
+            {'query': {'match_all': {}}, 'size': 1},
+        ]
+        request = APIRequestFactory().post(
+            '/_msearch/',
+            data=''.join(json.dumps(line) + '\n' for line in lines),
+            content_type='application/x-ndjson')
+        response = views.MultiSearch.as_view()(request)
+        response.render()
+        return response.status_code, json.loads(response.content.decode())
+
+    def test_post_with_results(self):
+        status_code, content = self.request('test')
+        assert status_code == 200
+        results, project = content['responses']
+        assert results['hits']['total'] == 1
+        assert results['hits']['hits'][0]['_source']['id'] == (
+            self.location.id)
+        assert project == views.TIMESTAMP_RESULTS
+
+    def test_post_with_error_query(self):
+        status_code, content = self.request('ERROR')
+        assert status_code == 200
+        assert 'error' in content['responses'][0]
+
+
 class DumpTest(ViewTestCase, UserTestCase, TestCase):
 
     view_class = views.Dump
@@ -14,6 +14,9 @@ urls = [
 ]
 
 urlpatterns = [
+    url(
+        r'^_msearch/$',
+        views.MultiSearch.as_view()),
     url(
         r'^project-(?P<projectid>[-\w]+)/(?P<type>[-\w,]+)/',
         include(urls, namespace='mock_es')),
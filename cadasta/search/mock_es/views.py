@@ -13,6 +13,15 @@ from party.models import Party, TenureRelationship
 from resources.models import Resource
 
 
+TIMESTAMP_RESULTS = {
+    'hits': {
+        'hits': [{
+            '_source': {'@timestamp': '2017-01-01T01:23:45.678Z'},
+        }],
+    },
+}
+
+
 def transform(entity, bulk=False):
 
     if type(entity) is SpatialUnit:
@@ -170,13 +179,7 @@ class Search(BaseSearch):
     def get(self, request, *args, **kwargs):
         if self.kwargs['type'] == 'project':
             # Search for project type is only used for getting the timestamp
-            return Response({
-                'hits': {
-                    'hits': [{
-                        '_source': {'@timestamp': '2017-01-01T01:23:45.678Z'},
-                    }],
-                },
-            })
+            return Response(TIMESTAMP_RESULTS)
         else:
             # TODO: No search by type yet
             return Response({})
@@ -194,3 +197,31 @@ class Dump(BaseSearch):
     def get(self, request, *args, **kwargs):
         assert self.kwargs['type'] == 'spatial,party,resource'
         return self.search(json.loads(request.query_params['source']))
+
+
+class MultiSearch(APIView):
+
+    authentication_classes = []
+    permission_classes = (AllowAny,)
+
+    def post(self, request, *args, **kwargs):
+        lines = [json.loads(line)
+                 for line in request.body.decode('utf-8').splitlines()
+                 if line.strip()]
+        responses = []
+        for header, query_dsl in zip(lines[::2], lines[1::2]):
+            if header['type'] == 'project':
+                responses.append(TIMESTAMP_RESULTS)
+                continue
+            view = Search()
+            view.kwargs = {
+                'projectid': header['index'][len('project-'):],
+                'type': header['type'],
+            }
+            response = view.search(query_dsl)
+            if response.status_code == status.HTTP_200_OK:
+                responses.append(response.data)
+            else:
+                responses.append({'error': 'unavailable',
+                                  'status': response.status_code})
+        return Response({'responses': responses})
@@ -1,3 +1,6 @@
+import re
+from functools import lru_cache
+
 import pyparsing
 
 
@@ -14,13 +17,68 @@ must_not_term = pyparsing.Group('-' + term)
 token = must_term | must_not_term | term
 query = pyparsing.OneOrMore(token)
 
+# Queries made only of plain terms (no quotes and no +/- prefixes) are
+# tokenized without pyparsing. Only the whitespace characters skipped by
+# pyparsing separate terms, so both paths yield the same tokens.
+whitespace = ' \t\n\r'
+plain_term = r'[^\s"+\-][^\s"]*'
+plain_query = re.compile(r'{0}(?:[{1}]+{0})*'.format(plain_term, whitespace))
+plain_separator = re.compile(r'[{}]+'.format(whitespace))
+
+# Number of distinct query strings whose compiled DSL is kept in memory
+COMPILED_QUERY_CACHE_SIZE = 1024
+
+
+class FrozenDict(dict):
+    """Read-only dict used for the shared, cached DSL fragments."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("Compiled query DSL is immutable")
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+
+class FrozenList(list):
+    """Read-only list used for the shared, cached DSL fragments."""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("Compiled query DSL is immutable")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = clear = extend = insert = pop = remove = _immutable
+    reverse = sort = _immutable
+
+
+def freeze(dsl):
+    if isinstance(dsl, dict):
+        return FrozenDict((k, freeze(v)) for k, v in dsl.items())
+    if isinstance(dsl, list):
+        return FrozenList(freeze(v) for v in dsl)
+    return dsl
+
 
 def parse_query(raw_query_str):
     """This function takes the raw UI search query string, parses it, then
-    generates and returns the 'bool' JSON object for the 'query' DSL field."""
+    generates and returns the 'bool' JSON object for the 'query' DSL field.
+
+    Compiled queries are memoized, so the returned DSL is shared between
+    callers and is immutable."""
+    return compile_query(normalize_query(raw_query_str))
 
+
+def normalize_query(raw_query_str):
+    """Strips the whitespace that does not affect how the query is parsed."""
+    return raw_query_str.strip(whitespace)
+
+
+@lru_cache(maxsize=COMPILED_QUERY_CACHE_SIZE)
+def compile_query(raw_query_str):
     # Parse query string into tokens and sort them into buckets
-    tokens = query.parseString(raw_query_str).asList()
+    if plain_query.fullmatch(raw_query_str):
+        tokens = plain_separator.split(raw_query_str)
+    else:
+        tokens = query.parseString(raw_query_str).asList()
     must_terms = []
     must_not_terms = []
     should_terms = []
@@ -48,7 +106,7 @@ def parse_query(raw_query_str):
         dsl['bool']['must'] = must_dsl
     if should_dsl:
         dsl['bool']['should'] = should_dsl
-    return dsl
+    return freeze(dsl)
 
 
 def transform_to_dsl(terms, has_fuzziness=True):
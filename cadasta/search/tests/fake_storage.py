@@ -0,0 +1,65 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeStorage():
+    """
+    Local HTTP stand-in for S3 serving `files`, a dict of URL paths to file
+    contents. Paths in `failures` answer with a 503 error the given number of
+    times before being served. Use as a context manager.
+    """
+
+    def __init__(self, files, failures=None):
+        self.files = files
+        self.failures = dict(failures or {})
+        self.requests = []
+
+    def __enter__(self):
+        storage = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                storage.requests.append(self.path)
+                if storage.failures.get(self.path):
+                    storage.failures[self.path] -= 1
+                    self.send_error(503)
+                elif self.path not in storage.files:
+                    self.send_error(404)
+                else:
+                    content = storage.files[self.path]
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(content)))
+                    self.end_headers()
+                    self.wfile.write(content)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def rewrite_es_dump(self, es_dump_path, out_path, replacements=None):
+        """Copies an ES dump file pointing its resource files to this
+        server."""
+        replacements = dict(replacements or {})
+        replacements['https://example.com'] = self.url
+        with open(es_dump_path) as infile, open(out_path, 'w') as outfile:
+            for line in infile:
+                for old, new in replacements.items():
+                    line = line.replace(old, new)
+                outfile.write(line)
+        return out_path
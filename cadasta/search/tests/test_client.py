@@ -0,0 +1,122 @@
+import json
+import requests
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+
+from core import breakers
+from ..client import ESClient
+
+
+api_url = (
+    settings.ES_SCHEME + '://' + settings.ES_HOST + ':' + settings.ES_PORT)
+
+
+def mock_request_with_exception(*args, **kwargs):
+    raise requests.exceptions.ConnectionError
+
+
+class ESClientTest(TestCase):
+
+    def setUp(self):
+        breakers.es.close()
+        self.client = ESClient()
+
+    def test_session_is_reused(self):
+        session = self.client.session
+        assert self.client.session is session
+        adapter = session.get_adapter(api_url)
+        assert adapter._pool_maxsize == settings.ES_POOL_SIZE
+
+    def test_session_is_recreated_after_fork(self):
+        session = self.client.session
+        with patch('os.getpid', return_value=-1):
+            assert self.client.session is not session
+
+    @patch('time.monotonic', side_effect=[1.0, 1.5])
+    @patch('requests.Session.request')
+    def test_post(self, mock_request, mock_monotonic):
+        self.client.post('/project-abc/_search/', {'size': 1})
+        mock_request.assert_called_once_with(
+            'POST',
+            api_url + '/project-abc/_search/',
+            data='{"size": 1}',
+            headers={'content-type': 'application/json'},
+            timeout=(settings.ES_CONNECT_TIMEOUT, settings.ES_TIMEOUT),
+        )
+        assert self.client.stats['requests'] == 1
+        assert self.client.stats['errors'] == 0
+        assert self.client.stats['latency'] == 0.5
+
+    @patch('requests.Session.request', new=mock_request_with_exception)
+    def test_request_connection_not_ok(self):
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.client.get('/project-abc/_search/')
+        assert self.client.stats['requests'] == 1
+        assert self.client.stats['errors'] == 1
+
+    @patch('requests.Session.request')
+    def test_pool_exhaustion_is_counted(self, mock_request):
+        self.client._in_flight = settings.ES_POOL_SIZE
+        self.client.get('/project-abc/_search/')
+        assert self.client.stats['pool_exhausted'] == 1
+        assert self.client._in_flight == settings.ES_POOL_SIZE
+
+    @patch('requests.Session.request')
+    def test_search_with_timestamp(self, mock_request):
+        results = {'hits': {'total': 0, 'hits': []}}
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = {'responses': [
+            results,
+            {'hits': {'hits': [{'_source': {'@timestamp': 'TIMESTAMP'}}]}},
+        ]}
+
+        response = self.client.search_with_timestamp('abc', {'size': 10})
+        assert response == (results, 'TIMESTAMP')
+        args, kwargs = mock_request.call_args
+        assert args == ('POST', api_url + '/_msearch/')
+        lines = [json.loads(line) for line in kwargs['data'].splitlines()]
+        assert lines == [
+            {'index': 'project-abc', 'type': 'spatial,party,resource'},
+            {'size': 10},
+            {'index': 'project-abc', 'type': 'project'},
+            {'query': {'match_all': {}}, 'size': 1},
+        ]
+
+    @patch('requests.Session.request')
+    def test_search_with_timestamp_missing_index(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = {'responses': [
+            {'error': 'index_not_found_exception'},
+            {'error': 'index_not_found_exception'},
+        ]}
+        assert self.client.search_with_timestamp('abc', {}) is None
+
+    @patch('requests.Session.request')
+    def test_search_with_timestamp_not_ok(self, mock_request):
+        mock_request.return_value.status_code = 404
+        assert self.client.search_with_timestamp('abc', {}) is None
+
+    @patch('requests.Session.request')
+    def test_request_server_error(self, mock_request):
+        mock_request.return_value.status_code = 503
+        mock_request.return_value.raise_for_status.side_effect = (
+            requests.exceptions.HTTPError)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            self.client.get('/project-abc/_search/')
+        assert self.client.stats['errors'] == 1
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    @patch('requests.Session.request', new=mock_request_with_exception)
+    def test_request_breaker_opens(self):
+        cache.clear()
+        for _ in range(breakers.es.fail_max - 1):
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                self.client.get('/project-abc/_search/')
+        with self.assertRaises(breakers.es.expected_errors):
+            self.client.get('/project-abc/_search/')
+        assert breakers.es.is_open
@@ -1,14 +1,14 @@
 import csv
 import io
-import json
 import os
 import pytest
 import shutil
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from openpyxl import load_workbook
+from unittest.mock import patch
 from zipfile import ZipFile
 
 from core.models import RandomIDModel
@@ -26,16 +26,22 @@ from questionnaires.managers import create_attrs_schema, get_attr_type_ids
 from questionnaires.tests import attr_schemas
 from questionnaires.tests.factories import QuestionnaireFactory
 from .fake_results import get_fake_es_api_results
+from .fake_storage import FakeStorage
 from ..export.base import Exporter
+from ..export.database import count_project_entities, read_project_entities
+from ..export.pipeline import ExportPipeline, read_es_dump
 from ..export.all import AllExporter
 from ..export.resource import ResourceExporter
 from ..export.shape import ShapeExporter
 from ..export.xls import XLSExporter
 from ..export.utils import (convert_postgis_ewkb_to_ewkt,
+                            convert_postgis_ewkb_to_wkb,
+                            convert_wkbs_to_ewkt,
                             NotWgs84EwkbValueError)
 
 
 test_dir = os.path.join(settings.MEDIA_ROOT, 'temp')
+POINT_WKB = bytes.fromhex('0101000000000000000000F03F000000000000F03F')
 
 
 class BaseTestClass(UserTestCase, TestCase):
@@ -135,7 +141,7 @@ class ExporterTest(BaseTestClass):
         assert list(metadatum['attr_columns'].keys()) == [
             'id', 'party_id', 'spatial_unit_id', 'tenure_type_id', 'notes']
 
-    def test_get_attr_values(self):
+    def test_get_row_location(self):
         location_data = {
             'id': 'ID',
             'geometry.ewkt': 'GEOMETRY.EWKT',
@@ -148,11 +154,10 @@ class ExporterTest(BaseTestClass):
 
         exporter = Exporter(self.project)
         metadatum = exporter.metadata['location']
-        attr_values = exporter.get_attr_values(location_data, metadatum)
-        for key in metadatum['attr_columns'].keys():
-            assert attr_values[key] == key.upper()
+        assert exporter.get_row(location_data, metadatum) == [
+            'ID', 'GEOMETRY.EWKT', 'TYPE', 'QUALITY', 'INFRASTRUCTURE']
 
-    def test_get_attr_values_with_conditional_selector(self):
+    def test_get_row_with_conditional_selector(self):
         party_data = {
             'id': 'ID',
             'name': 'NAME',
@@ -162,21 +167,17 @@ class ExporterTest(BaseTestClass):
                 'gender': 'GENDER',
                 'homeowner': 'HOMEOWNER',
                 'dob': 'DOB',
+                'number_of_members': 'NUMBER_OF_MEMBERS',
             },
         }
 
         exporter = Exporter(self.project)
         metadatum = exporter.metadata['party']
-        attr_values = exporter.get_attr_values(party_data, metadatum)
-        for key in metadatum['attr_columns'].keys():
-            if key == 'type':
-                assert attr_values[key] == 'IN'
-            elif key in ['number_of_members', 'date_formed']:
-                assert key not in attr_values
-            else:
-                assert attr_values[key] == key.upper()
-
-    def test_get_attr_values_with_list_attr(self):
+        # Attributes of other party types are left empty
+        assert exporter.get_row(party_data, metadatum) == [
+            'ID', 'NAME', 'IN', 'NOTES', 'GENDER', 'HOMEOWNER', 'DOB', '', '']
+
+    def test_get_row_with_list_attr(self):
         tenure_rel_data = {
             'id': 'ID',
             'party_id': 'PARTY_ID',
@@ -190,111 +191,91 @@ class ExporterTest(BaseTestClass):
 
         exporter = Exporter(self.project)
         metadatum = exporter.metadata['tenure_rel']
-        attr_values = exporter.get_attr_values(tenure_rel_data, metadatum)
-        for key in metadatum['attr_columns'].keys():
-            if key == 'notes':
-                assert attr_values[key] == '1, 2, 3'
-            else:
-                assert attr_values[key] == key.upper()
-
-    def test_process_location_entity(self):
-        es_type_line = '{"index": {"_type": "spatial"} }'
-        dummies = []
-        for _ in range(5):
-            obj = RandomIDModel()
-            obj.id = random_id()
-            dummies.append(obj)
-        es_source_line = json.dumps(
-            get_fake_es_api_results(*dummies)['hits']['hits'][1]['_source'])
-
-        exporter = Exporter(self.project)
+        assert exporter.get_row(tenure_rel_data, metadatum) == [
+            'ID', 'PARTY_ID', 'SPATIAL_UNIT_ID', 'TENURE_TYPE_ID', '1, 2, 3']
 
-        def callback(source, metadatum):
-            assert metadatum == exporter.metadata['location']
-            assert source['id'] == dummies[1].id
-            assert source['geometry.ewkt'] == 'SRID=4326;POINT (1 1)'
-            assert source['geometry.wkt'] == 'POINT (1 1)'
-            assert source['attributes']['name'] == "Long Island"
-            assert source['attributes']['acquired_how'] == 'LH'
-
-        exporter.process_entity(es_type_line, es_source_line, callback)
-
-    def test_process_location_entity_with_null_geometry(self):
-        es_type_line = '{"index": {"_type": "spatial"} }'
-        dummies = []
-        for _ in range(5):
-            obj = RandomIDModel()
-            obj.id = random_id()
-            dummies.append(obj)
-        raw_source = (
-            get_fake_es_api_results(*dummies)['hits']['hits'][1]['_source'])
-        raw_source['geometry'] = None
-        es_source_line = json.dumps(raw_source)
+    def test_get_row(self):
+        party_data = {
+            'id': 'ID',
+            'name': 'NAME',
+            'type': 'GR',
+            'attributes': {
+                'notes': ['1', '2'],
+                'gender': 'GENDER',
+                'number_of_members': '3',
+            },
+        }
 
         exporter = Exporter(self.project)
+        metadatum = exporter.metadata['party']
+        with self.assertNumQueries(0):
+            row = exporter.get_row(party_data, metadatum)
+        assert row == ['ID', 'NAME', 'GR', '1, 2', '', '', '', '3', '']
 
-        def callback(source, metadatum):
-            assert metadatum == exporter.metadata['location']
-            assert source['id'] == dummies[1].id
-            assert source['geometry.ewkt'] == ''
-            assert source['geometry.wkt'] == ''
-            assert source['attributes']['name'] == "Long Island"
-            assert source['attributes']['acquired_how'] == 'LH'
+        party_data['type'] = 'CO'
+        assert exporter.get_row(party_data, metadatum) == [
+            'ID', 'NAME', 'CO', '1, 2', '', '', '', '', '']
 
-        exporter.process_entity(es_type_line, es_source_line, callback)
+        # Types without a schema have no attribute values
+        party_data['type'] = 'UNKNOWN'
+        assert exporter.get_row(party_data, metadatum) == [
+            'ID', 'NAME', 'UNKNOWN', '', '', '', '', '', '']
 
-    def test_process_party_entity(self):
-        es_type_line = '{"index": {"_type": "party"} }'
-        dummies = []
-        for _ in range(5):
-            obj = RandomIDModel()
-            obj.id = random_id()
-            dummies.append(obj)
-        es_source_line = json.dumps(
-            get_fake_es_api_results(*dummies)['hits']['hits'][2]['_source'])
+    def test_compile_row_projectors(self):
+        location_data = {
+            'id': 'ID',
+            'geometry.ewkt': 'GEOMETRY.EWKT',
+            'type': 'TYPE',
+            'attributes': {'quality': 'QUALITY'},
+        }
 
         exporter = Exporter(self.project)
+        metadatum = exporter.metadata['location']
+        assert exporter.get_row(location_data, metadatum) == [
+            'ID', 'GEOMETRY.EWKT', 'TYPE', 'QUALITY', '']
 
-        def callback(source, metadatum):
-            assert metadatum == exporter.metadata['party']
-            assert source['id'] == dummies[2].id
-            assert source['name'] == "Party in the USA"
-            assert source['attributes']['party_notes'] == "PBS is the best."
-
-        exporter.process_entity(es_type_line, es_source_line, callback)
-
-    def test_process_tenure_rel_entity(self):
-        es_type_line = '{"index": {"_type": "party"} }'
-        dummies = []
-        for _ in range(5):
-            obj = RandomIDModel()
-            obj.id = random_id()
-            dummies.append(obj)
-        es_source_line = json.dumps(
-            get_fake_es_api_results(*dummies)['hits']['hits'][3]['_source'])
+        metadatum['model_attrs'] = ['id', 'type']
+        metadatum['attr_columns'].pop('geometry.ewkt')
+        exporter.compile_row_projectors()
+        assert exporter.get_row(location_data, metadatum) == [
+            'ID', 'TYPE', 'QUALITY', '']
 
+    def test_write_decodes_geometries_per_batch(self):
         exporter = Exporter(self.project)
-
-        def callback(source, metadatum):
-            assert metadatum == exporter.metadata['tenure_rel']
-            assert source['id'] == dummies[3].id
-            assert source['spatial_unit_id'] == dummies[1].id
-            assert source['party_id'] == dummies[2].id
-            assert source['tenure_type_id'] == 'CU'
-            assert source['tenure_type_label'] == 'Customary Rights'
-            assert source['attributes']['rel_notes'] == "PBS is the best."
-
-        exporter.process_entity(es_type_line, es_source_line, callback)
-
-    def test_process_invalid_entity(self):
-        es_type_line = '{"index": {"_type": "project"} }'
-        es_source_line = 'DUMMY'
-
-        def callback(source, metadatum):
-            assert False  # callback should not be called
-
+        written = []
+        exporter.write_entity = lambda entity, metadatum: written.append(
+            entity)
+        loc1 = {'id': 'ID0', 'geometry.wkb': POINT_WKB}
+        loc2 = {'id': 'ID1', 'geometry.wkb': None}
+        party = {'id': 'ID2'}
+        batch = [('spatial', 'location', loc1),
+                 ('party', 'party', party),
+                 ('spatial', 'location', loc2)]
+
+        with patch('search.export.base.convert_wkbs_to_ewkt',
+                   wraps=convert_wkbs_to_ewkt) as convert:
+            exporter.write(batch)
+        assert convert.call_count == 1
+        assert [e['id'] for e in written] == ['ID0', 'ID2', 'ID1']
+        assert written[0]['geometry.ewkt'] == 'SRID=4326;POINT (1 1)'
+        assert written[0]['geometry.wkt'] == 'POINT (1 1)'
+        assert written[1] is party
+        assert written[2]['geometry.ewkt'] == ''
+        # Shared entities are not modified
+        assert 'geometry.ewkt' not in loc1
+
+    def test_write_without_ewkt_does_not_decode_geometries(self):
         exporter = Exporter(self.project)
-        exporter.process_entity(es_type_line, es_source_line, callback)
+        exporter.metadata['location']['model_attrs'] = ['id', 'type']
+        written = []
+        exporter.write_entity = lambda entity, metadatum: written.append(
+            entity)
+        loc = {'id': 'ID0', 'geometry.wkb': POINT_WKB}
+
+        with patch('search.export.base.convert_wkbs_to_ewkt') as convert:
+            exporter.write([('spatial', 'location', loc)])
+        assert convert.call_count == 0
+        assert written == [loc]
 
 
 @pytest.mark.usefixtures('clear_temp')
@@ -570,16 +551,14 @@ class ResourceExporterTest(BaseTestClass):
         es_dump_path = os.path.join(test_dir, 'test-res1-orig.esjson')
         shutil.copy(original_es_dump_path, es_dump_path)
 
-        # Rewrite the ES dump file to inject the resource ID
-        with open(es_dump_path, 'r') as infile:
-            es_dump_path = os.path.join(test_dir, 'test-res1.esjson')
-            fwrite = open(es_dump_path, 'w')
-            for line in infile:
-                fwrite.write(line.replace('ID3', res.id))
-            fwrite.close()
+        with FakeStorage({'/text.csv': b'a,b\n1,2\n'}) as storage:
+            # Rewrite the ES dump file to inject the resource ID and URL
+            es_dump_path = storage.rewrite_es_dump(
+                es_dump_path, os.path.join(test_dir, 'test-res1.esjson'),
+                {'ID3': res.id})
 
-        exporter = ResourceExporter(self.project)
-        zip_path, mime_type = exporter.make_download(es_dump_path)
+            exporter = ResourceExporter(self.project)
+            zip_path, mime_type = exporter.make_download(es_dump_path)
 
         assert zip_path == os.path.join(test_dir, 'test-res1-res.zip')
         assert mime_type == ('application/zip')
@@ -589,6 +568,7 @@ class ResourceExporterTest(BaseTestClass):
             assert len(files) == 2
             assert 'resources.xlsx' in files
             assert 'resources/baby_goat.jpeg' in files
+            assert myzip.read('resources/baby_goat.jpeg') == b'a,b\n1,2\n'
 
             myzip.extract('resources.xlsx', test_dir)
             wb = load_workbook(os.path.join(test_dir, 'resources.xlsx'))
@@ -619,11 +599,14 @@ class ResourceExporterTest(BaseTestClass):
             os.path.dirname(settings.BASE_DIR),
             'search/tests/files/test_es_dump_dupe_resources.esjson'
         )
-        es_dump_path = os.path.join(test_dir, 'test-res2.esjson')
-        shutil.copy(original_es_dump_path, es_dump_path)
+        files = {'/text1.csv': b'file 1', '/text2.csv': b'file 2'}
+        with FakeStorage(files) as storage:
+            es_dump_path = storage.rewrite_es_dump(
+                original_es_dump_path,
+                os.path.join(test_dir, 'test-res2.esjson'))
 
-        exporter = ResourceExporter(self.project)
-        zip_path, mime_type = exporter.make_download(es_dump_path)
+            exporter = ResourceExporter(self.project)
+            zip_path, mime_type = exporter.make_download(es_dump_path)
 
         assert zip_path == os.path.join(test_dir, 'test-res2-res.zip')
         assert mime_type == ('application/zip')
@@ -634,6 +617,8 @@ class ResourceExporterTest(BaseTestClass):
             assert 'resources.xlsx' in files
             assert 'resources/text.csv' in files
             assert 'resources/text (2).csv' in files
+            assert myzip.read('resources/text.csv') == b'file 1'
+            assert myzip.read('resources/text (2).csv') == b'file 2'
 
             myzip.extract('resources.xlsx', test_dir)
             wb = load_workbook(os.path.join(test_dir, 'resources.xlsx'))
@@ -678,6 +663,76 @@ class ResourceExporterTest(BaseTestClass):
         assert mime_type == ('application/zip')
         assert ZipFile(zip_path).namelist() == []
 
+    def test_make_download_with_failing_files(self):
+        ensure_dirs()
+        original_es_dump_path = os.path.join(
+            os.path.dirname(settings.BASE_DIR),
+            'search/tests/files/test_es_dump_dupe_resources.esjson'
+        )
+        files = {'/text1.csv': b'file 1', '/text2.csv': b'file 2'}
+        failures = {'/text1.csv': 1, '/text2.csv': 100}
+        with FakeStorage(files, failures=failures) as storage:
+            es_dump_path = storage.rewrite_es_dump(
+                original_es_dump_path,
+                os.path.join(test_dir, 'test-res4.esjson'))
+
+            exporter = ResourceExporter(self.project)
+            zip_path, mime_type = exporter.make_download(es_dump_path)
+
+        # The first file is retried, the second one fails permanently
+        assert storage.requests.count('/text1.csv') == 2
+        assert storage.requests.count('/text2.csv') == (
+            settings.EXPORT_RESOURCE_RETRIES + 1)
+        with ZipFile(zip_path) as myzip:
+            assert sorted(myzip.namelist()) == [
+                'resources.xlsx', 'resources/text.csv']
+            assert myzip.read('resources/text.csv') == b'file 1'
+        assert os.listdir(os.path.join(test_dir, 'test-res4-res-dir')) == []
+
+    @override_settings(EXPORT_RESOURCE_MAX_SIZE=6)
+    def test_make_download_with_too_large_files(self):
+        ensure_dirs()
+        original_es_dump_path = os.path.join(
+            os.path.dirname(settings.BASE_DIR),
+            'search/tests/files/test_es_dump_dupe_resources.esjson'
+        )
+        files = {'/text1.csv': b'file 1', '/text2.csv': b'file 2 is large'}
+        with FakeStorage(files) as storage:
+            es_dump_path = storage.rewrite_es_dump(
+                original_es_dump_path,
+                os.path.join(test_dir, 'test-res5.esjson'))
+
+            exporter = ResourceExporter(self.project)
+            zip_path, mime_type = exporter.make_download(es_dump_path)
+
+        with ZipFile(zip_path) as myzip:
+            assert sorted(myzip.namelist()) == [
+                'resources.xlsx', 'resources/text.csv']
+
+    def test_append_resource_metadata_uses_prefetched_links(self):
+        res = ResourceFactory.create(project=self.project)
+        loc = SpatialUnitFactory.create(project=self.project)
+        par = PartyFactory.create(project=self.project)
+        ContentObject.objects.create(resource=res, content_object=loc)
+        ContentObject.objects.create(resource=res, content_object=par)
+
+        exporter = ResourceExporter(self.project)
+        with self.assertNumQueries(1):
+            exporter.links = exporter.get_resource_links()
+
+        rows = []
+        worksheet = type('Worksheet', (), {'append': rows.append})()
+        source = {'id': res.id, 'name': 'Goat', 'description': '',
+                  'original_file': 'goat.jpeg'}
+        with self.assertNumQueries(0):
+            exporter.append_resource_metadata(source, worksheet)
+            exporter.append_resource_metadata(
+                dict(source, id='OTHER'), worksheet)
+        assert rows == [
+            [res.id, 'Goat', '', 'goat.jpeg', loc.id, par.id, ''],
+            ['OTHER', 'Goat', '', 'goat.jpeg', '', '', ''],
+        ]
+
 
 @pytest.mark.usefixtures('clear_temp')
 @pytest.mark.usefixtures('make_dirs')
@@ -703,16 +758,14 @@ class AllExporterTest(BaseTestClass):
         es_dump_path = os.path.join(test_dir, 'test-all1-orig.esjson')
         shutil.copy(original_es_dump_path, es_dump_path)
 
-        # Rewrite the ES dump file to inject the resource ID
-        with open(es_dump_path, 'r') as infile:
-            es_dump_path = os.path.join(test_dir, 'test-all1.esjson')
-            fwrite = open(es_dump_path, 'w')
-            for line in infile:
-                fwrite.write(line.replace('ID3', res.id))
-            fwrite.close()
+        with FakeStorage({'/text.csv': b'a,b\n1,2\n'}) as storage:
+            # Rewrite the ES dump file to inject the resource ID and URL
+            es_dump_path = storage.rewrite_es_dump(
+                es_dump_path, os.path.join(test_dir, 'test-all1.esjson'),
+                {'ID3': res.id})
 
-        exporter = AllExporter(self.project)
-        zip_path, mime_type = exporter.make_download(es_dump_path)
+            exporter = AllExporter(self.project)
+            zip_path, mime_type = exporter.make_download(es_dump_path)
 
         assert zip_path == os.path.join(test_dir, 'test-all1-res.zip')
         assert mime_type == ('application/zip')
@@ -825,6 +878,199 @@ class AllExporterTest(BaseTestClass):
             assert wb['Sheet']['A1'].value is None
 
 
+class RecordingSink():
+
+    def __init__(self, es_types):
+        self.es_types = es_types
+        self.batches = []
+
+    def start(self, es_dump_path):
+        self.started = es_dump_path
+
+    def write(self, batch):
+        self.batches.append(batch)
+
+    def finish(self):
+        return [entity['id'] for batch in self.batches
+                for _, _, entity in batch]
+
+
+class ExportPipelineTest(BaseTestClass):
+
+    def setUp(self):
+        super().setUp()
+        self.es_dump_path = os.path.join(
+            os.path.dirname(settings.BASE_DIR),
+            'search/tests/files/test_es_dump_basic.esjson'
+        )
+
+    def test_read_es_dump(self):
+        entities = list(read_es_dump(self.es_dump_path))
+        assert [(es_type, source['id']) for es_type, source in entities] == [
+            ('spatial', 'ID0'),
+            ('party', 'ID1'),
+            ('party', 'ID1'),
+            ('resource', 'ID3'),
+        ]
+
+    def test_run(self):
+        loc_sink = RecordingSink(('spatial', 'party'))
+        res_sink = RecordingSink(('resource',))
+        pipeline = ExportPipeline([loc_sink, res_sink],
+                                  normalizer=Exporter(self.project),
+                                  buffer_size=2)
+        results = pipeline.run(self.es_dump_path)
+
+        assert loc_sink.started == self.es_dump_path
+        assert res_sink.started == self.es_dump_path
+        assert results == [['ID0', 'ID1', 'ID2'], ['ID3']]
+        assert [len(b) for b in loc_sink.batches] == [2, 1]
+        assert [len(b) for b in res_sink.batches] == [1]
+
+        keys = [key for batch in loc_sink.batches for _, key, _ in batch]
+        assert keys == ['location', 'party', 'tenure_rel']
+        _, key, resource = res_sink.batches[0][0]
+        assert key is None
+        assert resource['original_file'] == 'baby_goat.jpeg'
+
+    def test_run_shares_normalized_entities(self):
+        sink1 = RecordingSink(('spatial', 'party'))
+        sink2 = RecordingSink(('spatial', 'party'))
+        pipeline = ExportPipeline([sink1, sink2],
+                                  normalizer=Exporter(self.project))
+        pipeline.run(self.es_dump_path)
+
+        assert len(sink1.batches) == 1
+        assert sink1.batches == sink2.batches
+        _, _, location = sink1.batches[0][0]
+        assert 'geometry.ewkt' not in location
+        assert location['geometry.wkb'] == POINT_WKB
+        assert location['attributes'] == {
+            'quality': 'point', 'infrastructure': ['food', 'electricity']}
+
+    def run_fake_results(self, change_hits=None):
+        """Runs the fake ES results of a project through a pipeline with
+        one sink. Returns the models of the results, the entities written
+        to the sink and the normalizer."""
+        dummies = []
+        for _ in range(5):
+            obj = RandomIDModel()
+            obj.id = random_id()
+            dummies.append(obj)
+        hits = get_fake_es_api_results(*dummies)['hits']['hits']
+        if change_hits:
+            change_hits(hits)
+        entities = [(hit['_type'], hit['_source']) for hit in hits]
+
+        exporter = Exporter(self.project)
+        sink = RecordingSink(('spatial', 'party'))
+        ExportPipeline([sink], normalizer=exporter).run(
+            self.es_dump_path, entities)
+        return dummies, [entity for batch in sink.batches
+                         for entity in batch], exporter
+
+    def test_run_prepares_entities(self):
+        dummies, entities, exporter = self.run_fake_results()
+
+        # The project is not consumed by the sink
+        assert [(es_type, key) for es_type, key, _ in entities] == [
+            ('spatial', 'location'),
+            ('party', 'party'),
+            ('party', 'tenure_rel'),
+        ]
+
+        _, _, location = entities[0]
+        assert location['id'] == dummies[1].id
+        assert location['geometry.wkb'] == POINT_WKB
+        assert location['attributes']['name'] == "Long Island"
+        assert location['attributes']['acquired_how'] == 'LH'
+        location = exporter.add_geometry_text([location])[0]
+        assert location['geometry.ewkt'] == 'SRID=4326;POINT (1 1)'
+        assert location['geometry.wkt'] == 'POINT (1 1)'
+
+        _, _, party = entities[1]
+        assert party['id'] == dummies[2].id
+        assert party['name'] == "Party in the USA"
+        assert party['attributes']['party_notes'] == "PBS is the best."
+
+        _, _, tenure_rel = entities[2]
+        assert tenure_rel['id'] == dummies[3].id
+        assert tenure_rel['spatial_unit_id'] == dummies[1].id
+        assert tenure_rel['party_id'] == dummies[2].id
+        assert tenure_rel['tenure_type_id'] == 'CU'
+        assert tenure_rel['tenure_type_label'] == 'Customary Rights'
+        assert tenure_rel['attributes']['rel_notes'] == "PBS is the best."
+
+    def test_run_prepares_location_with_null_geometry(self):
+        def remove_geometry(hits):
+            hits[1]['_source']['geometry'] = None
+        dummies, entities, exporter = self.run_fake_results(remove_geometry)
+
+        _, key, location = entities[0]
+        assert key == 'location'
+        assert location['id'] == dummies[1].id
+        assert location['geometry.wkb'] is None
+        location = exporter.add_geometry_text([location])[0]
+        assert location['geometry.ewkt'] == ''
+        assert location['geometry.wkt'] == ''
+        assert location['attributes']['name'] == "Long Island"
+
+
+@pytest.mark.usefixtures('clear_temp')
+@pytest.mark.usefixtures('make_dirs')
+class DatabaseSourceTest(BaseTestClass):
+
+    def test_read_project_entities(self):
+        rel = TenureRelationshipFactory.create(
+            project=self.project,
+            spatial_unit__geometry='SRID=4326;POINT(1 1)')
+        res = ResourceFactory.create(project=self.project)
+        ResourceFactory.create(project=self.project, archived=True)
+        assert count_project_entities(self.project) == 4
+
+        entities = list(read_project_entities(self.project))
+        assert [(es_type, source['id']) for es_type, source in entities] == [
+            ('spatial', rel.spatial_unit.id),
+            ('party', rel.party.id),
+            ('party', rel.party.id),
+            ('resource', res.id),
+        ]
+
+        exporter = Exporter(self.project)
+        key, location = exporter.prepare_entity(*entities[0])
+        assert key == 'location'
+        assert location['geometry.wkb'] == POINT_WKB
+        key, party = exporter.prepare_entity(*entities[1])
+        assert key == 'party'
+        assert party['name'] == rel.party.name
+        key, tenure_rel = exporter.prepare_entity(*entities[2])
+        assert key == 'tenure_rel'
+        assert tenure_rel['id'] == rel.id
+        assert tenure_rel['party_id'] == rel.party.id
+        assert tenure_rel['spatial_unit_id'] == rel.spatial_unit.id
+        assert tenure_rel['tenure_type_id'] == rel.tenure_type
+        _, resource = entities[3]
+        assert resource['original_file'] == res.original_file
+        assert resource['file'] == res.file.url
+
+    def test_make_download_from_database(self):
+        rel = TenureRelationshipFactory.create(project=self.project)
+        ensure_dirs()
+
+        exporter = XLSExporter(self.project)
+        xls_path, _ = exporter.make_download(
+            os.path.join(test_dir, 'test-db1'),
+            read_project_entities(self.project))
+
+        assert xls_path == os.path.join(test_dir, 'test-db1.xlsx')
+        wb = load_workbook(xls_path)
+        assert wb.get_sheet_names() == [
+            'locations', 'parties', 'relationships']
+        assert wb['locations']['A2'].value == rel.spatial_unit.id
+        assert wb['parties']['A2'].value == rel.party.id
+        assert wb['relationships']['A2'].value == rel.id
+
+
 class UtilsTest(TestCase):
 
     def test_convert_postgis_ewkb_to_ewkt(self):
@@ -834,3 +1080,20 @@ class UtilsTest(TestCase):
         with pytest.raises(NotWgs84EwkbValueError):
             convert_postgis_ewkb_to_ewkt(ewkb.lower())
         assert convert_postgis_ewkb_to_ewkt(ewkb) == 'SRID=4326;POINT (1 1)'
+
+    def test_convert_postgis_ewkb_to_wkb(self):
+        ewkb = '0101000020E6100000000000000000F03F000000000000F03F'
+        with pytest.raises(NotWgs84EwkbValueError):
+            convert_postgis_ewkb_to_wkb(ewkb.lower())
+        assert convert_postgis_ewkb_to_wkb(ewkb) == POINT_WKB
+
+    def test_convert_wkbs_to_ewkt(self):
+        line_wkb = bytes.fromhex(
+            '010200000002000000000000000000F03F000000000000F03F'
+            '00000000000000400000000000000040')
+        assert convert_wkbs_to_ewkt([POINT_WKB, None, line_wkb]) == [
+            'SRID=4326;POINT (1 1)',
+            '',
+            'SRID=4326;LINESTRING (1 1,2 2)',
+        ]
+        assert convert_wkbs_to_ewkt([]) == []
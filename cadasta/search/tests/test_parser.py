@@ -1,6 +1,8 @@
+import json
 import pytest
 
 from django.test import TestCase
+from unittest.mock import patch
 
 from .. import parser
 
@@ -251,6 +253,54 @@ class ParserTest(TestCase):
             }
         }
 
+    def test_parse_query_plain_terms_skip_pyparsing(self):
+        queries = ['a', 'a b', '   a\t\tb\n', 'a___ b--- c+++', 'b+a b-a',
+                   'ab cd ef gh']
+        expected = {
+            q: parser.transform_to_dsl(parser.query.parseString(q).asList())
+            for q in queries
+        }
+
+        parser.compile_query.cache_clear()
+        with patch.object(parser.query, 'parseString') as parse:
+            for q in queries:
+                assert parser.parse_query(q)['bool']['should'] == expected[q]
+            parse.assert_not_called()
+
+    def test_parse_query_fast_path_matches_pyparsing(self):
+        queries = ['a', 'a b', '  a  b  ', 'a\tb', 'a\u00a0b', 'a"b', '+a',
+                   'a -b', '"a b"', 'a+b c-d', 'é ü ß', '+', '-']
+        for q in queries:
+            stripped = q.strip(parser.whitespace)
+            if parser.plain_query.fullmatch(stripped):
+                tokens = parser.plain_separator.split(stripped)
+                assert tokens == parser.query.parseString(q).asList()
+
+        assert parser.plain_query.fullmatch('a b')
+        assert not parser.plain_query.fullmatch('a\u00a0b')
+        assert not parser.plain_query.fullmatch('a "b c"')
+        assert not parser.plain_query.fullmatch('a +b')
+        assert not parser.plain_query.fullmatch('')
+
+    def test_parse_query_is_memoized(self):
+        parser.compile_query.cache_clear()
+        dsl = parser.parse_query('+a "b c"')
+        with patch.object(parser.query, 'parseString') as parse:
+            assert parser.parse_query('+a "b c"') is dsl
+            assert parser.parse_query('  +a "b c"\n') is dsl
+            parse.assert_not_called()
+        assert parser.compile_query.cache_info().hits == 2
+
+    def test_parse_query_is_immutable(self):
+        dsl = parser.parse_query('a -b')
+        with pytest.raises(TypeError):
+            dsl['bool'] = {}
+        with pytest.raises(TypeError):
+            dsl['bool']['must_not'].append({})
+        with pytest.raises(TypeError):
+            dsl['bool']['should'][0]['multi_match'].update({'boost': 1})
+        assert json.loads(json.dumps(dsl)) == dsl
+
     def test_transform_to_dsl(self):
         f = parser.fields
 
@@ -9,11 +9,12 @@ import subprocess
 
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 # from django.core.exceptions import PermissionDenied
 # from django.core.urlresolvers import reverse
 # from django.http import Http404
 from django.template.loader import render_to_string
-from django.test import TestCase
+from django.test import TestCase, override_settings
 # from openpyxl import load_workbook
 from rest_framework.exceptions import PermissionDenied as APIPermissionDenied
 from unittest.mock import patch
@@ -25,6 +26,7 @@ from skivvy import APITestCase
 # from skivvy import ViewTestCase, APITestCase
 
 from accounts.tests.factories import UserFactory
+from core import breakers
 from core.tests.utils.cases import UserTestCase
 from core.tests.utils.files import make_dirs  # noqa
 from organization.tests.factories import ProjectFactory
@@ -82,6 +84,8 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
     }
 
     def setup_models(self):
+        cache.clear()
+        breakers.es.close()
         self.user = UserFactory.create()
         assign_policies(self.user)
         self.project = ProjectFactory.create(slug='test-project')
@@ -141,9 +145,23 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
             'size': 20,
             'sort': {'_score': {'order': 'desc'}},
         }
-        url = '{}/project-{}/spatial,party,resource/_search/'
-        self.es_endpoint = url.format(api_url, self.project.id)
-        self.es_body = json.dumps(self.query_body, sort_keys=True)
+        index = 'project-{}'.format(self.project.id)
+        self.es_endpoint = api_url + '/_msearch/'
+        lines = (
+            {'index': index, 'type': 'spatial,party,resource'},
+            self.query_body,
+            {'index': index, 'type': 'project'},
+            {'query': {'match_all': {}}, 'size': 1},
+        )
+        self.es_body = ''.join(
+            json.dumps(line, sort_keys=True) + '\n' for line in lines)
+        self.es_headers = {'content-type': 'application/x-ndjson'}
+        self.es_timeout = (settings.ES_CONNECT_TIMEOUT, settings.ES_TIMEOUT)
+
+    def es_response(self, results, timestamp='TIMESTAMP'):
+        return {'responses': [results, {
+            'hits': {'hits': [{'_source': {'@timestamp': timestamp}}]},
+        }]}
 
     def setup_url_kwargs(self):
         return {
@@ -151,11 +169,10 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
             'project': self.project.slug,
         }
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_results(self, mock_post, mock_get):
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = {
+    @patch('requests.Session.request')
+    def test_post_with_results(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response({
             'hits': {
                 'total': 100,
                 'hits': [{
@@ -167,7 +184,7 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
                     },
                 }],
             },
-        }
+        })
 
         response = self.request(user=self.user, method='POST')
         expected_html = render_to_string(
@@ -185,17 +202,16 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
         assert response.content['recordsFiltered'] == 100
         assert response.content['draw'] == 40
         assert response.content['timestamp'] == 'TIMESTAMP'
-        mock_post.assert_called_once_with(
+        mock_request.assert_called_once_with(
+            'POST',
             self.es_endpoint,
             data=self.es_body,
-            headers={'content-type': 'application/json'},
-            timeout=10,
+            headers=self.es_headers,
+            timeout=self.es_timeout,
         )
-        mock_get.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_results_custom_location_type(self, mock_post, mock_get):
+    @patch('requests.Session.request')
+    def test_post_with_results_custom_location_type(self, mock_request):
         questionnaire = q_factories.QuestionnaireFactory.create(
             project=self.project)
         question = q_factories.QuestionFactory.create(
@@ -207,8 +223,8 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
             name='AP',
             label='Custom Apartment')
 
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = {
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response({
             'hits': {
                 'total': 100,
                 'hits': [{
@@ -220,7 +236,7 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
                     },
                 }],
             },
-        }
+        })
 
         response = self.request(user=self.user, method='POST')
         expected_html = render_to_string(
@@ -238,19 +254,18 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
         assert response.content['recordsFiltered'] == 100
         assert response.content['draw'] == 40
         assert response.content['timestamp'] == 'TIMESTAMP'
-        mock_post.assert_called_once_with(
+        mock_request.assert_called_once_with(
+            'POST',
             self.es_endpoint,
             data=self.es_body,
-            headers={'content-type': 'application/json'},
-            timeout=10
+            headers=self.es_headers,
+            timeout=self.es_timeout,
         )
-        mock_get.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_over_max_results(self, mock_post, mock_get):
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = {
+    @patch('requests.Session.request')
+    def test_post_with_over_max_results(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response({
             'hits': {
                 'total': settings.ES_MAX_RESULTS + 1000,
                 'hits': [{
@@ -262,7 +277,7 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
                     },
                 }],
             },
-        }
+        })
 
         response = self.request(user=self.user, method='POST')
         expected_html = render_to_string(
@@ -280,34 +295,23 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
         assert response.content['recordsFiltered'] == settings.ES_MAX_RESULTS
         assert response.content['draw'] == 40
         assert response.content['timestamp'] == 'TIMESTAMP'
-        mock_post.assert_called_once_with(
+        mock_request.assert_called_once_with(
+            'POST',
             self.es_endpoint,
             data=self.es_body,
-            headers={'content-type': 'application/json'},
-            timeout=10,
+            headers=self.es_headers,
+            timeout=self.es_timeout,
         )
-        mock_get.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_no_results(self, mock_post, mock_get):
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = {
+    @patch('requests.Session.request')
+    def test_post_with_no_results(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response({
             'hits': {
                 'total': 100,
                 'hits': [],
             },
-        }
-        mock_get.return_value.status_code = 200
-        mock_get.return_value.json.return_value = {
-            'hits': {
-                'hits': [{
-                    '_source': {
-                        '@timestamp': 'TIMESTAMP',
-                    },
-                }],
-            },
-        }
+        })
 
         response = self.request(user=self.user, method='POST')
         assert response.status_code == 200
@@ -316,24 +320,38 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
         assert response.content['recordsFiltered'] == 100
         assert response.content['draw'] == 40
         assert response.content['timestamp'] == 'TIMESTAMP'
-        mock_post.assert_called_once_with(
+        mock_request.assert_called_once_with(
+            'POST',
             self.es_endpoint,
             data=self.es_body,
-            headers={'content-type': 'application/json'},
-            timeout=10,
-        )
-        mock_get.assert_called_once_with(
-            '{}/project-{}/project/_search/?q=*'.format(
-                api_url, self.project.id
-            ),
-            timeout=10,
+            headers=self.es_headers,
+            timeout=self.es_timeout,
         )
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_project_result(self, mock_post, mock_get):
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = {
+    @patch('requests.Session.request')
+    def test_post_with_no_results_and_no_timestamp(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = {'responses': [{
+            'hits': {
+                'total': 0,
+                'hits': [],
+            },
+        }, {
+            'hits': {
+                'total': 0,
+                'hits': [],
+            },
+        }]}
+
+        response = self.request(user=self.user, method='POST')
+        assert response.status_code == 200
+        assert response.content['data'] == []
+        assert response.content['timestamp'] == "unknown"
+
+    @patch('requests.Session.request')
+    def test_post_with_project_result(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response({
             'hits': {
                 'total': 100,
                 'hits': [{
@@ -343,7 +361,7 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
                     },
                 }],
             },
-        }
+        })
 
         response = self.request(user=self.user, method='POST')
         assert response.status_code == 200
@@ -352,19 +370,18 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
         assert response.content['recordsFiltered'] == 100
         assert response.content['draw'] == 40
         assert response.content['timestamp'] == 'TIMESTAMP'
-        mock_post.assert_called_once_with(
+        mock_request.assert_called_once_with(
+            'POST',
             self.es_endpoint,
             data=self.es_body,
-            headers={'content-type': 'application/json'},
-            timeout=10,
+            headers=self.es_headers,
+            timeout=self.es_timeout,
         )
-        mock_get.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_null_id(self, mock_post, mock_get):
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = {
+    @patch('requests.Session.request')
+    def test_post_with_null_id(self, mock_request):
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response({
             'hits': {
                 'total': 100,
                 'hits': [{
@@ -375,7 +392,7 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
                     },
                 }],
             },
-        }
+        })
 
         response = self.request(user=self.user, method='POST')
         assert response.status_code == 200
@@ -384,17 +401,16 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
         assert response.content['recordsFiltered'] == 100
         assert response.content['draw'] == 40
         assert response.content['timestamp'] == 'TIMESTAMP'
-        mock_post.assert_called_once_with(
+        mock_request.assert_called_once_with(
+            'POST',
             self.es_endpoint,
             data=self.es_body,
-            headers={'content-type': 'application/json'},
-            timeout=10,
+            headers=self.es_headers,
+            timeout=self.es_timeout,
         )
-        mock_get.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_missing_query(self, mock_post, mock_get):
+    @patch('requests.Session.request')
+    def test_post_with_missing_query(self, mock_request):
         response = self.request(
             user=self.user, method='POST', post_data={'q': None})
         assert response.status_code == 200
@@ -403,12 +419,11 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
         assert response.content['recordsFiltered'] == 0
         assert response.content['draw'] == 40
         assert response.content['timestamp'] == ''
-        mock_post.assert_not_called()
-        mock_get.assert_not_called()
+        mock_request.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_es_not_ok(self, mock_post, mock_get):
+    @patch('requests.Session.request')
+    def test_post_with_es_not_ok(self, mock_request):
+        mock_request.return_value.status_code = 503
         response = self.request(user=self.user, method='POST')
         assert response.status_code == 200
         assert response.content['data'] == []
@@ -416,17 +431,16 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
         assert response.content['recordsFiltered'] == 0
         assert response.content['draw'] == 40
         assert response.content['error'] == 'unavailable'
-        mock_post.assert_called_once_with(
+        mock_request.assert_called_once_with(
+            'POST',
             self.es_endpoint,
             data=self.es_body,
-            headers={'content-type': 'application/json'},
-            timeout=10,
+            headers=self.es_headers,
+            timeout=self.es_timeout,
         )
-        mock_get.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post', new=mock_request_with_exception)
-    def test_post_with_es_connection_not_ok(self, mock_get):
+    @patch('requests.Session.request', new=mock_request_with_exception)
+    def test_post_with_es_connection_not_ok(self):
         response = self.request(user=self.user, method='POST')
         assert response.status_code == 200
         assert response.content['data'] == []
@@ -434,118 +448,219 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
         assert response.content['recordsFiltered'] == 0
         assert response.content['draw'] == 40
         assert response.content['error'] == 'unavailable'
-        mock_get.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_nonexistent_org(self, mock_post, mock_get):
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    @patch('requests.Session.request')
+    def test_post_with_es_connection_not_ok_serves_stale(self, mock_request):
+        cache.clear()
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response({
+            'hits': {
+                'total': 100,
+                'hits': [{
+                    '_type': 'spatial',
+                    '_source': {
+                        'id': self.su.id,
+                        'type': 'AP',
+                        '@timestamp': 'TIMESTAMP',
+                    },
+                }],
+            },
+        })
+        fresh = self.request(user=self.user, method='POST')
+        assert 'stale' not in fresh.content
+        # Let the cached index timestamp expire, so the page cache is skipped
+        cache.delete(async.get_timestamp_cache_key(self.project.id))
+
+        mock_request.side_effect = requests.exceptions.ConnectionError
+        response = self.request(user=self.user, method='POST')
+        assert response.status_code == 200
+        assert response.content['stale'] is True
+        assert response.content['data'] == fresh.content['data']
+        assert response.content['recordsTotal'] == 100
+        assert response.content['timestamp'] == 'TIMESTAMP'
+
+        # Other pages have not been cached
+        response = self.request(user=self.user, method='POST',
+                                post_data={'start': 30})
+        assert response.content['error'] == 'unavailable'
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    @patch('requests.Session.request')
+    def test_post_with_cached_page(self, mock_request):
+        cache.clear()
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response({
+            'hits': {
+                'total': 100,
+                'hits': [{
+                    '_type': 'spatial',
+                    '_source': {
+                        'id': self.su.id,
+                        'type': 'AP',
+                        '@timestamp': 'TIMESTAMP',
+                    },
+                }],
+            },
+        })
+        fresh = self.request(user=self.user, method='POST')
+
+        with self.assertNumQueries(0):
+            view = self.view_class()
+            page = view.get_results_page(self.project, ' searching ', 10, 20)
+        assert page['data'] == fresh.content['data']
+        assert page['recordsTotal'] == 100
+        assert page['timestamp'] == 'TIMESTAMP'
+
+        response = self.request(user=self.user, method='POST',
+                                post_data={'draw': 41})
+        assert response.content['data'] == fresh.content['data']
+        assert response.content['draw'] == 41
+        assert mock_request.call_count == 1
+
+        # Another page is not cached yet
+        self.request(user=self.user, method='POST', post_data={'start': 30})
+        assert mock_request.call_count == 2
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    @patch('requests.Session.request')
+    def test_post_with_cached_page_after_reindex(self, mock_request):
+        cache.clear()
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response({
+            'hits': {
+                'total': 0,
+                'hits': [],
+            },
+        })
+        response = self.request(user=self.user, method='POST')
+        assert response.content['timestamp'] == 'TIMESTAMP'
+
+        # A reindex is picked up once the index timestamp is refreshed
+        cache.set(async.get_timestamp_cache_key(self.project.id), 'NEW')
+        mock_request.return_value.json.return_value = self.es_response({
+            'hits': {
+                'total': 0,
+                'hits': [],
+            },
+        }, timestamp='NEW')
+        response = self.request(user=self.user, method='POST')
+        assert response.content['timestamp'] == 'NEW'
+        assert mock_request.call_count == 2
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    @patch('requests.Session.request')
+    def test_post_with_es_breaker_open(self, mock_request):
+        cache.clear()
+        mock_request.side_effect = requests.exceptions.ConnectTimeout
+        for _ in range(breakers.es.fail_max):
+            response = self.request(user=self.user, method='POST')
+            assert response.content['error'] == 'unavailable'
+        assert breakers.es.is_open
+        assert mock_request.call_count == breakers.es.fail_max
+
+        # No more requests are sent to ES while the breaker is open
+        response = self.request(user=self.user, method='POST')
+        assert response.content['error'] == 'unavailable'
+        assert mock_request.call_count == breakers.es.fail_max
+
+    @patch('requests.Session.request')
+    def test_post_with_nonexistent_org(self, mock_request):
         response = self.request(user=self.user,
                                 method='POST',
                                 url_kwargs={'organization': 'evil-corp'})
         assert response.status_code == 404
         assert response.content['detail'] == "Project not found."
-        mock_post.assert_not_called()
-        mock_get.assert_not_called()
+        mock_request.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_nonexistent_project(self, mock_post, mock_get):
+    @patch('requests.Session.request')
+    def test_post_with_nonexistent_project(self, mock_request):
         response = self.request(user=self.user,
                                 method='POST',
                                 url_kwargs={'project': 'world-domination'})
         assert response.status_code == 404
         assert response.content['detail'] == "Project not found."
-        mock_post.assert_not_called()
-        mock_get.assert_not_called()
+        mock_request.assert_not_called()
 
-    @patch('requests.get')
-    @patch('requests.post')
-    def test_post_with_unauthorized_user(self, mock_post, mock_get):
+    @patch('requests.Session.request')
+    def test_post_with_unauthorized_user(self, mock_request):
         response = self.request(method='POST')
         assert response.status_code == 403
         assert response.content['detail'] == APIPermissionDenied.default_detail
-        mock_post.assert_not_called()
-        mock_get.assert_not_called()
+        mock_request.assert_not_called()
 
-    @patch('requests.post')
-    def test_query_es(self, mock_post):
-        mock_post.return_value.status_code = 200
-        mock_post.return_value.json.return_value = {
+    @patch('requests.Session.request')
+    def test_query_es(self, mock_request):
+        results = {
             'hits': {
                 'total': 0,
                 'hits': [],
             },
         }
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response(results)
 
-        raw_results = self.view_class().query_es(
+        es_response = self.view_class().query_es(
             self.project.id, self.query, 10, 20)
-        assert raw_results == mock_post.return_value.json.return_value
-        mock_post.assert_called_once_with(
+        assert es_response == (results, 'TIMESTAMP', False)
+        mock_request.assert_called_once_with(
+            'POST',
             self.es_endpoint,
             data=self.es_body,
-            headers={'content-type': 'application/json'},
-            timeout=10,
+            headers=self.es_headers,
+            timeout=self.es_timeout,
         )
 
-    @patch('requests.post')
-    def test_query_es_not_ok(self, mock_post):
-        mock_post.return_value.status_code = 404
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    @patch('requests.Session.request')
+    def test_query_es_connection_not_ok_with_cached_results(
+            self, mock_request):
+        cache.clear()
+        results = {
+            'hits': {
+                'total': 0,
+                'hits': [],
+            },
+        }
+        mock_request.return_value.status_code = 200
+        mock_request.return_value.json.return_value = self.es_response(results)
+        self.view_class().query_es(self.project.id, self.query, 10, 20)
+
+        mock_request.side_effect = requests.exceptions.ConnectionError
+        es_response = self.view_class().query_es(
+            self.project.id, self.query, 10, 20)
+        assert es_response == (results, 'TIMESTAMP', True)
+
+    @patch('requests.Session.request')
+    def test_query_es_not_ok(self, mock_request):
+        mock_request.return_value.status_code = 404
 
-        raw_results = self.view_class().query_es(
+        es_response = self.view_class().query_es(
             self.project.id, self.query, 10, 20)
-        assert raw_results is None
-        mock_post.assert_called_once_with(
+        assert es_response is None
+        mock_request.assert_called_once_with(
+            'POST',
             self.es_endpoint,
             data=self.es_body,
-            headers={'content-type': 'application/json'},
-            timeout=10,
+            headers=self.es_headers,
+            timeout=self.es_timeout,
         )
 
-    @patch('requests.post', new=mock_request_with_exception)
+    @patch('requests.Session.request', new=mock_request_with_exception)
     def test_query_es_connection_not_ok(self):
-        raw_results = self.view_class().query_es(
+        es_response = self.view_class().query_es(
             self.project.id, self.query, 10, 20)
-        assert raw_results is None
-
-    @patch('requests.get')
-    def test_query_es_timestamp(self, mock_get):
-        mock_get.return_value.status_code = 200
-        mock_get.return_value.json.return_value = {
-            'hits': {
-                'hits': [{
-                    '_source': {
-                        '@timestamp': 'TIMESTAMP',
-                    },
-                }],
-            },
-        }
-
-        timestamp = self.view_class().query_es_timestamp(self.project.id)
-        assert timestamp == 'TIMESTAMP'
-        mock_get.assert_called_once_with(
-            '{}/project-{}/project/_search/?q=*'.format(
-                api_url, self.project.id
-            ),
-            timeout=10,
-        )
-
-    @patch('requests.get')
-    def test_query_es_timestamp_not_ok(self, mock_get):
-        mock_get.return_value.status_code = 404
-
-        timestamp = self.view_class().query_es_timestamp(self.project.id)
-        assert timestamp == "unknown"
-        mock_get.assert_called_once_with(
-            '{}/project-{}/project/_search/?q=*'.format(
-                api_url, self.project.id
-            ),
-            timeout=10,
-        )
-
-    @patch('requests.get', new=mock_request_with_exception)
-    def test_query_es_timestamp_connection_not_ok(self):
-        timestamp = self.view_class().query_es_timestamp(self.project.id)
-        assert timestamp == "unknown"
+        assert es_response is None
 
     def test_augment_result_location(self):
         view = self.view_class()
@@ -610,6 +725,40 @@ class SearchAPITest(APITestCase, UserTestCase, TestCase):
             '_source': {},
         }) is None
 
+    def test_augment_result_with_prefetched_entities(self):
+        entities = self.view_class().get_entities([self.party_result])
+        with self.assertNumQueries(0):
+            augmented_result = self.view_class().augment_result(
+                self.party_result, entities)
+        assert augmented_result['url'] == self.party.get_absolute_url()
+        assert augmented_result['main_label'] == "Party in the USA"
+
+    def test_get_entities(self):
+        results = self.results['hits']['hits']
+        with self.assertNumQueries(4):
+            entities = self.view_class().get_entities(results)
+        assert entities == {
+            (SpatialUnit, self.su.id): self.su,
+            (Party, self.party.id): self.party,
+            (TenureRelationship, self.tenure_rel.id): self.tenure_rel,
+            (Resource, self.resource.id): self.resource,
+        }
+
+    def test_get_entities_unsupported_es_type(self):
+        with self.assertNumQueries(0):
+            assert self.view_class().get_entities([self.proj_result]) == {}
+
+    def test_get_schema_attributes_resolved_once(self):
+        view = self.view_class()
+        su2 = SpatialUnitFactory.create(project=self.project)
+        entities = view.get_entities([self.su_result, {
+            '_type': 'spatial', '_source': {'id': su2.id}}])
+        attrs = view.get_schema_attributes(
+            entities[(SpatialUnit, self.su.id)])
+        with self.assertNumQueries(0):
+            assert view.get_schema_attributes(
+                entities[(SpatialUnit, su2.id)]) == attrs
+
     def test_get_entity_location(self):
         assert self.view_class().get_entity(
             'spatial', self.su_result['_source']) == self.su
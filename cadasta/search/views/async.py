@@ -1,13 +1,16 @@
-import json
+import hashlib
+# import json
 # import os
-import requests
+from collections import defaultdict
+from functools import reduce
 # import subprocess
 # import time
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 # from django.http import HttpResponse, HttpResponseBadRequest
-from django.utils.translation import ugettext as _
-from django.core.exceptions import ObjectDoesNotExist
+from django.utils.translation import get_language, ugettext as _
 from django.template.loader import render_to_string
 # from django.views.generic.base import View
 from rest_framework.views import APIView
@@ -17,6 +20,7 @@ from rest_framework.response import Response
 from jsonattrs.models import Schema
 from tutelary import mixins as tmixins
 
+from core import breakers
 # from organization import messages as org_messages
 from organization.views.mixins import ProjectMixin
 from spatial.models import SpatialUnit
@@ -25,7 +29,8 @@ from party.models import Party, TenureRelationship
 from party.choices import TENURE_RELATIONSHIP_TYPES
 from core.form_mixins import get_types
 from resources.models import Resource
-from ..parser import parse_query
+from ..client import client as es_client
+from ..parser import normalize_query, parse_query
 # from ..export.all import AllExporter
 # from ..export.resource import ResourceExporter
 # from ..export.shape import ShapeExporter
@@ -35,11 +40,60 @@ api_url = (
     settings.ES_SCHEME + '://' + settings.ES_HOST + ':' + settings.ES_PORT)
 party_type_choices = {c[0]: c[1] for c in Party.TYPE_CHOICES}
 
+# Maps each ES type to the models its documents may represent, in the order
+# in which they should be tried, and the source field holding the model ID.
+entity_mappings = {
+    'spatial': (
+        {
+            'model': SpatialUnit,
+            'id_field_name': 'id',
+        },
+    ),
+    'party': (
+        {
+            'model': TenureRelationship,
+            'id_field_name': 'tenure_id',
+        },
+        {
+            'model': Party,
+            'id_field_name': 'id',
+        },
+    ),
+    'resource': (
+        {
+            'model': Resource,
+            'id_field_name': 'id',
+        },
+    ),
+}
+
+
+def get_timestamp_cache_key(project_id):
+    return 'search:timestamp:{}'.format(project_id)
+
+
+def get_page_cache_key(index_timestamp, project, query, start_idx,
+                       page_size):
+    query_hash = hashlib.md5(query.encode('utf-8')).hexdigest()
+    return 'search:page:{}:{}:{}:{}:{}:{}:{}'.format(
+        project.id, project.current_questionnaire, index_timestamp,
+        query_hash, start_idx, page_size, get_language())
+
+
+def get_fallback_cache_key(project_id, query, start_idx, page_size):
+    query_hash = hashlib.md5(query.encode('utf-8')).hexdigest()
+    return 'search:fallback:{}:{}:{}:{}'.format(
+        project_id, query_hash, start_idx, page_size)
+
 
 class Search(tmixins.APIPermissionRequiredMixin, ProjectMixin, APIView):
 
     permission_required = 'project.view_private'
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.schema_attrs = {}
+
     def get_perms_objects(self):
         return [self.get_project()]
 
@@ -49,7 +103,57 @@ class Search(tmixins.APIPermissionRequiredMixin, ProjectMixin, APIView):
         page_size = int(request.data.get('length', 10))
         dataTablesDraw = int(request.data['draw'])
 
-        project = self.get_project()
+        page = {
+            'recordsTotal': 0,
+            'recordsFiltered': 0,
+            'data': [],
+            'timestamp': '',
+        }
+        if query:
+            page = self.get_results_page(
+                self.get_project(), query, start_idx, page_size)
+            if page is None:
+                return Response({
+                    'draw': dataTablesDraw,
+                    'recordsTotal': 0,
+                    'recordsFiltered': 0,
+                    'data': [],
+                    'error': 'unavailable',
+                })
+
+        page['draw'] = dataTablesDraw
+        return Response(page)
+
+    def get_results_page(self, project, query, start_idx, page_size):
+        """Returns the rendered page of search results, or `None` if ES is
+        unavailable. Pages are cached under the project index timestamp, so
+        reindexing the project invalidates them."""
+        key_args = (project, normalize_query(query), start_idx, page_size)
+        timestamp_key = get_timestamp_cache_key(project.id)
+        index_timestamp = cache.get(timestamp_key)
+        if index_timestamp:
+            page = cache.get(get_page_cache_key(index_timestamp, *key_args))
+            if page is not None:
+                return page
+
+        es_response = self.query_es(project.id, query, start_idx, page_size)
+        if es_response is None:
+            return None
+        raw_results, index_timestamp, is_stale = es_response
+
+        page = self.render_page(project, raw_results, index_timestamp)
+        if is_stale:
+            page['stale'] = True
+        elif index_timestamp:
+            cache.set(timestamp_key, index_timestamp,
+                      settings.ES_INDEX_TIMESTAMP_CACHE_TIMEOUT)
+            cache.set(get_page_cache_key(index_timestamp, *key_args), page,
+                      settings.ES_RESULTS_CACHE_TIMEOUT)
+        return page
+
+    def render_page(self, project, raw_results, index_timestamp):
+        """Hydrates and renders the raw ES results into a page of HTML
+        results for DataTables."""
         tenure_types = get_types(
             'tenure_type',
             TENURE_RELATIONSHIP_TYPES,
@@ -64,90 +168,70 @@ class Search(tmixins.APIPermissionRequiredMixin, ProjectMixin, APIView):
             include_labels=True)
         self.spatial_types = dict(spatial_types)
 
-        results_as_html = []
-        num_hits = 0
-        timestamp = ''
+        num_hits = min(raw_results['hits']['total'],
+                       settings.ES_MAX_RESULTS)
+        results = raw_results['hits']['hits']
 
-        if query:
-            raw_results = self.query_es(
-                self.get_project().id, query, start_idx, page_size)
-            if raw_results is None:
-                return Response({
-                    'draw': dataTablesDraw,
-                    'recordsTotal': 0,
-                    'recordsFiltered': 0,
-                    'data': [],
-                    'error': 'unavailable',
-                })
+        if len(results) == 0:
+            timestamp = index_timestamp or _("unknown")
+        else:
+            timestamp = results[0]['_source'].get('@timestamp')
 
-            num_hits = min(raw_results['hits']['total'],
-                           settings.ES_MAX_RESULTS)
-            results = raw_results['hits']['hits']
-
-            if len(results) == 0:
-                timestamp = self.query_es_timestamp(project.id)
-            else:
-                timestamp = results[0]['_source'].get('@timestamp')
-
-            for result in results:
-                if result['_type'] == 'project':
-                    continue
-                augmented_result = self.augment_result(result)
-                if augmented_result is None:
-                    continue
-                html = self.htmlize_result(augmented_result)
-                results_as_html.append([html])
-
-        return Response({
-            'draw': dataTablesDraw,
+        results_as_html = []
+        entities = self.get_entities(results)
+        for result in results:
+            if result['_type'] == 'project':
+                continue
+            augmented_result = self.augment_result(result, entities)
+            if augmented_result is None:
+                continue
+            html = self.htmlize_result(augmented_result)
+            results_as_html.append([html])
+
+        return {
             'recordsTotal': num_hits,
             'recordsFiltered': num_hits,
             'data': results_as_html,
             'timestamp': timestamp,
-        })
+        }
 
     def query_es(self, project_id, query, start_idx, page_size):
-        """Queries the ES API based on the UI query string and returns the
-        raw ES JSON results."""
+        """Queries the ES API based on the UI query string and returns a tuple
+        of the raw ES JSON results, the project index timestamp, which is
+        fetched in the same round trip, and whether the results are stale.
+
+        Successful responses are kept in the cache so that they can be served
+        as stale results while ES is failing or its circuit breaker is open.
+        Returns `None` if ES is unavailable and nothing has been cached."""
         body = {
             'query': parse_query(query),
             'from': start_idx,
             'size': page_size,
             'sort': {'_score': {'order': 'desc'}},
         }
+        cache_key = get_fallback_cache_key(
+            project_id, query, start_idx, page_size)
         try:
-            url = '{}/project-{}/spatial,party,resource/_search/'
-            r = requests.post(
-                url.format(api_url, project_id),
-                data=json.dumps(body, sort_keys=True),
-                headers={'content-type': 'application/json'},
-                timeout=10,
-            )
-            if r.status_code == 200:
-                return r.json()
-            else:
+            es_response = es_client.search_with_timestamp(project_id, body)
+        except breakers.es.expected_errors:
+            es_response = cache.get(cache_key)
+            if es_response is None:
                 return None
-        except requests.exceptions.RequestException:
+            return es_response + (True,)
+
+        if es_response is None:
             return None
+        cache.set(cache_key, es_response,
+                  settings.ES_FALLBACK_CACHE_TIMEOUT)
+        return es_response + (False,)
 
-    def query_es_timestamp(self, project_id):
-        """Queries the ES API project type to get the index timestamp."""
-        try:
-            url = '{}/project-{}/project/_search/?q=*'
-            r = requests.get(url.format(api_url, project_id), timeout=10)
-            if r.status_code == 200:
-                return r.json()['hits']['hits'][0]['_source'].get('@timestamp')
-            else:
-                return _("unknown")
-        except requests.exceptions.RequestException:
-            return _("unknown")
-
-    def augment_result(self, result):
+    def augment_result(self, result, entities=None):
         """Returns an augmented data suitable for plugging into HTML
-        given the raw ES result."""
+        given the raw ES result. `entities` are the model instances
+        previously loaded for the page by `get_entities`."""
         es_type = result['_type']
         source = result['_source']
-        entity = self.get_entity(es_type, source)
+        entity = self.get_entity(es_type, source, entities)
         if entity is None:
             return None
         model = type(entity)
@@ -163,42 +247,36 @@ class Search(tmixins.APIPermissionRequiredMixin, ProjectMixin, APIView):
 
         return augmented_result
 
-    def get_entity(self, es_type, source):
+    def get_entities(self, results):
+        """Loads the model instances for a page of ES results with a single
+        query per model and returns them keyed by (model, ID)."""
+        ids = defaultdict(set)
+        for result in results:
+            for model_map in entity_mappings.get(result['_type'], ()):
+                id = result['_source'].get(model_map['id_field_name'])
+                if id:
+                    ids[model_map['model']].add(id)
+
+        entities = {}
+        for model, model_ids in ids.items():
+            queryset = model.objects.select_related('project__organization')
+            if model == TenureRelationship:
+                queryset = queryset.select_related('spatial_unit')
+            for id, entity in queryset.in_bulk(list(model_ids)).items():
+                entities[(model, id)] = entity
+        return entities
+
+    def get_entity(self, es_type, source, entities=None):
         """Returns the model instance for a search result given its ES type and
         the result source document, which should contain the database ID."""
-        mappings = {
-            'spatial': (
-                {
-                    'model': SpatialUnit,
-                    'id_field_name': 'id',
-                },
-            ),
-            'party': (
-                {
-                    'model': TenureRelationship,
-                    'id_field_name': 'tenure_id',
-                },
-                {
-                    'model': Party,
-                    'id_field_name': 'id',
-                },
-            ),
-            'resource': (
-                {
-                    'model': Resource,
-                    'id_field_name': 'id',
-                },
-            ),
-        }
-        mapping = mappings.get(es_type)
-        if mapping:
-            for model_map in mapping:
-                id = source.get(model_map['id_field_name'])
-                if id:
-                    try:
-                        return model_map['model'].objects.get(id=id)
-                    except ObjectDoesNotExist:
-                        pass
+        if entities is None:
+            entities = self.get_entities([{'_type': es_type,
+                                           '_source': source}])
+        for model_map in entity_mappings.get(es_type, ()):
+            id = source.get(model_map['id_field_name'])
+            entity = entities.get((model_map['model'], id))
+            if entity is not None:
+                return entity
         return None
 
     def get_main_label(self, model, source):
@@ -214,8 +292,7 @@ class Search(tmixins.APIPermissionRequiredMixin, ProjectMixin, APIView):
         """Returns additional display data for the result."""
         if type(entity) == SpatialUnit:
             attributes = []
-            schema = Schema.objects.from_instance(entity)
-            attrs = [a for s in schema for a in s.attributes.all()]
+            attrs = self.get_schema_attributes(entity)
             attributes.extend([
                 (a.long_name, a.render(entity.attributes.get(a.name, '—')))
                 for a in attrs if not a.omit and 'name' in a.name
@@ -235,6 +312,23 @@ class Search(tmixins.APIPermissionRequiredMixin, ProjectMixin, APIView):
             ]
         return attributes
 
+    def get_schema_attributes(self, entity):
+        """Returns the schema attributes that apply to the entity. Schemas are
+        resolved once per content type and selectors for the whole page."""
+        content_type = ContentType.objects.get_for_model(entity)
+        label = '{}.{}'.format(content_type.app_label, content_type.model)
+        selectors = tuple(
+            reduce(getattr, selector.split('.'), entity)
+            for selector in settings.JSONATTRS_SCHEMA_SELECTORS[label])
+
+        key = (content_type.id, selectors)
+        if key not in self.schema_attrs:
+            schemas = Schema.objects.lookup(
+                content_type=content_type, selectors=list(selectors))
+            self.schema_attrs[key] = [
+                a for s in schemas for a in s.attributes.all()]
+        return self.schema_attrs[key]
+
     def htmlize_result(self, result):
         """Formats the search result into an HTML snippet."""
         return render_to_string(
@@ -19,7 +19,10 @@ from .choices import TYPE_CHOICES
 from resources.mixins import ResourceModelMixin
 from jsonattrs.fields import JSONAttributeField
 from jsonattrs.decorators import fix_model_for_attributes
-from questionnaires.models import Questionnaire, QuestionOption
+from questionnaires.catalog import get_option_catalog
+
+# Marks options that are missing from a questionnaire
+MISSING = object()
 
 
 @fix_model_for_attributes
@@ -140,9 +143,8 @@ class SpatialUnit(ResourceModelMixin, RandomIDModel):
             return translated_label
 
         # If label failed to translate, fallback to default language
-        rel_questionnaire = Questionnaire.objects.get(
-            id=self.project.current_questionnaire)
-        return self.label.get(rel_questionnaire.default_language)
+        catalog = get_option_catalog(self.project.current_questionnaire)
+        return self.label.get(catalog.default_language)
 
 
 def reassign_spatial_geometry(instance):
@@ -290,11 +292,11 @@ def set_label_on_spatialunits(sender, instance, **kwargs):
         if unchanged:
             return
 
-    try:
-        rel_questionoption = QuestionOption.objects.get(
-            name=instance.type,
-            question__name='location_type',
-            question__questionnaire__id=instance.project.current_questionnaire)
-    except QuestionOption.DoesNotExist:
+    questionnaire_id = instance.project.current_questionnaire
+    if not questionnaire_id:
+        return
+    label = get_option_catalog(questionnaire_id).get_label_xlat(
+        'location_type', instance.type, MISSING)
+    if label is MISSING:
         return
-    instance.label = rel_questionoption.label_xlat
+    instance.label = label
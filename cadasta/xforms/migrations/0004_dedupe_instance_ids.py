@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+
+import uuid
+from django.db import migrations
+from django.db.models import Count
+
+
+def dedupe_instance_ids(apps, schema_editor):
+    # Submissions sent again concurrently could be stored twice. The first
+    # one keeps the instance ID, so that it can be made unique.
+    XFormSubmission = apps.get_model('xforms', 'XFormSubmission')
+    duplicates = XFormSubmission.objects.values('instanceID').annotate(
+        count=Count('id')).filter(count__gt=1)
+
+    for duplicate in duplicates:
+        submissions = XFormSubmission.objects.filter(
+            instanceID=duplicate['instanceID']).order_by('created_date', 'id')
+        for submission in submissions[1:]:
+            submission.instanceID = uuid.uuid4()
+            submission.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('xforms', '0003_add_audit_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            dedupe_instance_ids,
+            reverse_code=migrations.RunPython.noop
+        )
+    ]
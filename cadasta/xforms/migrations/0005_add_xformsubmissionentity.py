@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.20 on 2026-10-18 07:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('xforms', '0004_dedupe_instance_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='XFormSubmissionEntity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.CharField(max_length=24)),
+                ('index', models.PositiveIntegerField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+            ],
+            options={
+                'ordering': ('submission', 'content_type', 'index'),
+            },
+        ),
+        migrations.AlterField(
+            model_name='xformsubmission',
+            name='instanceID',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AddField(
+            model_name='xformsubmissionentity',
+            name='submission',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entities', to='xforms.XFormSubmission'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='xformsubmissionentity',
+            unique_together=set([('submission', 'content_type', 'index')]),
+        ),
+    ]
@@ -1,49 +1,71 @@
-from django.core.exceptions import PermissionDenied
-from django.core.files.storage import get_storage_class
+import os
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.contrib.gis.geos import GEOSGeometry
 from django.contrib.gis.db import models as geo_models
 from django.db.models.functions import Cast
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.utils.translation import ugettext as _
-from jsonattrs.models import Attribute, AttributeType
+from lxml import etree
 from tutelary.models import Policy
+from organization.models import get_contributor_cache_key
 from party.models import Party, TenureRelationship
-from pyxform.xform2json import XFormToDict
+from questionnaires.catalog import get_attribute_types
 from questionnaires.models import Questionnaire, Question
 from resources.models import Resource
+from resources.utils.io import ensure_dirs
 from spatial.models import SpatialUnit
 from xforms.exceptions import InvalidXMLSubmission
 from xforms.models import XFormSubmission
+from xforms.tasks import schedule_attachment_ingestion
 from xforms.utils import odk_geom_to_wkt
 from core.messages import SANITIZE_ERROR
+from core.util import random_id
 from core.validators import sanitize_string
 
-
-def get_policy_instance(policy_name, variables=None):
-    return (Policy.objects.get(name=policy_name), variables)
+# Models of the attribute groups of submissions
+ATTRIBUTE_MODELS = {
+    'party': 'party',
+    'location': 'spatialunit',
+    'tenure_relationship': 'tenurerelationship',
+}
+
+
+def can_contribute(user, project):
+    """Returns whether the user is a superuser, an admin of the project's
+    organization, or a manager or data collector of the project."""
+    policies = {policy.name: policy for policy in Policy.objects.filter(
+        name__in=['superuser', 'org-admin', 'project-manager',
+                  'data-collector'])}
+    org_vars = {'organization': project.organization.slug}
+    prj_vars = {'organization': project.organization.slug,
+                'project': project.slug}
+    roles = [(policies['superuser'], None),
+             (policies['org-admin'], org_vars),
+             (policies['project-manager'], prj_vars),
+             (policies['data-collector'], prj_vars)]
+    assigned_policies = user.assigned_policies()
+    return any(role in assigned_policies for role in roles)
 
 
 class ModelHelper():
     def __init__(self, *arg):
         self.arg = arg
+        # Attachments spooled by spool_resource(), by file name
+        self.attachments = OrderedDict()
 
     def _check_perm(self, user, project):
-        superuser = get_policy_instance('superuser')
-        org_admin = get_policy_instance('org-admin', {
-            'organization': project.organization.slug
-        })
-        prj_manager = get_policy_instance('project-manager', {
-            'organization': project.organization.slug,
-            'project': project.slug
-        })
-        data_collector = get_policy_instance('data-collector', {
-            'organization': project.organization.slug,
-            'project': project.slug
-        })
-
-        roles = [superuser, org_admin, prj_manager, data_collector]
-        assigned_policies = user.assigned_policies()
-        if not any(role in assigned_policies for role in roles):
+        key = get_contributor_cache_key(user.id, project.id)
+        allowed = cache.get(key)
+        if allowed is None:
+            allowed = can_contribute(user, project)
+            cache.set(key, allowed,
+                      settings.CONTRIBUTOR_PERMISSION_CACHE_TIMEOUT)
+        if not allowed:
             raise PermissionDenied(_("You don't have permission to contribute"
                                      " data to this project."))
 
@@ -53,12 +75,6 @@ class ModelHelper():
         )
         self._check_perm(user, questionnaire.project)
 
-        # If xform has already been submitted, check for additional resources
-        additional_resources = self.check_for_duplicate_submission(
-                        data, questionnaire)
-        if additional_resources:
-            return additional_resources
-
         project = questionnaire.project
 
         if project.current_questionnaire != questionnaire.id:
@@ -88,37 +104,51 @@ class ModelHelper():
                 locations, location_resources,
                 tenure_relationships, tenure_resources)
 
-    def check_for_duplicate_submission(self, data, questionnaire):
-        previous_submission = XFormSubmission.objects.filter(
-            instanceID=data['meta']['instanceID']
-        )
-
-        if not previous_submission:
-            return None
-
-        previous_submission = previous_submission[0]
-
-        party_objects, party_resources = self.create_party(
-            data=data,
-            project=questionnaire.project,
-            duplicate=previous_submission)
-
-        location_objects, location_resources = self.create_spatial_unit(
-            data=data,
-            project=questionnaire.project,
-            duplicate=previous_submission)
-
-        tenure_objects, tenure_resources = self.create_tenure_relationship(
-            data=data,
-            project=questionnaire.project,
-            parties=party_objects,
-            locations=location_objects,
-            duplicate=previous_submission)
-
-        return (questionnaire,
-                party_objects, party_resources,
-                location_objects, location_resources,
-                tenure_objects, tenure_resources)
+    def get_submission(self, data):
+        """Returns the stored submission with the instance ID of the data,
+        if the submission was sent before."""
+        return XFormSubmission.objects.select_related(
+            'questionnaire__project'
+        ).filter(instanceID=data['meta']['instanceID']).first()
+
+    def check_for_duplicate_submission(self, data, submission):
+        """
+        Returns the resource names of the entities of a submission that was
+        sent before, so that the attachments sent with it again are linked
+        to the entities. The entities are looked up from the IDs recorded
+        with the submission, in the order they were created.
+        """
+        project = submission.questionnaire.project
+        entity_ids = submission.get_entity_ids()
+        if not entity_ids:
+            # Submissions stored before their entities were recorded
+            parties, party_resources = self.create_party(
+                data=data, project=project, duplicate=submission)
+            locations, location_resources = self.create_spatial_unit(
+                data=data, project=project, duplicate=submission)
+            tenures, tenure_resources = self.create_tenure_relationship(
+                data=data, project=project, parties=parties,
+                locations=locations, duplicate=submission)
+            return party_resources, location_resources, tenure_resources
+
+        party_ids = entity_ids.get('party', [])
+        location_ids = entity_ids.get('spatialunit', [])
+        tenure_ids = entity_ids.get('tenurerelationship', [])
+
+        party_resources = [
+            self._get_resource_names(group, party_id, 'party')
+            for group, party_id in zip(
+                self._format_repeat(data, ['party']), party_ids)]
+        location_resources = [
+            self._get_resource_names(group, location_id, 'location')
+            for group, location_id in zip(
+                self._format_repeat(data, ['location']), location_ids)]
+        tenure_resources = [
+            self._get_resource_names(group, tenure_id, 'tenure')
+            for (party_id, location_id, group), tenure_id in zip(
+                self._format_tenure_repeat(data, party_ids, location_ids),
+                tenure_ids)]
+        return party_resources, location_resources, tenure_resources
 
     def create_party(self, data, project, duplicate=None):
         party_objects = []
@@ -136,11 +166,11 @@ class ModelHelper():
                     project=project,
                     name=group['party_name'],
                     type=group['party_type'],
-                    attributes=self._get_attributes(group, 'party')
+                    attributes=self._get_attributes(group, 'party', project)
                 )
 
                 party_resources.append(
-                    self._get_resource_names(group, party, 'party')
+                    self._get_resource_names(group, party.id, 'party')
                 )
                 party_objects.append(party)
 
@@ -163,7 +193,8 @@ class ModelHelper():
                 attrs = dict(
                     project=project,
                     type=group['location_type'],
-                    attributes=self._get_attributes(group, 'location')
+                    attributes=self._get_attributes(
+                        group, 'location', project)
                 )
 
                 if duplicate:
@@ -178,7 +209,7 @@ class ModelHelper():
                                                           **attrs)
 
                 location_resources.append(
-                    self._get_resource_names(group, location, 'location')
+                    self._get_resource_names(group, location.id, 'location')
                 )
                 location_objects.append(location)
 
@@ -198,66 +229,79 @@ class ModelHelper():
             get_or_create_tenure_rels = TenureRelationship.objects.create
 
         try:
-            if data.get('tenure_type'):
-                tenure_group = [data]
-            else:
-                tenure_group = self._format_repeat(data, ['party', 'location'])
-
-            for p, party in enumerate(parties):
-                for l, location in enumerate(locations):
-                    t = 0
-                    if len(tenure_group) > 1:
-                        if p > l:
-                            t = p
-                        else:
-                            t = l
-                    tenure = get_or_create_tenure_rels(
-                        project=project,
-                        party=party,
-                        spatial_unit=location,
-                        tenure_type=tenure_group[t]['tenure_type'],
-                        attributes=self._get_attributes(
-                            tenure_group[t],
-                            'tenure_relationship')
-                    )
-                    tenure_objects.append(tenure)
-                    tenure_resources.append(
-                        self._get_resource_names(
-                            tenure_group[t], tenure, 'tenure')
-                    )
+            for party, location, group in self._format_tenure_repeat(
+                    data, parties, locations):
+                tenure = get_or_create_tenure_rels(
+                    project=project,
+                    party=party,
+                    spatial_unit=location,
+                    tenure_type=group['tenure_type'],
+                    attributes=self._get_attributes(
+                        group,
+                        'tenure_relationship',
+                        project)
+                )
+                tenure_objects.append(tenure)
+                tenure_resources.append(
+                    self._get_resource_names(group, tenure.id, 'tenure')
+                )
 
         except Exception as e:
             raise InvalidXMLSubmission(_(
                 "Tenure relationship error: {}".format(e)))
         return tenure_objects, tenure_resources
 
-    def create_resource(self, data, user, project, content_object=None):
-        Storage = get_storage_class()
-        file = data.file.read()
-        try:
-            if file == b'':
-                Resource.objects.get(
-                    name=data.name,
-                    contributor=user,
-                    mime_type=data.content_type,
-                    project=project,
-                    original_file=data.name
-                ).content_objects.create(
-                    content_object=content_object
-                )
-            else:
-                url = Storage().save('resources/' + data.name, file)
-                Resource.objects.create(
+    def spool_resource(self, data, user, project, content_object=None):
+        """
+        Validates an attachment of the submission and spools it to a local
+        file. The file is uploaded and its resource created by the
+        `xforms.ingest_attachments` task once the submission is committed,
+        so that the upload does not hold the submission's transaction open.
+
+        An empty file is an attachment that was uploaded with an earlier
+        copy of the submission. The task links the resource of that upload
+        instead, once it exists.
+        """
+        attachment = self.attachments.get(data.name)
+        if attachment is None:
+            attachment = {
+                'path': None,
+                'name': data.name,
+                'mime_type': data.content_type,
+                'resource_id': None,
+                'content_objects': [],
+            }
+            file = data.file.read()
+            if file != b'':
+                resource = Resource(
+                    id=random_id(),
                     name=data.name,
-                    file=url,
-                    content_object=content_object,
                     mime_type=data.content_type,
                     contributor=user,
                     project=project,
-                    original_file=data.name
-                ).full_clean()
-        except Exception as e:
-            raise InvalidXMLSubmission(_("{}".format(e)))
+                    original_file=data.name)
+                try:
+                    resource.full_clean(exclude=['file'])
+                except ValidationError as e:
+                    raise InvalidXMLSubmission(_("{}".format(e)))
+
+                path = os.path.join(ensure_dirs(), 'xform-' + resource.id)
+                with open(path, 'wb') as f:
+                    f.write(file)
+                attachment['path'] = path
+                attachment['resource_id'] = resource.id
+            self.attachments[data.name] = attachment
+
+        if content_object is not None:
+            attachment['content_objects'].append((
+                ContentType.objects.get_for_model(content_object).id,
+                content_object.id))
+
+    def discard_attachments(self):
+        for attachment in self.attachments.values():
+            if attachment['path'] and os.path.exists(attachment['path']):
+                os.remove(attachment['path'])
+        self.attachments.clear()
 
     def sanitize_submission(self, submission, sanitizable_questions):
         for key, value in submission.items():
@@ -273,67 +317,184 @@ class ModelHelper():
             questionnaire__version=version,
             type__in=['TX', 'NO']).values_list('name', flat=True)
 
+    def parse_submission(self, xml_file):
+        """
+        Parses a submission into the dict that pyxform's XFormToDict builds,
+        {root tag: submission}, in one pass over the XML. Answers to the
+        questions returned by `get_sanitizable_questions()` are sanitized as
+        they are read, and the elements of the XML tree are freed once they
+        are converted.
+        """
+        namespaces = None
+        sanitizable_questions = None
+        # (tag, value) of the converted elements whose parent is still open
+        converted = []
+
+        def strip_namespaces(name):
+            for namespace in namespaces:
+                name = name.replace(namespace, '')
+            return name
+
+        try:
+            for _event, element in etree.iterparse(
+                    xml_file, remove_comments=True, remove_pis=True):
+                if namespaces is None:
+                    root = element.getroottree().getroot()
+                    namespaces = ['{%s}' % uri for uri in root.nsmap.values()]
+                    sanitizable_questions = set(
+                        self.get_sanitizable_questions(
+                            root.get('id'), root.get('version')))
+
+                node = {strip_namespaces(name): value
+                        for name, value in element.items()}
+                if len(element):
+                    children = converted[-len(element):]
+                    del converted[-len(element):]
+                    for child, (tag, value) in zip(element, children):
+                        # Text between child elements
+                        if (isinstance(value, dict) and
+                                child.tail is not None and
+                                child.tail.strip() != ''):
+                            value['tail'] = child.tail
+                        if tag not in node:
+                            node[tag] = value
+                        elif isinstance(node[tag], list):
+                            node[tag].append(value)
+                        else:
+                            node[tag] = [node[tag], value]
+                    del element[:]
+
+                tag = strip_namespaces(element.tag)
+                text = element.text.strip() if element.text else ''
+                if node:
+                    if text:
+                        node['_text'] = text
+                    converted.append((tag, node))
+                else:
+                    if (tag in sanitizable_questions and
+                            not sanitize_string(text)):
+                        raise InvalidXMLSubmission(SANITIZE_ERROR)
+                    converted.append((tag, text))
+        except etree.XMLSyntaxError as e:
+            raise InvalidXMLSubmission(_('Invalid XML: {}').format(e))
+        return dict(converted)
+
     def upload_submission_data(self, request):
+        """
+        Creates the models of a submission and links its attachments to
+        them. Returns the submission, and whether it was created: a
+        submission that was sent before is looked up by its instance ID,
+        and only the attachments sent with it again are added.
+        """
         if 'xml_submission_file' not in request.data.keys():
             raise InvalidXMLSubmission(_('XML submission not found'))
 
-        xml_submission_file = request.data['xml_submission_file'].read()
-        full_submission = XFormToDict(
-            xml_submission_file.decode('utf-8')).get_dict()
-
+        full_submission = self.parse_submission(
+            request.data['xml_submission_file'])
         submission = full_submission[list(full_submission.keys())[0]]
 
-        sanitizable_questions = self.get_sanitizable_questions(
-            submission['id'], submission['version'])
-        self.sanitize_submission(submission, sanitizable_questions)
-
-        with transaction.atomic():
-            (questionnaire,
-             parties, party_resources,
-             locations, location_resources,
-             tenure_relationships, tenure_resources
-             ) = self.create_models(submission, request.user)
-
-            party_resource_files = []
-            for party in party_resources:
-                party_resource_files.extend(party['resources'])
-
-            location_resource_files = []
-            for location in location_resources:
-                location_resource_files.extend(location['resources'])
-
-            tenure_resource_files = []
-            for tenure in tenure_resources:
-                tenure_resource_files.extend(tenure['resources'])
-
-            resource_data = {
-                'project': questionnaire.project,
-                'location_resources': location_resource_files,
-                'locations': location_resources,
-                'party_resources': party_resource_files,
-                'parties': party_resources,
-                'tenure_resources': tenure_resource_files,
-                'tenures': tenure_resources,
-            }
-            self.upload_resource_files(request, resource_data)
-
-        if XFormSubmission.objects.filter(
-                instanceID=submission['meta']['instanceID']).exists():
-            return XFormSubmission.objects.get(
-                instanceID=submission['meta']['instanceID'])
-
-        xform_submission = XFormSubmission(
-            json_submission=full_submission,
-            user=request.user,
-            questionnaire=questionnaire,
-            instanceID=submission['meta']['instanceID']
-            )
-        return xform_submission, parties, locations, tenure_relationships
+        xform_submission = self.get_submission(submission)
+        if xform_submission is not None:
+            return self.upload_duplicate_submission(
+                request, submission, xform_submission), False
+
+        try:
+            with transaction.atomic():
+                (questionnaire,
+                 parties, party_resources,
+                 locations, location_resources,
+                 tenure_relationships, tenure_resources
+                 ) = self.create_models(submission, request.user)
+
+                self.upload_resources(request, questionnaire.project,
+                                      party_resources, location_resources,
+                                      tenure_resources)
+
+                xform_submission = XFormSubmission(
+                    json_submission=full_submission,
+                    user=request.user,
+                    questionnaire=questionnaire,
+                    instanceID=submission['meta']['instanceID']
+                )
+                xform_submission.save()
+                xform_submission.add_entities(
+                    parties, locations, tenure_relationships)
+        except IntegrityError:
+            # The submission was stored by another request in the meantime
+            xform_submission = self.get_submission(submission)
+            if xform_submission is None:
+                self.discard_attachments()
+                raise
+            # The attachments were already read and spooled. They are kept,
+            # and linked to the entities of the stored submission instead of
+            # the ones that were rolled back.
+            for attachment in self.attachments.values():
+                attachment['content_objects'] = []
+            return self.upload_duplicate_submission(
+                request, submission, xform_submission), False
+        except Exception:
+            self.discard_attachments()
+            raise
+
+        # The attachments are uploaded once the submission is committed
+        if self.attachments:
+            schedule_attachment_ingestion(
+                questionnaire.project, request.user,
+                list(self.attachments.values()))
+        return xform_submission, True
+
+    def upload_duplicate_submission(self, request, submission,
+                                    xform_submission):
+        project = xform_submission.questionnaire.project
+        self._check_perm(request.user, project)
+
+        # Retries of a submission without attachments need no more queries
+        if set(request.FILES.keys()) - {'xml_submission_file'}:
+            (party_resources, location_resources,
+             tenure_resources) = self.check_for_duplicate_submission(
+                submission, xform_submission)
+            try:
+                self.upload_resources(request, project,
+                                      party_resources, location_resources,
+                                      tenure_resources)
+            except Exception:
+                self.discard_attachments()
+                raise
+
+        if self.attachments:
+            schedule_attachment_ingestion(
+                project, request.user, list(self.attachments.values()))
+        return xform_submission
+
+    def upload_resources(self, request, project, party_resources,
+                         location_resources, tenure_resources):
+        party_resource_files = []
+        for party in party_resources:
+            party_resource_files.extend(party['resources'])
+
+        location_resource_files = []
+        for location in location_resources:
+            location_resource_files.extend(location['resources'])
+
+        tenure_resource_files = []
+        for tenure in tenure_resources:
+            tenure_resource_files.extend(tenure['resources'])
+
+        resource_data = {
+            'project': project,
+            'location_resources': location_resource_files,
+            'locations': location_resources,
+            'party_resources': party_resource_files,
+            'parties': party_resources,
+            'tenure_resources': tenure_resource_files,
+            'tenures': tenure_resources,
+        }
+        self.upload_resource_files(request, resource_data)
 
     def upload_resource_files(self, request, data):
         user = request.user
         files = request.FILES
-        files.pop('xml_submission_file')
+        files.pop('xml_submission_file', None)
         project = data['project']
         for file_name in files:
             args = [data, user, project, files, file_name]
@@ -351,11 +512,11 @@ class ModelHelper():
                     *args, 'tenures', TenureRelationship)
 
             else:
-                self.create_resource(data=files[file_name],
-                                     user=user,
-                                     project=project,
-                                     content_object=None
-                                     )
+                self.spool_resource(data=files[file_name],
+                                    user=user,
+                                    project=project,
+                                    content_object=None
+                                    )
 
     def _format_repeat(self, data, model_type):
         repeat_group = [data]
@@ -368,6 +529,24 @@ class ModelHelper():
 
         return repeat_group
 
+    def _format_tenure_repeat(self, data, parties, locations):
+        """Pairs each party with each location, together with the group of
+        the data that describes their tenure relationship."""
+        if data.get('tenure_type'):
+            tenure_group = [data]
+        else:
+            tenure_group = self._format_repeat(data, ['party', 'location'])
+
+        for p, party in enumerate(parties):
+            for l, location in enumerate(locations):
+                t = 0
+                if len(tenure_group) > 1:
+                    if p > l:
+                        t = p
+                    else:
+                        t = l
+                yield party, location, tenure_group[t]
+
     def _format_geometry(self, data):
         if 'location_geotrace' in data:
             geom = data['location_geotrace']
@@ -383,11 +562,11 @@ class ModelHelper():
             if file_name in obj['resources']:
                 content_object = model.objects.get(
                     id=obj['id'])
-                self.create_resource(data=files[file_name],
-                                     user=user,
-                                     project=project,
-                                     content_object=content_object
-                                     )
+                self.spool_resource(data=files[file_name],
+                                    user=user,
+                                    project=project,
+                                    content_object=content_object
+                                    )
 
     def _get_questionnaire(self, id_string, version):
         try:
@@ -397,7 +576,11 @@ class ModelHelper():
         except Questionnaire.DoesNotExist:
             raise InvalidXMLSubmission(_('Questionnaire not found.'))
 
-    def _get_attributes(self, data, model_type):
+    def _get_attributes(self, data, model_type, project):
+        attribute_types = get_attribute_types(
+            project.current_questionnaire
+        ).get(ATTRIBUTE_MODELS[model_type], {})
+
         attributes = {}
         for attr_group in data:
             if '{model}_attributes'.format(model=model_type) in attr_group:
@@ -408,22 +591,19 @@ class ModelHelper():
                            for model_type in ('tenure', 'location', 'party')):
                         continue
 
-                    if Attribute.objects.filter(
-                        name=item,
-                        attr_type=AttributeType.objects.get(
-                            name='select_multiple')).exists():
+                    if attribute_types.get(item) == 'select_multiple':
                         answers = data[attr_group][item].split(' ')
                         attributes[item] = answers
                     else:
                         attributes[item] = data[attr_group][item]
         return attributes
 
-    def _get_resource_names(self, data, model, model_type):
+    def _get_resource_names(self, data, model_id, model_type):
         group_name = '{}_attributes'.format(model_type)
         if model_type == 'tenure':
             group_name = 'tenure_relationship_attributes'
 
-        resources = {'id': model.id, 'resources': []}
+        resources = {'id': model_id, 'resources': []}
         # for legacy xlsforms
         if '{}_photo'.format(model_type) in data.keys():
             resources['resources'].append(data['{}_photo'.format(model_type)])
@@ -1,8 +1,9 @@
 import json
 import uuid
 from django.db import models
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.fields import JSONField
-from core.models import RandomIDModel
+from core.models import ID_FIELD_LENGTH, RandomIDModel
 from questionnaires.models import Questionnaire
 from accounts.models import User
 from spatial.models import SpatialUnit
@@ -16,7 +17,7 @@ class XFormSubmission(RandomIDModel):
         Questionnaire, null=False, related_name='submissions')
 
     instanceID = models.UUIDField(
-        primary_key=False, default=uuid.uuid4, editable=False)
+        primary_key=False, default=uuid.uuid4, editable=False, unique=True)
 
     spatial_units = models.ManyToManyField(
       SpatialUnit, related_name='xform_submissions',
@@ -34,6 +35,33 @@ class XFormSubmission(RandomIDModel):
     created_date = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
 
+    def add_entities(self, parties, spatial_units, tenure_relationships):
+        """Links the entities created from the submission to it, and records
+        them in the order they were created."""
+        self.parties.add(*parties)
+        self.spatial_units.add(*spatial_units)
+        self.tenure_relationships.add(*tenure_relationships)
+
+        entities = []
+        for objects in (parties, spatial_units, tenure_relationships):
+            for index, obj in enumerate(objects):
+                entities.append(XFormSubmissionEntity(
+                    submission=self,
+                    content_type=ContentType.objects.get_for_model(obj),
+                    object_id=obj.id,
+                    index=index))
+        XFormSubmissionEntity.objects.bulk_create(entities)
+
+    def get_entity_ids(self):
+        """Returns the IDs of the entities created from the submission, in
+        the order they were created, as {model name: [id, ...]}."""
+        entity_ids = {}
+        for content_type_id, object_id in self.entities.values_list(
+                'content_type_id', 'object_id'):
+            model = ContentType.objects.get_for_id(content_type_id).model
+            entity_ids.setdefault(model, []).append(object_id)
+        return entity_ids
+
     def __repr__(self):
         repr_string = ('<XFormSubmission id={obj.id}'
                        ' user={obj.user.username}'
@@ -50,3 +78,20 @@ class XFormSubmission(RandomIDModel):
                          parties=list(self.parties.all()),
                          tenure_relationships=list(
                             self.tenure_relationships.all()))
+
+
+class XFormSubmissionEntity(models.Model):
+    """
+    An entity created from a submission. A submission that is sent again
+    is linked to its entities through these, in the order the entities
+    were created from the submission.
+    """
+    submission = models.ForeignKey(
+        XFormSubmission, related_name='entities', on_delete=models.CASCADE)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=ID_FIELD_LENGTH)
+    index = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ('submission', 'content_type', 'index')
+        unique_together = ('submission', 'content_type', 'index')
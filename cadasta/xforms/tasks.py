@@ -0,0 +1,120 @@
+import logging
+import os
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import get_storage_class
+from django.db import DatabaseError, transaction
+
+from accounts.models import User
+from organization.models import Project
+from resources.exceptions import InvalidGPXFile
+from resources.models import ContentObject, Resource
+from tasks.celery import app
+
+logger = logging.getLogger(__name__)
+
+# Errors of the storage or the database, and resources of resent
+# attachments that are not ingested yet, after which the ingestion of the
+# attachments is retried
+RETRIED_ERRORS = (BotoCoreError, ClientError, DatabaseError, OSError,
+                  Resource.DoesNotExist)
+
+
+def link_attachment(attachment, user, project):
+    """Links the resource of an attachment that was uploaded with an
+    earlier copy of a submission to the entities of the attachment. Raises
+    Resource.DoesNotExist while the ingestion of the earlier copy is still
+    pending."""
+    resource = Resource.objects.filter(
+        name=attachment['name'],
+        contributor=user,
+        mime_type=attachment['mime_type'],
+        project=project,
+        original_file=attachment['name']).first()
+    if resource is None:
+        raise Resource.DoesNotExist(
+            "Resource {} does not exist.".format(attachment['name']))
+    for content_type_id, object_id in attachment['content_objects']:
+        ContentObject.objects.get_or_create(
+            resource=resource,
+            content_type_id=content_type_id,
+            object_id=object_id)
+
+
+def ingest_attachment(attachment, user, project):
+    """Uploads a spooled attachment of a submission and creates its resource
+    and the links to the resource's entities. Attachments whose resource
+    already exists are only cleaned up, so that the ingestion can be
+    retried. Attachments that are not valid resources are logged and
+    dropped, since retrying them would fail again."""
+    if attachment['path'] is None:
+        return link_attachment(attachment, user, project)
+
+    if not Resource.objects.filter(id=attachment['resource_id']).exists():
+        with open(attachment['path'], 'rb') as f:
+            url = get_storage_class()().save(
+                'resources/' + attachment['name'], File(f))
+
+        try:
+            with transaction.atomic():
+                resource = Resource(
+                    id=attachment['resource_id'],
+                    name=attachment['name'],
+                    mime_type=attachment['mime_type'],
+                    contributor=user,
+                    project=project,
+                    original_file=attachment['name'])
+                # Set after the instance is created, so that thumbnails are
+                # made for the new file although the resource already has
+                # its ID
+                resource.file = url
+                resource.save()
+                ContentObject.objects.bulk_create([
+                    ContentObject(resource=resource,
+                                  content_type_id=content_type_id,
+                                  object_id=object_id)
+                    for content_type_id, object_id
+                    in attachment['content_objects']
+                ])
+        except (InvalidGPXFile, ValidationError) as e:
+            logger.error("Attachment %s of a submission to project %s is "
+                         "not a valid resource: %s",
+                         attachment['name'], project.slug, e)
+
+    if os.path.exists(attachment['path']):
+        os.remove(attachment['path'])
+
+
+@app.task(name='xforms.ingest_attachments', bind=True,
+          max_retries=settings.XFORM_ATTACHMENT_MAX_RETRIES,
+          default_retry_delay=settings.XFORM_ATTACHMENT_RETRY_DELAY)
+def ingest_attachments(self, project_id, user_id, attachments):
+    project = Project.objects.get(id=project_id)
+    user = User.objects.get(id=user_id)
+    try:
+        for attachment in attachments:
+            ingest_attachment(attachment, user, project)
+    except RETRIED_ERRORS as e:
+        if self.request.called_directly:
+            raise
+        raise self.retry(exc=e)
+
+
+def schedule_attachment_ingestion(project, user, attachments):
+    """Schedules the ingestion of the attachments of a submission, which
+    are spooled to local files by `ModelHelper.spool_resource()`."""
+    payload = {
+        'project_id': project.id,
+        'user_id': user.id,
+        'attachments': attachments,
+    }
+    return ingest_attachments.apply_async(
+        kwargs=payload,
+        creator_id=user.id,
+        related_content_type_id=ContentType.objects.get_for_model(project).id,
+        related_object_id=project.id,
+    )
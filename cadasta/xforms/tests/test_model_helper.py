@@ -2,7 +2,8 @@ import os
 import io
 import pytest
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.core.exceptions import PermissionDenied
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.contrib.contenttypes.models import ContentType
@@ -20,7 +21,7 @@ from questionnaires.tests.factories import (QuestionnaireFactory,
                                             QuestionFactory,)
 
 from party.models import Party, TenureRelationship
-from organization.models import OrganizationRole
+from organization.models import OrganizationRole, ProjectRole
 from resources.models import Resource
 from spatial.models import SpatialUnit
 from xforms.models import XFormSubmission
@@ -91,6 +92,59 @@ class XFormModelHelperTest(TestCase):
         OrganizationRole.objects.create(
             user=self.user, organization=self.project.organization)
 
+    def test_parse_submission(self):
+        xml = (
+            '<?xml version="1.0" encoding="UTF-8" ?>'
+            '<a1 xmlns:orx="http://openrosa.org/xforms" id="a1" version="0">'
+            '  <!-- comment -->'
+            '  <title />'
+            '  <party_repeat>'
+            '    <party_name>Party One</party_name>'
+            '    <party_attributes><fname>true</fname></party_attributes>'
+            '  </party_repeat>'
+            '  <party_repeat>'
+            '    <party_name>Party Two</party_name>'
+            '  </party_repeat>'
+            '  <location_geometry type="point">1.0 2.0</location_geometry>'
+            '  <orx:meta>'
+            '    <orx:instanceID>uuid:b3f225d3</orx:instanceID>'
+            '  </orx:meta>'
+            '</a1>'
+        ).encode()
+        submission = mh().parse_submission(io.BytesIO(xml))
+        assert submission == {
+            'a1': {
+                'id': 'a1',
+                'version': '0',
+                'title': '',
+                'party_repeat': [
+                    {'party_name': 'Party One',
+                     'party_attributes': {'fname': 'true'}},
+                    {'party_name': 'Party Two'},
+                ],
+                'location_geometry': {'type': 'point', '_text': '1.0 2.0'},
+                'meta': {'instanceID': 'uuid:b3f225d3'},
+            }
+        }
+
+    def test_parse_submission_sanitizes_answers(self):
+        QuestionFactory.create(
+            name='party_name', type='TX', questionnaire=self.questionnaire)
+        xml = ('<a1 id="a1" version="0">'
+               '<party_repeat><party_name>Party One</party_name>'
+               '</party_repeat>'
+               '<party_repeat><party_name>=Party Two</party_name>'
+               '</party_repeat>'
+               '<meta><instanceID>uuid:b3f225d3</instanceID></meta>'
+               '</a1>').encode()
+        with pytest.raises(InvalidXMLSubmission) as e:
+            mh().parse_submission(io.BytesIO(xml))
+        assert str(e.value) == SANITIZE_ERROR
+
+    def test_parse_invalid_submission(self):
+        with pytest.raises(InvalidXMLSubmission):
+            mh().parse_submission(io.BytesIO(b'<a1 id="a1"><party_name>'))
+
     def test_sanitize_submission(self):
         geoshape = ('45.56342779158167 -122.67650283873081 0.0 0.0;'
                     '45.56176327330353 -122.67669159919024 0.0 0.0;'
@@ -329,8 +383,7 @@ class XFormModelHelperTest(TestCase):
             'tenure_resource_photo': 'resource_three.png'
         }
 
-        assert not mh.check_for_duplicate_submission(
-            mh(), data, self.questionnaire)
+        assert mh().get_submission(data) is None
 
         party1 = PartyFactory.create(
             project=self.project,
@@ -388,19 +441,27 @@ class XFormModelHelperTest(TestCase):
         xform.spatial_units.add(su)
         xform.tenure_relationships.add(*[tenure1, tenure2])
 
-        additional_resources = mh.check_for_duplicate_submission(
-            mh(), data, self.questionnaire)
+        assert mh().get_submission(data) == xform
 
-        (questionnaire,
-         parties, party_resources,
-         locations, location_resources,
-         tenure_relationships, tenure_resources) = additional_resources
+        # Submissions stored before their entities were recorded
+        resources = mh.check_for_duplicate_submission(mh(), data, xform)
+        self._test_duplicate_resources(resources, party1, party2, su,
+                                       tenure1, tenure2)
+
+        xform.add_entities([party1, party2], [su], [tenure1, tenure2])
+        xform = mh().get_submission(data)
+        with self.assertNumQueries(1):
+            resources = mh.check_for_duplicate_submission(mh(), data, xform)
+        self._test_duplicate_resources(resources, party1, party2, su,
+                                       tenure1, tenure2)
 
         assert Party.objects.all().count() == 2
         assert SpatialUnit.objects.all().count() == 1
         assert TenureRelationship.objects.all().count() == 2
 
-        assert questionnaire == self.questionnaire
+    def _test_duplicate_resources(self, resources, party1, party2, su,
+                                  tenure1, tenure2):
+        party_resources, location_resources, tenure_resources = resources
 
         assert party_resources[0]['id'] == party1.id
         assert party_resources[0]['resources'] == ['sad_birthday.png',
@@ -1227,70 +1288,31 @@ class XFormModelHelperTest(TestCase):
                 mh(), data, [party], [location4, location5], self.project)
         assert TenureRelationship.objects.count() == 0
 
-    def test_create_resource(self):
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # test attaching resources
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~
-        with open(path +
-                  '/xforms/tests/files/test_image_one.png', 'rb') as src:
-            file = src.read()
-
+    def test_spool_resource_uploaded_before(self):
         data = InMemoryUploadedFile(
-            file=io.BytesIO(file),
+            file=io.BytesIO(b''),
             field_name='test_image_one',
-            name='{}.png'.format('test_image_one'),
+            name='test_image_one.png',
             content_type='image/png',
-            size=len(file),
+            size=0,
             charset='utf-8',
         )
         party = PartyFactory.create(project=self.project)
-        mh.create_resource(
-            self, data, self.user, self.project, content_object=party)
-        assert len(party.resources) == 1
-        resource = Resource.objects.get(name='test_image_one.png')
-        assert resource in party.resources
-
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # test attaching existing resources
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~
-        party2 = PartyFactory.create(project=self.project)
-        mh.create_resource(
-            self, data, self.user, self.project, content_object=party2)
-
-        assert Resource.objects.count() == 1
-        assert len(party2.resources) == 1
-        assert resource in party2.resources
-
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # test without content object
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~
-        with open(path +
-                  '/xforms/tests/files/test_image_two.png', 'rb') as src:
-            file = src.read()
-
-        data = InMemoryUploadedFile(
-            file=io.BytesIO(file),
-            field_name='test_image_two',
-            name='{}.png'.format('test_image_two'),
-            content_type='image/png',
-            size=len(file),
-            charset='utf-8',
-        )
-
-        mh.create_resource(
-            self, data, self.user, self.project, content_object=None)
-
-        assert Resource.objects.count() == 2
-        resource = Resource.objects.get(name='test_image_two.png')
-        assert resource.content_objects.count() == 0
-
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # test failing
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~
-        with pytest.raises(InvalidXMLSubmission):
-            mh.create_resource(
-                self, data, self.user, self.project, content_object='ardvark')
-        assert Resource.objects.count() == 2
+        helper = mh()
+        # The resource is looked up by the ingestion task, since it may not
+        # be ingested yet
+        helper.spool_resource(data, self.user, self.project, party)
+        assert helper.attachments['test_image_one.png'] == {
+            'path': None,
+            'name': 'test_image_one.png',
+            'mime_type': 'image/png',
+            'resource_id': None,
+            'content_objects': [
+                (ContentType.objects.get_for_model(Party).id, party.id)],
+        }
+        assert Resource.objects.count() == 0
+        helper.discard_attachments()
+        assert helper.attachments == {}
 
     def test_format_repeat(self):
         data = {
@@ -1408,13 +1430,60 @@ class XFormModelHelperTest(TestCase):
             'locations': [{'id': '1234', 'resources': ['not_created.png']}]
         }
 
-        mh()._format_create_resource(data, self.user, self.project,
-                                     files, file_name,
-                                     'parties', Party)
+        helper = mh()
+        helper._format_create_resource(data, self.user, self.project,
+                                       files, file_name,
+                                       'parties', Party)
+
+        assert Resource.objects.all().count() == 0
+        attachment = helper.attachments[file_name]
+        assert attachment['content_objects'] == [
+            (ContentType.objects.get_for_model(Party).id, party.id)]
+        with open(attachment['path'], 'rb') as spooled:
+            assert spooled.read() == file
 
-        assert Resource.objects.all().count() == 1
-        resource = Resource.objects.get(name='test_image_two.png')
-        assert resource in party.resources.all()
+        helper.discard_attachments()
+        assert not os.path.exists(attachment['path'])
+        assert helper.attachments == {}
+
+    def test_spool_resource(self):
+        with open(path +
+                  '/xforms/tests/files/test_image_one.png', 'rb') as src:
+            file = src.read()
+        data = InMemoryUploadedFile(
+            file=io.BytesIO(file),
+            field_name='test_image_one',
+            name='test_image_one.png',
+            content_type='image/png',
+            size=len(file),
+            charset='utf-8',
+        )
+        party = PartyFactory.create(project=self.project)
+        party2 = PartyFactory.create(project=self.project)
+        helper = mh()
+        helper.spool_resource(data, self.user, self.project, party)
+        helper.spool_resource(data, self.user, self.project, party2)
+        helper.spool_resource(data, self.user, self.project)
+
+        assert list(helper.attachments) == ['test_image_one.png']
+        attachment = helper.attachments['test_image_one.png']
+        assert attachment['mime_type'] == 'image/png'
+        assert [object_id for _, object_id
+                in attachment['content_objects']] == [party.id, party2.id]
+        helper.discard_attachments()
+
+        data = InMemoryUploadedFile(
+            file=io.BytesIO(b'<html></html>'),
+            field_name='test_bad_resource',
+            name='test_bad_resource.html',
+            content_type='text/html',
+            size=13,
+            charset='utf-8',
+        )
+        with pytest.raises(InvalidXMLSubmission) as e:
+            helper.spool_resource(data, self.user, self.project)
+        assert 'mime_type' in str(e.value)
+        assert helper.attachments == {}
 
     def test_get_questionnaire(self):
         questionnaire = mh._get_questionnaire(
@@ -1438,7 +1507,7 @@ class XFormModelHelperTest(TestCase):
             },
             'party_name': 'House Party'
         }
-        attributes = mh._get_attributes(self, data, 'party')
+        attributes = mh._get_attributes(self, data, 'party', self.project)
 
         assert attributes['name_indv'] == 'Party Indv Attrs'
         assert attributes['type_indv'] == 'Party for one'
@@ -1447,6 +1516,33 @@ class XFormModelHelperTest(TestCase):
         assert 'party_name' not in attributes
         assert 'party_type' not in attributes
 
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    def test_get_attributes_select_multiple(self):
+        cache.clear()
+        schema = Schema.objects.get(
+            content_type__model='party',
+            selectors=[self.project.organization.id, self.project.id, 'a1'])
+        Attribute.objects.create(
+            schema=schema,
+            name='occupations', long_name='Occupations',
+            attr_type=AttributeType.objects.get(name='select_multiple'),
+            index=2, choices=['farmer', 'fisher'],
+            required=False, omit=False
+        )
+        data = {
+            'party_attributes': {'occupations': 'farmer fisher'},
+            'location_attributes': {'occupations': 'farmer fisher'},
+        }
+        attributes = mh._get_attributes(self, data, 'party', self.project)
+        assert attributes['occupations'] == ['farmer', 'fisher']
+
+        with self.assertNumQueries(0):
+            attributes = mh._get_attributes(
+                self, data, 'location', self.project)
+        assert attributes['occupations'] == 'farmer fisher'
+
     def test_get_resource_names(self):
         data = {
             'party_type': 'Party Type',
@@ -1455,7 +1551,7 @@ class XFormModelHelperTest(TestCase):
             'tenure_resource_thing': 'Tenure Resource Thing',
         }
         model = PartyFactory.create()
-        resources = mh._get_resource_names(self, data, model, 'party')
+        resources = mh._get_resource_names(self, data, model.id, 'party')
         assert resources['id'] == model.id
         assert 'Party Photo' in resources['resources']
         assert 'Party Resource Thing' in resources['resources']
@@ -1478,6 +1574,27 @@ class XFormModelHelperTest(TestCase):
         except PermissionDenied:
             self.fail("PermissionDenied raised unexpectedly")
 
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    })
+    def test_check_perm_is_cached(self):
+        cache.clear()
+        role = ProjectRole.objects.create(
+            user=self.user, project=self.project, role='DC')
+        mh._check_perm(mh, self.user, self.project)
+        with self.assertNumQueries(0):
+            mh._check_perm(mh, self.user, self.project)
+
+        role.role = 'PU'
+        role.save()
+        with pytest.raises(PermissionDenied):
+            mh._check_perm(mh, self.user, self.project)
+
+        role.delete()
+        ProjectRole.objects.create(
+            user=self.user, project=self.project, role='PM')
+        mh._check_perm(mh, self.user, self.project)
+
     def test_get_sanitizable_questions(self):
         QuestionFactory.create(
             name='text',
@@ -1,7 +1,11 @@
 from json import dumps
+from django.db import IntegrityError
 from django.test import TestCase
 from accounts.tests.factories import UserFactory
+from organization.tests.factories import ProjectFactory
+from party.tests.factories import PartyFactory, TenureRelationshipFactory
 from questionnaires.tests.factories import QuestionnaireFactory
+from spatial.tests.factories import SpatialUnitFactory
 from ..models import XFormSubmission
 
 
@@ -25,3 +29,41 @@ class XFormSubmissionTest(TestCase):
                                     ' tenure_relationships=[]>'
                                     ).format(json=dumps(json),
                                              instance=instanceID)
+
+    def test_instance_id_is_unique(self):
+        user = UserFactory.create()
+        questionnaire = QuestionnaireFactory.create()
+        instanceID = '19f004e7-d16f-49d0-abcc-a73762c6d102'
+        XFormSubmission.objects.create(user=user,
+                                       questionnaire=questionnaire,
+                                       instanceID=instanceID)
+        with self.assertRaises(IntegrityError):
+            XFormSubmission.objects.create(user=user,
+                                           questionnaire=questionnaire,
+                                           instanceID=instanceID)
+
+    def test_add_entities(self):
+        project = ProjectFactory.create()
+        party1 = PartyFactory.create(project=project)
+        party2 = PartyFactory.create(project=project)
+        su = SpatialUnitFactory.create(project=project)
+        tenure1 = TenureRelationshipFactory.create(
+            project=project, party=party1, spatial_unit=su)
+        tenure2 = TenureRelationshipFactory.create(
+            project=project, party=party2, spatial_unit=su)
+        submission = XFormSubmission.objects.create(
+            user=UserFactory.create(),
+            questionnaire=QuestionnaireFactory.create(project=project))
+
+        submission.add_entities([party2, party1], [su], [tenure1, tenure2])
+
+        assert set(submission.parties.all()) == {party1, party2}
+        assert list(submission.spatial_units.all()) == [su]
+        assert set(submission.tenure_relationships.all()) == {tenure1,
+                                                              tenure2}
+        with self.assertNumQueries(1):
+            assert submission.get_entity_ids() == {
+                'party': [party2.id, party1.id],
+                'spatialunit': [su.id],
+                'tenurerelationship': [tenure1.id, tenure2.id],
+            }
@@ -0,0 +1,161 @@
+import os
+from unittest.mock import patch
+
+import pytest
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from celery import Task
+
+from accounts.tests.factories import UserFactory
+from core.tests.utils.cases import StreamingFakeS3Storage
+from core.tests.utils.files import make_dirs  # noqa
+from core.util import random_id
+from organization.tests.factories import ProjectFactory
+from party.models import Party
+from party.tests.factories import PartyFactory
+from resources.models import Resource
+from resources.tests.utils import clear_temp  # noqa
+from resources.utils.io import ensure_dirs
+
+from ..tasks import ingest_attachments, schedule_attachment_ingestion
+
+path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.usefixtures('clear_temp')
+@pytest.mark.usefixtures('make_dirs')
+class IngestAttachmentsTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = UserFactory.create()
+        self.project = ProjectFactory.create()
+        self.party = PartyFactory.create(project=self.project)
+        patcher = patch('xforms.tasks.get_storage_class',
+                        return_value=StreamingFakeS3Storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def spool(self, name, src_path=None, mime_type='image/png'):
+        spooled = os.path.join(ensure_dirs(), 'xform-' + random_id())
+        src_path = src_path or os.path.join(path, 'tests/files', name)
+        with open(src_path, 'rb') as src:
+            with open(spooled, 'wb') as dst:
+                dst.write(src.read())
+        return {
+            'path': spooled,
+            'name': name,
+            'mime_type': mime_type,
+            'resource_id': random_id(),
+            'content_objects': [
+                (ContentType.objects.get_for_model(Party).id,
+                 self.party.id)],
+        }
+
+    def test_ingest_attachments(self):
+        assert isinstance(ingest_attachments, Task)
+        assert ingest_attachments.name == 'xforms.ingest_attachments'
+
+        attachments = [self.spool('test_image_one.png'),
+                       self.spool('test_image_two.png')]
+        kwargs = {'project_id': self.project.id,
+                  'user_id': self.user.id,
+                  'attachments': attachments}
+        ingest_attachments(**kwargs)
+
+        resources = Resource.objects.filter(project=self.project)
+        assert sorted(resources.values_list('id', flat=True)) == sorted(
+            attachment['resource_id'] for attachment in attachments)
+        for resource in resources:
+            assert resource in self.party.resources
+            assert resource.contributor == self.user
+            assert resource.file.url
+        assert not any(os.path.exists(attachment['path'])
+                       for attachment in attachments)
+
+        # Ingesting the attachments again changes nothing
+        ingest_attachments(**kwargs)
+        assert Resource.objects.filter(project=self.project).count() == 2
+        assert len(self.party.resources) == 2
+
+    def test_ingest_attachments_again_after_failure(self):
+        attachments = [self.spool('test_image_one.png'),
+                       self.spool('test_image_two.png')]
+        missing = dict(attachments[1], path=attachments[1]['path'] + '-x')
+        kwargs = {'project_id': self.project.id,
+                  'user_id': self.user.id,
+                  'attachments': [attachments[0], missing]}
+        with pytest.raises(FileNotFoundError):
+            ingest_attachments(**kwargs)
+        assert Resource.objects.filter(project=self.project).count() == 1
+
+        kwargs['attachments'] = attachments
+        ingest_attachments(**kwargs)
+        assert Resource.objects.filter(project=self.project).count() == 2
+        assert len(self.party.resources) == 2
+
+    def test_ingest_invalid_attachment(self):
+        invalid = self.spool(
+            'invalidgpx.xml',
+            src_path=os.path.join(os.path.dirname(settings.BASE_DIR),
+                                  'resources/tests/files/invalidgpx.xml'),
+            mime_type='application/xml')
+        valid = self.spool('test_image_one.png')
+        # Raises nothing, so that the task is not retried
+        ingest_attachments(project_id=self.project.id,
+                           user_id=self.user.id,
+                           attachments=[invalid, valid])
+
+        assert list(Resource.objects.filter(
+            project=self.project).values_list('id', flat=True)) == [
+            valid['resource_id']]
+        assert not os.path.exists(invalid['path'])
+        assert not os.path.exists(valid['path'])
+
+    def test_link_attachments(self):
+        attachment = self.spool('test_image_one.png')
+        resent = dict(attachment, path=None, resource_id=None)
+        party = PartyFactory.create(project=self.project)
+        resent['content_objects'] = [
+            (ContentType.objects.get_for_model(Party).id, party.id)]
+
+        # The attachment is resent before the first copy is ingested
+        with pytest.raises(Resource.DoesNotExist):
+            ingest_attachments(project_id=self.project.id,
+                               user_id=self.user.id,
+                               attachments=[resent])
+
+        ingest_attachments(project_id=self.project.id,
+                           user_id=self.user.id,
+                           attachments=[attachment, resent])
+        resource = Resource.objects.get(project=self.project)
+        assert resource.id == attachment['resource_id']
+        assert resource in self.party.resources
+        assert resource in party.resources
+
+        # Linking the attachment again changes nothing
+        ingest_attachments(project_id=self.project.id,
+                           user_id=self.user.id,
+                           attachments=[resent])
+        assert resource.content_objects.count() == 2
+
+    @patch('xforms.tasks.ingest_attachments')
+    def test_schedule_attachment_ingestion(self, ingest_task):
+        project = ProjectFactory.build(id='abcd')
+        user = UserFactory.build(id=123)
+        attachments = [{'path': '/tmp/xform-abc', 'name': 'photo.png'}]
+
+        schedule_attachment_ingestion(project, user, attachments)
+
+        ingest_task.apply_async.assert_called_once_with(
+            kwargs={
+                'project_id': project.id,
+                'user_id': user.id,
+                'attachments': attachments,
+            },
+            creator_id=user.id,
+            related_content_type_id=ContentType.objects.get_for_model(
+                project).id,
+            related_object_id=project.id,
+        )
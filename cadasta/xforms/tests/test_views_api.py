@@ -1,5 +1,6 @@
 import json
 import io
+from unittest.mock import patch
 
 import pytest
 from lxml import etree
@@ -12,7 +13,8 @@ from tutelary.models import Policy
 
 from accounts.tests.factories import UserFactory
 from core.messages import SANITIZE_ERROR
-from core.tests.utils.cases import UserTestCase, FileStorageTestCase
+from core.tests.utils.cases import (UserTestCase, FileStorageTestCase,
+                                    StreamingFakeS3Storage)
 from core.tests.utils.files import make_dirs  # noqa
 from organization.models import OrganizationRole
 from organization.tests.factories import OrganizationFactory, ProjectFactory
@@ -26,6 +28,7 @@ from spatial.models import SpatialUnit
 from tutelary.models import Role
 from xforms.tests.files.test_resources import responses
 from xforms.models import XFormSubmission
+from xforms.tasks import ingest_attachments
 
 from ..views import api
 from .attr_schemas import (default_party_xform_group,
@@ -116,11 +119,28 @@ class XFormListTest(APITestCase, UserTestCase, FileStorageTestCase, TestCase):
         assert 'hash' not in response
 
 
+def run_ingestion_locally(kwargs, **options):
+    """Stands in for the broker by running attachment ingestion tasks in the
+    test process."""
+    return ingest_attachments.apply(kwargs=kwargs)
+
+
 class XFormSubmissionTest(APITestCase, UserTestCase, FileStorageTestCase,
                           TestCase):
     view_class = api.XFormSubmissionViewSet
     viewset_actions = {'post': 'create', 'head': 'create'}
 
+    def setUp(self):
+        super().setUp()
+        patcher = patch('xforms.tasks.ingest_attachments.apply_async',
+                        side_effect=run_ingestion_locally)
+        self.scheduled_ingestion = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('xforms.tasks.get_storage_class',
+                        return_value=StreamingFakeS3Storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def setup_models(self):
         self.user = UserFactory.create()
         self.org = OrganizationFactory.create()
@@ -267,12 +287,72 @@ class XFormSubmissionTest(APITestCase, UserTestCase, FileStorageTestCase,
         self._test_resource('test_image_two', party)
         self._test_resource('test_audio_one', party)
         self._test_resource('test_image_three', tenure)
+        assert self.scheduled_ingestion.call_count == 1
 
         response = XFormSubmission.objects.get(user=self.user)
         assert response.questionnaire == questionnaire
         assert ('Bilbo Baggins' in
                 response.json_submission['t_questionnaire']['party_name'])
 
+    def test_submission_upload_again(self):
+        self._create_questionnaire('t_questionnaire', 0)
+        data = self._submission(form='submission_line')
+        response = self.request(method='POST', user=self.user, post_data=data,
+                                content_type='multipart/form-data')
+        assert response.status_code == 201
+        submission = XFormSubmission.objects.get(user=self.user)
+        assert submission.get_entity_ids() == {
+            'party': [Party.objects.get().id],
+            'spatialunit': [SpatialUnit.objects.get().id],
+            'tenurerelationship': [TenureRelationship.objects.get().id]}
+
+        data = self._submission(form='submission_line')
+        response = self.request(method='POST', user=self.user, post_data=data,
+                                content_type='multipart/form-data')
+        assert response.status_code == 201
+        assert XFormSubmission.objects.get(user=self.user) == submission
+        assert Party.objects.count() == 1
+        assert SpatialUnit.objects.count() == 1
+        assert TenureRelationship.objects.count() == 1
+        assert submission.entities.count() == 3
+
+    def test_submission_upload_again_concurrently(self):
+        self._create_questionnaire('t_questionnaire', 0)
+        files = {'image': ['test_image_one', 'test_image_two',
+                           'test_image_three'],
+                 'audio': ['test_audio_one']}
+        data = self._submission(form='submission', **files)
+        response = self.request(method='POST', user=self.user, post_data=data,
+                                content_type='multipart/form-data')
+        assert response.status_code == 201
+        submission = XFormSubmission.objects.get(user=self.user)
+
+        # The submission is stored by another request after it is looked
+        # up, so that saving it again violates the unique instance ID
+        data = self._submission(form='submission', **files)
+        with patch('xforms.mixins.model_helper.ModelHelper.get_submission',
+                   side_effect=[None, submission]):
+            response = self.request(method='POST', user=self.user,
+                                    post_data=data,
+                                    content_type='multipart/form-data')
+        assert response.status_code == 201
+        assert XFormSubmission.objects.count() == 1
+        assert Party.objects.count() == 1
+        assert SpatialUnit.objects.count() == 1
+        assert TenureRelationship.objects.count() == 1
+        assert self.scheduled_ingestion.call_count == 2
+
+        party = Party.objects.get()
+        location = SpatialUnit.objects.get()
+        tenure = TenureRelationship.objects.get()
+        for name, model in [('test_image_one.png', location),
+                            ('test_image_two.png', party),
+                            ('test_audio_one.mp3', party),
+                            ('test_image_three.png', tenure)]:
+            resources = Resource.objects.filter(name=name)
+            assert resources.count() == 2
+            assert all(resource in model.resources for resource in resources)
+
     def test_line_upload(self):
         self._create_questionnaire('t_questionnaire', 0)
         data = self._submission(form='submission_line')
@@ -419,6 +499,7 @@ class XFormSubmissionTest(APITestCase, UserTestCase, FileStorageTestCase,
         assert len(Party.objects.all()) == 0
         assert len(SpatialUnit.objects.all()) == 0
         assert len(Resource.objects.all()) == 0
+        assert self.scheduled_ingestion.called is False
 
     def test_anonymous_user(self):
         self._create_questionnaire('t_questionnaire', 0)
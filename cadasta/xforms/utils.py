@@ -14,39 +14,53 @@ class InvalidODKGeometryError(Exception):
         return _("Invalid ODK Geometry: %s" % str(self.error))
 
 
+def parse_odk_geom(coords):
+    """Parses a non-empty geometry in ODK format into the name of its
+    geometry type and its (x, y) points."""
+    coords = coords.replace('\n', '')
+    coords = coords.split(';')
+    coords = [c.strip() for c in coords]
+    if (coords[-1] == ''):
+        coords.pop()
+
+    if len(coords) > 1:
+        # check for a geoshape taking into account
+        # the bug in odk where the second coordinate in a geoshape
+        # is the same as the last (first and last should be equal)
+        if len(coords) > 3:
+            if coords[1] == coords[-1]:  # geom is closed
+                coords.pop()
+                coords.append(coords[0])
+        points = []
+        for coord in coords:
+            coord = coord.split(' ')
+            coord = [x for x in coord if x]
+            latlng = [float(coord[1]),
+                      float(coord[0])]
+            points.append(tuple(latlng))
+        if (coords[0] != coords[-1] or len(coords) == 2):
+            return 'LineString', points
+        else:
+            return 'Polygon', points
+    else:
+        latlng = coords[0].split(' ')
+        latlng = [x for x in latlng if x]
+        return 'Point', [(float(latlng[1]), float(latlng[0]))]
+
+
+ODK_GEOMETRY_TYPES = {
+    'Point': lambda points: Point(*points[0]),
+    'LineString': LineString,
+    'Polygon': Polygon,
+}
+
+
 def odk_geom_to_wkt(coords):
     """Convert geometries in ODK format to WKT."""
     try:
         if coords == '':
             return ''
-        coords = coords.replace('\n', '')
-        coords = coords.split(';')
-        coords = [c.strip() for c in coords]
-        if (coords[-1] == ''):
-            coords.pop()
-
-        if len(coords) > 1:
-            # check for a geoshape taking into account
-            # the bug in odk where the second coordinate in a geoshape
-            # is the same as the last (first and last should be equal)
-            if len(coords) > 3:
-                if coords[1] == coords[-1]:  # geom is closed
-                    coords.pop()
-                    coords.append(coords[0])
-            points = []
-            for coord in coords:
-                coord = coord.split(' ')
-                coord = [x for x in coord if x]
-                latlng = [float(coord[1]),
-                          float(coord[0])]
-                points.append(tuple(latlng))
-            if (coords[0] != coords[-1] or len(coords) == 2):
-                return dumps(LineString(points))
-            else:
-                return dumps(Polygon(points))
-        else:
-            latlng = coords[0].split(' ')
-            latlng = [x for x in latlng if x]
-            return dumps(Point(float(latlng[1]), float(latlng[0])))
+        geom_type, points = parse_odk_geom(coords)
+        return dumps(ODK_GEOMETRY_TYPES[geom_type](points))
     except Exception as e:
         raise InvalidODKGeometryError(e)
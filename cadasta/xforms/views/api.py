@@ -1,20 +1,18 @@
 import logging
 
 from django.core.exceptions import PermissionDenied
+from django.db.models import F
 from django.shortcuts import get_object_or_404
-from django.utils.six import BytesIO
 from django.utils.translation import ugettext as _
 from questionnaires.models import Questionnaire
 from rest_framework import status, viewsets, generics
 from rest_framework.authentication import BasicAuthentication
-from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.renderers import JSONRenderer
 from rest_framework.renderers import StaticHTMLRenderer
 from rest_framework.response import Response
 from tutelary.models import Role
 from tutelary.mixins import APIPermissionRequiredMixin
-from xforms.models import XFormSubmission
 from xforms.mixins.model_helper import ModelHelper
 from xforms.mixins.openrosa_headers_mixin import OpenRosaHeadersMixin
 from xforms.renderers import XFormListRenderer
@@ -47,7 +45,8 @@ class XFormSubmissionViewSet(OpenRosaHeadersMixin, viewsets.GenericViewSet):
             return Response(headers=self.get_openrosa_headers(request),
                             status=status.HTTP_204_NO_CONTENT,)
         try:
-            instance = ModelHelper().upload_submission_data(request)
+            instance, created = ModelHelper().upload_submission_data(
+                request)
         except InvalidXMLSubmission as e:
             logger.exception(str(e))
             return self._sendErrorResponse(request, e,
@@ -58,34 +57,19 @@ class XFormSubmissionViewSet(OpenRosaHeadersMixin, viewsets.GenericViewSet):
 
         # If an already existing XFormSummission is sent back
         # don't create another.
-        if type(instance) == XFormSubmission:
+        if not created:
             return Response(
                 headers=self.get_openrosa_headers(request),
                 status=status.HTTP_201_CREATED,
                 content_type=self.DEFAULT_CONTENT_TYPE
             )
 
-        instance, parties, locations, tenure_relationships = instance
-        serializer = XFormSubmissionSerializer(instance)
-
-        json = JSONRenderer().render(serializer.data)
-        stream = BytesIO(json)
-        data = JSONParser().parse(stream)
-        serializer = XFormSubmissionSerializer(data=data)
-
-        # Every possible error that would make the serializer not valid
-        # has already been checked for, so no failsafe is necessary.
-        if serializer.is_valid():
-            data = serializer.save()
-            data.parties.add(*parties)
-            data.spatial_units.add(*locations)
-            data.tenure_relationships.add(*tenure_relationships)
-            success_msg = _("Form was Successfully Received")
-            return self._formatMessageResponse(
-                request,
-                success_msg,
-                status.HTTP_201_CREATED
-            )
+        success_msg = _("Form was Successfully Received")
+        return self._formatMessageResponse(
+            request,
+            success_msg,
+            status.HTTP_201_CREATED
+        )
 
     def _sendErrorResponse(self, request, e, status):
         return self._formatMessageResponse(request, e, status)
@@ -121,22 +105,15 @@ class XFormListView(OpenRosaHeadersMixin,
         return context
 
     def get_user_forms(self):
-        forms = []
         policies = self.request.user.assigned_policies()
-        orgs = self.request.user.organizations.filter(archived=False)
-        if Role.objects.get(name='superuser') in policies:
+        if any(isinstance(policy, Role) and policy.name == 'superuser'
+               for policy in policies):
             return Questionnaire.objects.filter(project__archived=False)
-        for org in orgs:
-            projects = org.projects.filter(archived=False)
-            for project in projects:
-                try:
-                    questionnaire = Questionnaire.objects.get(
-                        id=project.current_questionnaire
-                    )
-                    forms.append(questionnaire)
-                except Questionnaire.DoesNotExist:
-                    pass
-        return forms
+        return Questionnaire.objects.filter(
+            project__organization__in=self.request.user.organizations.filter(
+                archived=False),
+            project__archived=False,
+            id=F('project__current_questionnaire'))
 
     def get_queryset(self):
         return self.get_user_forms()